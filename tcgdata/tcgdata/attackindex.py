@@ -0,0 +1,225 @@
+''' Sorted, array backed index of attack damage, attack energy cost and HP
+for numeric range queries
+'''
+import argparse
+import bisect
+import re
+import tcgdata.indexfile as indexfile
+
+# Bump when the file format or damage parsing changes
+INDEX_VERSION = 2
+
+# Default index file, written by loadcards --attackindex and
+# buildattackindex
+ATTACK_INDEX_FILE = 'attackindex.json'
+
+# Damage modifier symbols, 'x' is written for '×' on some cards
+DAMAGE_MODIFIERS = {'+': '+', '-': '-', '×': '×', 'x': '×'}
+
+
+def main():
+    indexfile.build_main(AttackIndex, 'Build the attack damage, cost and HP '
+                         'index from the card files', ATTACK_INDEX_FILE)
+
+
+def parse_damage(damage):
+    """ Return (base damage, modifier) of an attack's damage text, e.g.
+    '30×' -> (30, '×'), '20+' -> (20, '+'), '120' -> (120, None) and
+    (None, None) if there's no number
+    """
+    match = re.match(r'\s*(\d+)\s*([-+×x]?)\s*$', damage or '')
+    if not match:
+        return None, None
+    return int(match.group(1)), DAMAGE_MODIFIERS.get(match.group(2))
+
+
+def damage_fields(attack):
+    """ {'damageBase': int, 'damageModifier': symbol} for an attack, without
+    the fields it has no value for
+    """
+    base, modifier = parse_damage(attack.get('damage'))
+    fields = {}
+    if base is not None:
+        fields['damageBase'] = base
+    if modifier:
+        fields['damageModifier'] = modifier
+    return fields
+
+
+def attack_cost(attack):
+    """ convertedEnergyCost of an attack, counted from its cost if need be """
+    if attack.get('convertedEnergyCost') is not None:
+        return int(attack['convertedEnergyCost'])
+    return len([energy for energy in attack.get('cost') or []
+                if energy != 'Free'])
+
+
+def card_hp(card):
+    """ a card's HP as an int, None if it has none """
+    hp = str(card.get('hp') or '')
+    return int(hp) if hp.isdigit() else None
+
+
+def parse_range(text):
+    """ argparse type for 'MIN:MAX' ranges, either end may be left out and
+    'N' is N:N, e.g. '130:' -> [130, None]
+    """
+    low, colon, high = text.partition(':')
+    try:
+        low = int(low) if low.strip() else None
+        high = int(high) if high.strip() else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "'{}' isn't a range like 130:, :2 or 60:90".format(text))
+    return [low, low if not colon else high]
+
+
+def _bounds(keys, valuerange):
+    """ slice of the sorted keys within an inclusive [low, high] range """
+    low, high = valuerange
+    start = 0 if low is None else bisect.bisect_left(keys, low)
+    end = len(keys) if high is None else bisect.bisect_right(keys, high)
+    return start, max(start, end)
+
+
+def _within(value, valuerange):
+    low, high = valuerange
+    return (value is not None and (low is None or value >= low) and
+            (high is None or value <= high))
+
+
+class AttackIndex(indexfile.IndexFile):
+    """ Attack damage, attack cost and card HP in sorted arrays for range
+    queries by binary search
+
+    damage, cost, ids -- base damage (None if it has none), converted
+                         energy cost and card id of each attack
+    bydamage, damagekeys -- positions of the attacks with damage sorted by
+                            damage, and their damage
+    bycost, costkeys -- positions of the attacks sorted by cost, and their
+                        cost
+    hp, hpids -- HP of the cards with HP in order, and their ids
+
+    Cards are added in any order, the arrays are sorted when first queried
+    or saved.  The index file keeps the sorted orders so loading doesn't
+    sort them again.
+    """
+
+    kind = 'attack index'
+    version = INDEX_VERSION
+
+    def __init__(self, damage=None, cost=None, ids=None, hp=None,
+                 hpids=None, bydamage=None, bycost=None):
+        self.damage = damage or []
+        self.cost = cost or []
+        self.ids = ids or []
+        self.hp = hp or []
+        self.hpids = hpids or []
+        self.bydamage = self.damagekeys = self.bycost = self.costkeys = None
+        if bydamage is not None and bycost is not None:
+            # sorted by _sort before they were saved
+            self.bydamage = bydamage
+            self.bycost = bycost
+            self._keys()
+
+    def add(self, card):
+        """ index a card's attacks and HP """
+        for attack in card.get('attacks') or []:
+            self.damage.append(parse_damage(attack.get('damage'))[0])
+            self.cost.append(attack_cost(attack))
+            self.ids.append(card['id'])
+        if card_hp(card) is not None:
+            self.hp.append(card_hp(card))
+            self.hpids.append(card['id'])
+        self.bydamage = None
+
+    def _sort(self):
+        """ (re)build the sorted orders after cards were added """
+        if self.bydamage is not None:
+            return
+        hp = sorted(zip(self.hp, self.hpids))
+        self.hp = [value for value, cardid in hp]
+        self.hpids = [cardid for value, cardid in hp]
+        positions = range(len(self.ids))
+        self.bydamage = sorted(
+            (position for position in positions
+             if self.damage[position] is not None), key=self._damage_order)
+        self.bycost = sorted(
+            positions, key=lambda position: (
+                self.cost[position], self.damage[position] or 0,
+                self.ids[position]))
+        self._keys()
+
+    def _damage_order(self, position):
+        return self.damage[position], self.cost[position], self.ids[position]
+
+    def _keys(self):
+        """ the damage and cost of the sorted orders, to binary search """
+        self.damagekeys = [self.damage[position]
+                           for position in self.bydamage]
+        self.costkeys = [self.cost[position] for position in self.bycost]
+
+    def search(self, damage=None, cost=None, hp=None):
+        """ Return the ids of the cards with an attack doing damage for cost
+        and with hp, each a [low, high] range with None for no limit
+
+        Damage and cost have to be met by the same attack.  Cards are in
+        order of the damage, else the cost, else the HP asked for.
+        """
+        self._sort()
+        cardids = []
+        if damage or cost:
+            damagerange = damage or [None, None]
+            costrange = cost or [None, None]
+            # Binary search the more selective order and check the other
+            start, end = _bounds(self.damagekeys, damagerange)
+            positions = self.bydamage[start:end]
+            if cost:
+                start, end = _bounds(self.costkeys, costrange)
+                if not damage:
+                    positions = self.bycost[start:end]
+                elif end - start < len(positions):
+                    # fewer attacks by cost, put them in damage order
+                    positions = sorted(
+                        (position for position in self.bycost[start:end]
+                         if self.damage[position] is not None),
+                        key=self._damage_order)
+            seen = set()
+            for position in positions:
+                cardid = self.ids[position]
+                if cardid in seen:
+                    continue
+                if (damage and not _within(self.damage[position],
+                                           damagerange) or
+                        cost and not _within(self.cost[position],
+                                             costrange)):
+                    continue
+                seen.add(cardid)
+                cardids.append(cardid)
+        if hp:
+            start, end = _bounds(self.hp, hp)
+            if damage or cost:
+                withhp = set(self.hpids[start:end])
+                cardids = [cardid for cardid in cardids if cardid in withhp]
+            else:
+                cardids = self.hpids[start:end]
+        return cardids
+
+    def summary(self):
+        return '{} attacks, {} HP values'.format(len(self.ids),
+                                                 len(self.hpids))
+
+    def to_json(self):
+        self._sort()
+        return {'damage': self.damage, 'cost': self.cost, 'ids': self.ids,
+                'hp': self.hp, 'hpids': self.hpids,
+                'bydamage': self.bydamage, 'bycost': self.bycost}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['damage'], data['cost'], data['ids'], data['hp'],
+                   data['hpids'], data['bydamage'], data['bycost'])
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,10 @@ and write them back out.
 '''
 import json
 import argparse
+import hashlib
 import logging
+import logging.handlers
+import multiprocessing
 import os
 import sys
 import tcgdata.cardfilters as cardfilters
@@ -15,13 +18,12 @@ from collections import OrderedDict
 # Initialise the logger
 logger = logging.getLogger(__name__)
 
-# List to hold cards
-cards = []
+# Bump when the fixcards filters change in a way that isn't captured by
+# formats.json, this invalidates all the recorded fingerprints
+FILTERS_VERSION = 1
 
 
 def main():
-    # Structure to hold cards
-    global cards
 
     parser = argparse.ArgumentParser(description='Normalize TCG json files')
     parser.add_argument('--carddir', nargs=1, required=True,
@@ -29,6 +31,13 @@ def main():
     parser.add_argument('--formats', nargs='?', type=argparse.FileType('r'),
                         required=False, default='formats.json',
                         help='formats json file')
+    parser.add_argument('--jobs', '-j', type=int, required=False, default=1,
+                        help='number of set files to process in parallel')
+    parser.add_argument('--indexfile', required=False,
+                        default='fixcards-index.json',
+                        help='fingerprints of already normalized cards')
+    parser.add_argument('--force', action='store_true', required=False,
+                        help='ignore the fingerprints and filter every card')
 
     # add logging arguments
     verbosity.add_arguments(parser)
@@ -57,22 +66,187 @@ def main():
         formats = json.load(args.formats)
         logger.info('Loaded formats file {}'.format(args.formats.name))
 
-    logger.info('Loading files in: {}'.format(args.carddir[0]))
-    cards = readfiles(args.carddir[0], formats['setfiles'])
-    logger.info('Loaded {} cards'.format(len(cards)))
+    # Read, filter and write one set at a time so only a single set is ever
+    # held in memory (per worker when running with --jobs)
+    logger.info('Processing files in: {}'.format(args.carddir[0]))
+
+    # Fingerprints of the cards as written by the last run, cards which
+    # haven't changed since then skip the filters
+    version = filters_version(formats)
+    index = {'version': version, 'sets': {}}
+    if not args.force and os.path.isfile(args.indexfile):
+        with open(args.indexfile, 'r') as index_file:
+            oldindex = json.load(index_file)
+        if oldindex.get('version') == version:
+            index = oldindex
+        else:
+            logger.info('Filters changed, ignoring {}'.format(args.indexfile))
+
+    tasks = [(args.carddir[0], setcode, set_file_name, formats,
+              index['sets'].get(setcode))
+             for setcode, set_file_name in formats['setfiles'].items()]
+    if args.jobs > 1:
+        summaries = _fix_setfiles_parallel(tasks, args.jobs)
+    else:
+        summaries = (fix_setfile(*task) for task in tasks)
+
+    cardcount = 0
+    counts = {}
+    for summary in summaries:
+        print('Dumping set {} to {} ({} cards, {} skipped, {})'.format(
+            summary['setcode'], summary['setfile'], summary['cards'],
+            summary['skipped'],
+            'changed' if summary['changed'] else 'unchanged'))
+        cardcount = cardcount + summary['cards']
+        index['sets'][summary['setcode']] = summary['fingerprints']
+        for rule, count in summary['counts'].items():
+            logger.debug('{}: {} {} replacements'.format(
+                summary['setcode'], count, rule))
+            counts[rule] = counts.get(rule, 0) + count
+    logger.info('Processed {} cards'.format(cardcount))
+    for rule in cardfilters.TextNormalizer.from_formats(formats).rules:
+        logger.info('{}: {} replacements'.format(rule, counts.get(rule, 0)))
+
+    with open(args.indexfile, 'w') as index_file:
+        json.dump(index, index_file)
+
+
+def fix_setfile(dirpath, setcode, set_file_name, formats, fingerprints=None):
+    """ read -> filter -> sortdict -> write a single set file
+
+    fingerprints - fingerprints of the set recorded by a previous run (see
+        below).  If the file is unchanged it isn't read at all, cards whose
+        fingerprint matches bypass the filters and sortdict.
+
+    Returns a summary of the work done:
+        {'setcode': setcode, 'setfile': set_file_name,
+         'cards': number of cards, 'skipped': cards which bypassed filters,
+         'changed': True if the file was rewritten,
+         'counts': {rule: number of text replacements},
+         'fingerprints': {'file': hash of the file,
+                          'cards': {cardid: hash of the normalized card}}}
+    """
+    set_file_path = dirpath + set_file_name
+    if fingerprints is None:
+        fingerprints = {'file': None, 'cards': {}}
+    summary = {'setcode': setcode, 'setfile': set_file_name,
+               'changed': False, 'counts': {}}
+
+    filehash = file_fingerprint(set_file_path)
+    if filehash == fingerprints['file']:
+        logger.debug('{} unchanged since last run'.format(set_file_path))
+        summary['cards'] = summary['skipped'] = len(fingerprints['cards'])
+        summary['fingerprints'] = fingerprints
+        return summary
+
+    set_cards = readset(set_file_path)
+    normalizer = cardfilters.TextNormalizer.from_formats(formats)
+    cardprints = {}
+    skipped = 0
+    for i, card in enumerate(set_cards):
+        cardhash = card_fingerprint(card)
+        if fingerprints['cards'].get(card['id']) == cardhash:
+            skipped = skipped + 1
+        else:
+            fixcard(card, formats, normalizer, summary['counts'])
+            card = set_cards[i] = _sortcard(card, formats['keyorder'])
+            cardhash = card_fingerprint(card)
+        cardprints[card['id']] = cardhash
+
+    if skipped < len(set_cards):
+        summary['changed'] = writeset(set_file_path, set_cards)
+        filehash = file_fingerprint(set_file_path)
+    summary['cards'] = len(set_cards)
+    summary['skipped'] = skipped
+    summary['fingerprints'] = {'file': filehash, 'cards': cardprints}
+    return summary
+
+
+def filters_version(formats):
+    """ return a hash identifying the filters fixcards applies """
+    config = [FILTERS_VERSION, formats['dont_sort_energy'],
+              formats.get('rules'), formats['keyorder']]
+    return hashlib.sha1(
+        json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
 
-    # Apply filters
+def card_fingerprint(card):
+    """ return a hash of the card contents (including key order) """
+    return hashlib.sha1(json.dumps(
+        card, ensure_ascii=False, separators=(',', ':')).encode(
+            'utf-8')).hexdigest()
+
+
+def file_fingerprint(set_file_path):
+    """ return a hash of the file contents or None if it doesn't exist """
+    if not os.path.isfile(set_file_path):
+        return None
+    with open(set_file_path, 'rb') as set_file_handler:
+        return hashlib.sha1(set_file_handler.read()).hexdigest()
+
+
+def _fix_setfiles_parallel(tasks, jobs):
+    """ run fix_setfile for each task in a pool of worker processes
+
+    Log records from the workers are sent back over a queue and handled by
+    the parent's handlers so the output isn't interleaved.  Summaries are
+    yielded in the same order as tasks.
+    """
+    rootlogger = logging.getLogger()
+    logqueue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(
+        logqueue, *rootlogger.handlers, respect_handler_level=True)
+    listener.start()
+    pool = multiprocessing.Pool(
+        jobs, initializer=_init_worker,
+        initargs=(logqueue, rootlogger.level, logger.level))
+    try:
+        summaries = pool.starmap(fix_setfile, tasks)
+        # close and join rather than terminate so workers can flush any
+        # queued log records before they exit
+        pool.close()
+        pool.join()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        listener.stop()
+    for summary in summaries:
+        yield summary
+
+
+def _init_worker(logqueue, rootlevel, level):
+    """ route a worker process's logging back to the parent via logqueue """
+    rootlogger = logging.getLogger()
+    rootlogger.handlers = [logging.handlers.QueueHandler(logqueue)]
+    rootlogger.setLevel(rootlevel)
+    logger.setLevel(level)
+
+
+def fixcards(cards, formats, counts=None):
+    """ Apply the fixcards filters to a list of cards in place
+
+    cards - list of cards, typically a single set
+    formats - loaded formats.json (uses dont_sort_energy and rules)
+    counts - optional dict to accumulate per-rule text replacement counts
+
+    Returns counts
+    """
+    if counts is None:
+        counts = {}
+    normalizer = cardfilters.TextNormalizer.from_formats(formats)
     for card in cards:
-        cardfilters.sort_energy(
-            card=card, dont_sort_energy=formats['dont_sort_energy'])
-        cardfilters.apostrophe_to_quotes(item=card)
-        # quote_to_apostrophe(item=card)
-        cardfilters.x_to_times(item=card)
-        cardfilters.clean_attack_text(item=card)
-        cardfilters.add_converted_reteat_cost(card=card)
+        fixcard(card, formats, normalizer, counts)
+    return counts
+
 
-    writefiles(args.carddir[0], cards,
-               formats['setfiles'], formats['keyorder'])
+def fixcard(card, formats, normalizer, counts):
+    """ Apply the fixcards filters to a single card in place """
+    cardfilters.sort_energy(
+        card=card, dont_sort_energy=formats['dont_sort_energy'])
+    cardfilters.normalize_text(item=card, normalizer=normalizer,
+                               counts=counts)
+    cardfilters.add_converted_reteat_cost(card=card)
 
 
 def readfiles(dirpath, setfiles):
@@ -85,21 +259,7 @@ def readfiles(dirpath, setfiles):
     # List to hold the cards
     cards = []
 
-    if not dirpath.endswith('/'):
-        dirpath = dirpath + '/'
-
-    for setcode, setfile in setfiles.items():
-        set_file_path = dirpath + setfile
-        if not os.path.isfile(set_file_path):
-            logger.debug('Can\'t find setfile \'{}\''.format(set_file_path))
-            raise Exception('Can\'t find referenced file')
-        else:
-            # Open the file and load the cards
-            with open(set_file_path, 'r') as set_file_handler:
-                logger.debug('Reading {}'.format(set_file_path))
-                set_cards = json.load(set_file_handler)
-                logger.debug('Found {} cards in {}'.format(len(set_cards),
-                                                           set_file_path))
+    for setcode, setfile, set_cards in readsets(dirpath, setfiles):
         # Add the cards to the car array
         for card in set_cards:
             cards.append(card)
@@ -107,6 +267,34 @@ def readfiles(dirpath, setfiles):
     return cards
 
 
+def readsets(dirpath, setfiles):
+    """ generator version of readfiles, yields one set at a time
+    dirpath - folder where card files are restored
+    setfiles - list of files from formats.com
+
+    yields (setcode, setfile, cards) for each set in setfiles
+    """
+    if not dirpath.endswith('/'):
+        dirpath = dirpath + '/'
+
+    for setcode, setfile in setfiles.items():
+        yield setcode, setfile, readset(dirpath + setfile)
+
+
+def readset(set_file_path):
+    """ read a single set json file and return the list of cards """
+    if not os.path.isfile(set_file_path):
+        logger.debug('Can\'t find setfile \'{}\''.format(set_file_path))
+        raise Exception('Can\'t find referenced file')
+    # Open the file and load the cards
+    with open(set_file_path, 'r') as set_file_handler:
+        logger.debug('Reading {}'.format(set_file_path))
+        set_cards = json.load(set_file_handler)
+        logger.debug('Found {} cards in {}'.format(len(set_cards),
+                                                   set_file_path))
+    return set_cards
+
+
 def writefiles(dirpath, cards, setfiles, sortorder=None):
     """ write set json files """
 
@@ -119,21 +307,43 @@ def writefiles(dirpath, cards, setfiles, sortorder=None):
     # Populate cards into the right lists
     for card in cards:
         if sortorder:
-            try:
-                card = sortdict(card, sortorder)
-            except Exception as e:
-                print('Exception trying to sort card keys prior to writing')
-                print('Card = {}'.format(card['id']))
-                raise
+            card = _sortcard(card, sortorder)
 
         card_output[card['setCode']].append(card)
 
     # write the files
     for setcode, set_file_name in setfiles.items():
         print('Dumping set {} to {}'.format(setcode, set_file_name))
-        with open(dirpath + set_file_name, 'w') as set_file_handler:
-            print(json.dumps(card_output[setcode], indent=2,
-                             ensure_ascii=False), file=set_file_handler)
+        writeset(dirpath + set_file_name, card_output[setcode])
+
+
+def writeset(set_file_path, cards, sortorder=None):
+    """ write a single set json file, optionally sorting the card keys
+
+    The file is left untouched if its contents would not change.  Returns
+    True if the file was written.
+    """
+    if sortorder:
+        cards = [_sortcard(card, sortorder) for card in cards]
+    output = json.dumps(cards, indent=2, ensure_ascii=False) + '\n'
+    if os.path.isfile(set_file_path):
+        with open(set_file_path, 'r') as set_file_handler:
+            if set_file_handler.read() == output:
+                logger.debug('{} unchanged'.format(set_file_path))
+                return False
+    with open(set_file_path, 'w') as set_file_handler:
+        set_file_handler.write(output)
+    return True
+
+
+def _sortcard(card, sortorder):
+    """ sortdict a card, reporting which card failed if it can't be sorted """
+    try:
+        return sortdict(card, sortorder)
+    except Exception as e:
+        print('Exception trying to sort card keys prior to writing')
+        print('Card = {}'.format(card['id']))
+        raise
 
 
 def sortdict(dictionary, sortorder, prefix='.'):
@@ -1,41 +1,244 @@
 import logging
 import re
+import tcgdata.changes as changes
 
 # Initialise the logger
 logger = logging.getLogger(__name__)
 
 
+# Default text rules, used when formats.json doesn't have a 'rules' section.
+# Each rule has:
+#   patterns -- list of [pattern, replacement] pairs
+#   prefilter -- optional list of literals, strings containing none of them
+#       are never handed to the regex engine
+#   fields -- optional list of paths the rule is limited to, in the same
+#       format as keyorder (e.g. '.attacks.text'), default is every string
+#   exclude_sets -- optional list of set codes to skip, or the name of a
+#       list in formats.json (e.g. 'dont_sort_energy')
+#   enabled -- optional, false to only apply the rule when asked for by name
+TEXT_RULES = {
+    # replace ’s and ’t with 's and 't
+    'apostrophe_to_quotes': {
+        'prefilter': ['’'],
+        'patterns': [
+            [r'’s\b', r"'s"],
+            [r'’t\b', r"'t"]
+        ]
+    },
+    # replace 's and 't with ’s and ’t
+    'quote_to_apostrophe': {
+        'enabled': False,
+        'prefilter': ["'"],
+        'patterns': [
+            [r'\'s\b', r'’s'],
+            [r'\'t\b', r'’t']
+        ]
+    },
+    # x+d (e.g. x2) or d+x (e.g. 20x) to ×
+    'x_to_times': {
+        'prefilter': ['x'],
+        'patterns': [
+            [r'\b(\d+)x\b', r'\1×'],
+            [r'\bx(\d+)\b', r'×\1']
+        ]
+    },
+    # remove attack damage included in the attack text e.g. "(20+) This
+    # attack does 20 damage plus ...".  Rules are applied in a single pass so
+    # the damage may still be written with an x.
+    'clean_attack_text': {
+        'fields': ['.attacks.text'],
+        'prefilter': ['('],
+        'patterns': [
+            [r'^\(\d+[×x]\)\s*', r''],
+            [r'^\(\d+\+\)\s*', r'']
+        ]
+    }
+}
+
+
+# TextNormalizers used by the single rule filters, see _normalizer()
+_normalizers = {}
+
+
+class TextNormalizer(object):
+    """ Apply a set of string rules to an item in a single pass
+
+    The rules are compiled into one engine: for each field path and set the
+    patterns of the rules which apply are combined into one precompiled
+    alternation, so each string in the item is walked once and handed to a
+    single sub().  Strings which contain none of the rules' prefilter
+    literals skip the regex entirely.  Replacements are counted per rule.
+
+    Rules are applied in one pass, so a rule will not see the output of
+    another rule (e.g. enabling both apostrophe_to_quotes and
+    quote_to_apostrophe swaps the characters).
+
+    rules -- list of rule names to apply, in order of precedence
+    ruleset -- rule definitions (see TEXT_RULES, the default)
+    formats -- loaded formats.json, used to look up named exclude_sets
+    """
+
+    def __init__(self, rules, ruleset=None, formats=None):
+        if ruleset is None:
+            ruleset = TEXT_RULES
+        self.rules = list(rules)
+        self._ruleset = {}
+        for rule in self.rules:
+            definition = ruleset[rule]
+            exclude_sets = definition.get('exclude_sets', [])
+            if isinstance(exclude_sets, str):
+                exclude_sets = formats[exclude_sets]
+            self._ruleset[rule] = {
+                'patterns': [(pattern, replacement) for pattern, replacement
+                             in definition['patterns']],
+                'prefilter': definition.get('prefilter'),
+                'fields': definition.get('fields'),
+                'exclude_sets': set(exclude_sets)
+            }
+        # compiled engines, keyed by (path, setcode)
+        self._engines = {}
+
+    @classmethod
+    def from_formats(cls, formats, rules=None):
+        """ build a TextNormalizer from the 'rules' section of formats
+
+        rules -- rule names to apply, default is every enabled rule
+        """
+        ruleset = formats.get('rules', TEXT_RULES)
+        if rules is None:
+            rules = [rule for rule, definition in ruleset.items()
+                     if definition.get('enabled', True)]
+        return cls(rules, ruleset=ruleset, formats=formats)
+
+    def normalize(self, item, counts=None, setcode=None, path='.',
+                  journal=None, journalpath=''):
+        """ Apply the rules to every string in item (dict or list) in place
+
+        counts -- optional dict, incremented with the number of replacements
+            made by each rule
+        setcode -- set of the card, looked up from the item if not passed
+        path -- path of item in the card, as used by keyorder
+        journal -- optional changes.ChangeJournal to record the edits in
+        journalpath -- path of item in the card, as used by the journal
+        """
+        if counts is None:
+            counts = {}
+        if setcode is None and isinstance(item, dict):
+            setcode = item.get('setCode', item.get('set_code'))
+        if isinstance(item, dict):
+            for k, v in list(item.items()):
+                nextpath = path + k if path.endswith('.') else path + '.' + k
+                if isinstance(v, list) or isinstance(v, dict):
+                    self.normalize(v, counts, setcode, nextpath, journal,
+                                   journal and changes.key_path(journalpath,
+                                                                k))
+                if isinstance(v, str):
+                    item[k] = self.sub(v, counts, setcode, nextpath)
+                    if journal and item[k] != v:
+                        journal.record(changes.key_path(journalpath, k), v,
+                                       item[k])
+        elif isinstance(item, list):
+            for i, v in enumerate(item):
+                if isinstance(v, str):
+                    item[i] = self.sub(v, counts, setcode, path)
+                    if journal and item[i] != v:
+                        journal.record(changes.key_path(journalpath, i), v,
+                                       item[i], iterable=True)
+                if isinstance(v, dict):
+                    self.normalize(v, counts, setcode, path, journal,
+                                   journal and changes.key_path(journalpath,
+                                                                i))
+        return counts
+
+    def sub(self, text, counts, setcode=None, path=None):
+        """ return text with the rules applied, updating counts """
+        try:
+            engine = self._engines[(path, setcode)]
+        except KeyError:
+            engine = self._engines[(path, setcode)] = self._compile(
+                path, setcode)
+        if engine is None:
+            return text
+        pattern, templates, prefilter = engine
+        if prefilter and not any(literal in text for literal in prefilter):
+            return text
+
+        def _replace(match):
+            rule, template = templates[match.lastindex]
+            counts[rule] = counts.get(rule, 0) + 1
+            return match.expand(template)
+
+        newtext = pattern.sub(_replace, text)
+        if newtext != text:
+            logger.debug('replacing[{}]'.format(text))
+            logger.debug('replaced [{}]'.format(newtext))
+        return newtext
+
+    def _compile(self, path, setcode):
+        """ combine the rules which apply to path and setcode
+
+        returns (pattern, templates, prefilter) or None if no rules apply.
+        templates maps the group index of each alternative to
+        (rule, replacement), prefilter is None if any rule has no prefilter.
+        """
+        templates = {}
+        alternatives = []
+        prefilter = set()
+        groupindex = 1
+        for rule in self.rules:
+            definition = self._ruleset[rule]
+            if (definition['fields'] is not None and
+                    path not in definition['fields']):
+                continue
+            if setcode in definition['exclude_sets']:
+                continue
+            if prefilter is not None and definition['prefilter']:
+                prefilter.update(definition['prefilter'])
+            else:
+                prefilter = None
+            for pattern, replacement in definition['patterns']:
+                # shift any group references in the replacement to account
+                # for the groups which come before this pattern
+                offset = groupindex
+                template = re.sub(
+                    r'\\(\d+)',
+                    lambda m: r'\g<{}>'.format(int(m.group(1)) + offset),
+                    replacement)
+                templates[groupindex] = (rule, template)
+                alternatives.append('({})'.format(pattern))
+                groupindex = groupindex + 1 + re.compile(pattern).groups
+        if not alternatives:
+            return None
+        return re.compile('|'.join(alternatives)), templates, prefilter
+
+
+def normalize_text(**kwargs):
+    """ Apply a TextNormalizer to an item, for use in filter lists
+
+    Required keyword arguments:
+        item -- item to modify
+        normalizer -- TextNormalizer to apply
+    Optional keyword arguments:
+        counts -- dict to accumulate per-rule replacement counts
+        journal -- changes.ChangeJournal to record the edits in
+    """
+    kwargs['normalizer'].normalize(kwargs['item'], kwargs.get('counts'),
+                                   journal=kwargs.get('journal'))
+
+
+def _normalizer(rule):
+    """ return a cached TextNormalizer for a single default rule """
+    if rule not in _normalizers:
+        _normalizers[rule] = TextNormalizer([rule])
+    return _normalizers[rule]
+
+
 def apostrophe_to_quotes(**kwargs):
     """ Change apostrophe to single quote characters
     replace ’s and ’t with 's and 't with
 
     """
-    patterns = [
-        (r'’s\b', r"'s"),
-        (r'’t\b', r"'t")
-    ]
-
-    d = kwargs['item']
-    if isinstance(d, dict):
-        for k, v in list(d.items()):
-            if isinstance(v, list) or isinstance(v, dict):
-                apostrophe_to_quotes(item=v)
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[k]))
-                        v = d[k] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[k]))
-    elif isinstance(d, list):
-        for i, v in enumerate(d):
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[i]))
-                        v = d[i] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[i]))
-            if isinstance(v, dict):
-                apostrophe_to_quotes(item=v)
+    _normalizer('apostrophe_to_quotes').normalize(kwargs['item'])
 
 
 def quote_to_apostrophe(**kwargs):
@@ -43,32 +246,7 @@ def quote_to_apostrophe(**kwargs):
     replace 's and 't with ’s and ’t
 
     """
-    patterns = [
-        (r'\'s\b', r'’s'),
-        (r'\'t\b', r'’t')
-    ]
-
-    d = kwargs['item']
-    if isinstance(d, dict):
-        for k, v in list(d.items()):
-            if isinstance(v, list) or isinstance(v, dict):
-                quote_to_apostrophe(item=v)
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[k]))
-                        v = d[k] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[k]))
-    elif isinstance(d, list):
-        for i, v in enumerate(d):
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[i]))
-                        v = d[i] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[i]))
-            if isinstance(v, dict):
-                quote_to_apostrophe(item=v)
+    _normalizer('quote_to_apostrophe').normalize(kwargs['item'])
 
 
 def x_to_times(**kwargs):
@@ -82,32 +260,7 @@ def x_to_times(**kwargs):
     \b matches empty string at beginning or end of a word
 
     """
-    patterns = [
-        (r'\b(\d+)x\b', r'\1×'),
-        (r'\bx(\d+)\b', r'×\1')
-    ]
-
-    d = kwargs['item']
-    if isinstance(d, dict):
-        for k, v in list(d.items()):
-            if isinstance(v, list) or isinstance(v, dict):
-                x_to_times(item=v)
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[k]))
-                        v = d[k] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[k]))
-    elif isinstance(d, list):
-        for i, v in enumerate(d):
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[i]))
-                        v = d[i] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[i]))
-            if isinstance(v, dict):
-                x_to_times(item=v)
+    _normalizer('x_to_times').normalize(kwargs['item'])
 
 
 def clean_attack_text(**kwargs):
@@ -116,23 +269,11 @@ def clean_attack_text(**kwargs):
     Patterns:
     Remove when attack damage is included in the attack text e.g. "(20+) This
         attack does 20 damage plus ..."
+            (r'^\(\d+[×x]\)\s*', r''),
+            (r'^\(\d+\+\)\s*', r'')
 
     """
-    patterns = [
-        (r'^\(\d+×\)\s*', r''),
-        (r'^\(\d+\+\)\s*', r'')
-    ]
-
-    item = kwargs['item']
-    if item.get('attacks'):
-        for attack in item['attacks']:
-            if attack.get('text'):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, attack['text']):
-                        logger.debug('replacing[{}]'.format(attack['text']))
-                        attack['text'] = re.sub(
-                            pattern, replacement, attack['text'])
-                        logger.debug('replaced [{}]'.format(attack['text']))
+    _normalizer('clean_attack_text').normalize(kwargs['item'])
 
 
 def sort_energy(**kwargs):
@@ -0,0 +1,424 @@
+''' Resident card query server
+
+Loads the cards once, from the set files or the card table, keeps id, set,
+name, supertype, legality, text and fuzzy name indexes in memory and answers
+querycards style queries over HTTP/JSON.  The cards are reloaded when the set
+files change (or loadcards bumps the table generation).
+
+    POST /query   {"ids": [...], "set": ..., "name": ..., ...} -> {"cards"}
+    GET  /status  number of cards, source and when they were loaded
+'''
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from boto3.dynamodb.conditions import Attr
+import tcgdata.cardfiles as cardfiles
+import tcgdata.dbtools as dbtools
+import tcgdata.storage as storage
+from tcgdata.attackindex import AttackIndex, damage_fields
+from tcgdata.legality import LEGALITY_FORMATS, LegalityIndex
+from tcgdata.nameindex import NameIndex
+from tcgdata.textindex import TextIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Default server used by querycards --server
+SERVER_URL = 'http://{}:{}'.format(DEFAULT_HOST, DEFAULT_PORT)
+
+# Query arguments the server understands, see CardCorpus.query
+QUERY_KEYS = ['ids', 'set', 'name', 'supertype', 'season', 'formats',
+              'ability', 'search', 'fuzzyname', 'damage', 'cost', 'hp',
+              'limit', 'fields']
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Serve card queries from memory over HTTP/JSON')
+    parser.add_argument('--carddir', nargs=1, required=False,
+                        help='load the set files in this directory rather '
+                        'than the card table')
+    parser.add_argument('--formats', default='formats.json', required=False,
+                        help='formats json file (default formats.json)')
+    parser.add_argument('-t', '--test', action='store_true', required=False,
+                        help='serve the test table')
+    parser.add_argument('-l', '--localdb', action='store_true',
+                        help='use local database', required=False)
+    parser.add_argument('--sqlite', required=False, metavar='PATH',
+                        help='use an SQLite database file instead of '
+                        'dynamodb')
+    parser.add_argument('--segments', type=int, default=4, required=False,
+                        help='number of parallel scan segments')
+    parser.add_argument('--host', default=DEFAULT_HOST, required=False,
+                        help='address to listen on (default {})'.format(
+                            DEFAULT_HOST))
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        required=False,
+                        help='port to listen on (default {})'.format(
+                            DEFAULT_PORT))
+    parser.add_argument('--interval', type=float, default=2, required=False,
+                        help='seconds between checks for changed cards, 0 '
+                        'to never reload (default 2)')
+    parser.add_argument('-d', '--debug', action="store_const",
+                        help="Print lots of debugging statements",
+                        dest="loglevel", const=logging.DEBUG,
+                        default=logging.WARNING)
+    parser.add_argument("-v", "--verbose", action="store_const",
+                        help="increase output verbosity",
+                        dest='loglevel', const=logging.INFO)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel)
+
+    if args.carddir:
+        if not os.path.isdir(args.carddir[0]):
+            print('--carddir must be a directory')
+            sys.exit(2)
+        source = FileSource(args.carddir[0], args.formats)
+    else:
+        dynamodb = storage.connect(args.localdb, args.sqlite)
+        source = TableSource(dynamodb, 'test_cards' if args.test
+                             else 'tcg_cards', 'tcg_sets', args.segments)
+
+    server = CardServer((args.host, args.port), source)
+    print('Loaded {} cards from {}'.format(len(server.corpus.cards), source))
+    if args.interval:
+        threading.Thread(target=server.watch, args=(args.interval,),
+                         daemon=True).start()
+    print('Serving on http://{}:{}'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def snakecase(name):
+    """ nationalPokedexNumber -> national_pokedex_number """
+    return re.sub(r'([A-Z])', r'_\1', name).lower()
+
+
+class FileSource(object):
+    """ Cards from the set files listed in a formats file
+
+    The cards are converted to card table items: top level attributes are
+    renamed to snake_case, attack damage is parsed (see
+    loadcards.update_attack_damage) and the legality flags are set from the
+    season rules (reprints made legal by the loadcards postprocess aren't).
+    """
+
+    def __init__(self, carddir, formats):
+        self.carddir = carddir
+        self.formats = formats
+
+    def __str__(self):
+        return self.carddir
+
+    def _paths(self):
+        with open(self.formats) as formats_file:
+            setfiles = json.load(formats_file)['setfiles']
+        return [os.path.join(self.carddir, setfile)
+                for setfile in setfiles.values()]
+
+    def version(self):
+        """ changes whenever the formats file or a set file changes """
+        version = []
+        for path in [self.formats] + self._paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        return version
+
+    def load(self):
+        """ Return the list of card items """
+        with open(self.formats) as formats_file:
+            formats = json.load(formats_file)
+        legality = LegalityIndex(formats['seasons'])
+        items = []
+        for path in self._paths():
+            if not os.path.isfile(path):
+                logger.warning('Skipping {}, not found'.format(path))
+                continue
+            for card in cardfiles.readset(path):
+                item = {snakecase(name): value
+                        for name, value in card.items()}
+                try:
+                    item.update(legality.card_legality(item))
+                except ValueError:
+                    logger.warning('Card {} has an unexpected number'.format(
+                        item['id']))
+                dbtools.update_legality_index(item, formats['seasons'])
+                for attack in item.get('attacks') or []:
+                    attack.update(damage_fields(attack))
+                items.append(item)
+        return items
+
+
+class TableSource(object):
+    """ Cards from the card table, reloaded when the generation recorded in
+    the set table changes
+    """
+
+    def __init__(self, dynamodb, card_table_name, set_table_name,
+                 segments=4):
+        self.cardtable = dynamodb.Table(card_table_name)
+        self.settable = dynamodb.Table(set_table_name)
+        self.segments = segments
+
+    def __str__(self):
+        return self.cardtable.name
+
+    def version(self):
+        return dbtools.table_generation(self.settable)
+
+    def load(self):
+        """ Return the list of card items """
+        return dbtools.scan_items(self.cardtable, segments=self.segments,
+                                  plain=True)
+
+
+class CardCorpus(object):
+    """ The cards and their indexes
+
+    cards -- {card id: card}
+    sets -- {set code: [card ids]} in card number order
+    names -- {name: [card ids]}
+    supertypes -- {supertype: set of card ids}
+    legal -- {'<season>_<format>': set of the ids of legal cards}
+    order -- {card id: position}, cards found by an index are returned in
+             set code, number order
+    """
+
+    def __init__(self, items):
+        self.cards = {}
+        self.sets = {}
+        self.names = {}
+        self.supertypes = {}
+        self.legal = {}
+        self.textindex = TextIndex()
+        self.nameindex = NameIndex()
+        self.attackindex = AttackIndex()
+        items = sorted(items, key=lambda item: (item['set_code'],
+                                                item['number']))
+        self.order = {item['id']: position
+                      for position, item in enumerate(items)}
+        for item in items:
+            cardid = item['id']
+            self.cards[cardid] = item
+            self.sets.setdefault(item['set_code'], []).append(cardid)
+            self.names.setdefault(item.get('name'), []).append(cardid)
+            self.supertypes.setdefault(item.get('supertype'), set()).add(
+                cardid)
+            for name, value in item.items():
+                if value is True and name.endswith(tuple(
+                        '_' + legalformat
+                        for legalformat in LEGALITY_FORMATS)):
+                    self.legal.setdefault(name, set()).add(cardid)
+            self.textindex.add(item)
+            self.nameindex.add(item)
+            self.attackindex.add(item)
+
+    def query(self, ids=None, set=None, name=None, supertype=None,
+              season='2018', formats=(), ability=False, search=None,
+              fuzzyname=None, damage=None, cost=None, hp=None, limit=None,
+              fields=None):
+        """ Return the cards matching a query, as querycards would
+
+        Cards given by ids, search (ranked text search), fuzzyname (the
+        limit, default 5, closest names) and damage, cost and hp ranges ([low,
+        high], see AttackIndex.search) have to be given by each of them, in
+        the order of the first.  The cards given, or if none are the cards of
+        every set, are narrowed down by set, name, supertype, the formats
+        they're legal in for the season and ability (True or text of the
+        ability).  limit cuts the cards of search and the ranges once
+        they're narrowed down.
+
+        fields -- only return these attributes (see storage.project)
+        """
+        idsources = [list(ids)] if ids else []
+        if search:
+            idsources.append([cardid for cardid, score in
+                              self.textindex.search(search)])
+        if fuzzyname:
+            idsources.append([cardid for cardname, score, matched in
+                              self.nameindex.lookup(fuzzyname, limit or 5)
+                              for cardid in matched])
+        if damage or cost or hp:
+            idsources.append(self.attackindex.search(damage, cost, hp))
+        if idsources:
+            cardids = dbtools.intersect_ids(idsources)
+            cards = []
+            for cardid in cardids:
+                if cardid in self.cards:
+                    cards.append(self.cards[cardid])
+                else:
+                    logger.warning('Card {} not found'.format(cardid))
+            if (set is not None or name is not None or
+                    supertype is not None or formats or ability):
+                selected = {
+                    card['id'] for card in self._select(
+                        set, name, supertype, season, formats, ability)}
+                cards = [card for card in cards if card['id'] in selected]
+            if limit and (search or damage or cost or hp):
+                cards = cards[:limit]
+        else:
+            cards = self._select(set, name, supertype, season, formats,
+                                 ability)
+        if fields:
+            cards = [storage.project(card, fields) for card in cards]
+        return cards
+
+    def _select(self, setcode, name, supertype, season, formats, ability):
+        """ the cards matching the criteria, intersecting the indexes """
+        matches = []
+        if setcode is not None:
+            matches.append(self.sets.get(setcode, []))
+        if name is not None:
+            matches.append(self.names.get(name, []))
+        if supertype is not None:
+            matches.append(self.supertypes.get(supertype, set()))
+        for legalformat in formats:
+            matches.append(self.legal.get(
+                '{}_{}'.format(season, legalformat), set()))
+        if matches:
+            matches.sort(key=len)
+            cardids = set(matches[0]).intersection(*matches[1:])
+            cardids = sorted(cardids, key=self.order.get)
+        else:
+            cardids = list(self.cards)
+        cards = [self.cards[cardid] for cardid in cardids]
+        if ability is True:
+            condition = Attr('ability').exists()
+        elif ability:
+            condition = (Attr('ability.name').contains(ability) |
+                         Attr('ability.text').contains(ability))
+        else:
+            return cards
+        return [card for card in cards if storage.evaluate(condition, card)]
+
+
+class CardServer(ThreadingHTTPServer):
+    """ HTTP server answering queries from a CardCorpus, see main
+
+    The corpus is replaced as a whole on reload so requests in progress
+    keep using the one they started with.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, source):
+        self.source = source
+        self.version = source.version()
+        self.corpus = CardCorpus(source.load())
+        self.loaded = time.time()
+        super().__init__(address, QueryHandler)
+
+    def reload(self):
+        """ reload the cards if the source has changed, True if it had """
+        version = self.source.version()
+        if version == self.version:
+            return False
+        start = time.time()
+        self.corpus = CardCorpus(self.source.load())
+        self.version = version
+        self.loaded = time.time()
+        print('Reloaded {} cards from {} in {:.2f}s'.format(
+            len(self.corpus.cards), self.source, self.loaded - start))
+        return True
+
+    def watch(self, interval):
+        """ check for changed cards every interval seconds, forever """
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except Exception:
+                # Keep serving the cards we have, e.g. while a set file is
+                # being rewritten
+                logger.exception('Reload from {} failed'.format(self.source))
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """ POST /query and GET /status """
+
+    def do_GET(self):
+        if self.path != '/status':
+            self._reply(404, {'error': 'Not found'})
+            return
+        self._reply(200, {'cards': len(self.server.corpus.cards),
+                          'source': str(self.server.source),
+                          'loaded': self.server.loaded})
+
+    def do_POST(self):
+        if self.path != '/query':
+            self._reply(404, {'error': 'Not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            query = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(query, dict):
+                raise ValueError('The query must be a JSON object')
+            unknown = set(query) - set(QUERY_KEYS)
+            if unknown:
+                raise ValueError('Unknown query arguments {}'.format(
+                    ', '.join(sorted(unknown))))
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+            return
+        start = time.perf_counter()
+        try:
+            cards = self.server.corpus.query(**query)
+        except (TypeError, AttributeError, ValueError) as e:
+            # e.g. a range that isn't [low, high] or a limit that isn't a
+            # number
+            self._reply(400, {'error': 'Bad query: {}'.format(e)})
+            return
+        logger.debug('{} -> {} cards in {:.3f}ms'.format(
+            query, len(cards), (time.perf_counter() - start) * 1000))
+        self._reply(200, {'cards': cards})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.info('{} {}'.format(self.address_string(), format % args))
+
+
+def query_server(url, query, timeout=10):
+    """ Return the cards a server at url gives for a query (see
+    CardCorpus.query), None if no server is running there
+
+    Raises ValueError if the server rejects the query.
+    """
+    request = urllib.request.Request(
+        url.rstrip('/') + '/query', data=json.dumps(query).encode('utf-8'),
+        headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))['cards']
+    except urllib.error.HTTPError as e:
+        raise ValueError(json.loads(e.read().decode('utf-8'))['error'])
+    except (urllib.error.URLError, ConnectionError) as e:
+        logger.info('No card server at {}: {}'.format(url, e))
+        return None
+
+
+if __name__ == "__main__":
+    main()
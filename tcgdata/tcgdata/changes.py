@@ -0,0 +1,153 @@
+''' Record the edits filters make to an item, for loadcards --updatefile '''
+import difflib
+from contextlib import contextmanager
+
+# Stands in for the old (or new) value of a key which didn't (or doesn't)
+# exist
+MISSING = object()
+
+
+class ChangeJournal(object):
+    """ Edits made to one item, recorded by the filters as they make them
+
+    Paths are in the form used by DeepDiff, e.g. "['attacks'][0]['cost']".
+    Several edits to the same path are merged, keeping the first old value
+    and the last new value, so only the net change is reported.
+    """
+
+    def __init__(self):
+        # path: [old, new, iterable]
+        self.changes = {}
+        # path: (old list, new list), see record_list
+        self.lists = {}
+
+    def record(self, path, old, new, iterable=False):
+        """ Record that the value at path changed from old to new
+
+        old/new -- MISSING if the key didn't exist before/after
+        iterable -- path is a list position rather than a dict key
+        """
+        if path in self.changes:
+            self.changes[path][1] = new
+        else:
+            self.changes[path] = [old, new, iterable]
+
+    def record_list(self, path, old, new):
+        """ Record a list at path changing from old to new
+
+        new is kept by reference, so later edits made to the list in place
+        are included.  The list is compared with its first old value when
+        the diff is made, as the positions of any edits recorded for its
+        items may have shifted since.
+        """
+        if path in self.lists:
+            old = self.lists[path][0]
+        self.lists[path] = (list(old), new)
+
+    @contextmanager
+    def track(self, item, path='', keys=None):
+        """ Record changes made to the top level keys of item in the block
+
+        Only a shallow copy of item is kept, so this is for filters which
+        set or remove top level values rather than editing them in place.
+
+        keys -- only track these keys, default is all of them
+        """
+        before = dict(item)
+        yield
+        if keys is None:
+            keys = list(before) + [key for key in item if key not in before]
+        for key in keys:
+            old = before.get(key, MISSING)
+            new = item.get(key, MISSING)
+            if old is not new:
+                self.record(key_path(path, key), old, new)
+
+    def diff(self, root='root'):
+        """ Return the changes in the shape of a DeepDiff (verbose_level=2)
+        result, with paths starting at root
+        """
+        result = {}
+        changed = dict(self.changes)
+        for path, (old, new) in self.lists.items():
+            # the lists are compared as a whole instead of by their items
+            for itempath in [itempath for itempath in changed
+                             if itempath.startswith(path + '[') and
+                             ']' not in itempath[len(path) + 1:-1]]:
+                del changed[itempath]
+            for index, oldvalue, newvalue in list_changes(old, new):
+                changed[key_path(path, index)] = [oldvalue, newvalue, True]
+        for path, (old, new, iterable) in changed.items():
+            path = root + path
+            if old is MISSING and new is MISSING:
+                continue
+            if old is MISSING:
+                category = ('iterable_item_added' if iterable else
+                            'dictionary_item_added')
+                result.setdefault(category, {})[path] = new
+            elif new is MISSING:
+                category = ('iterable_item_removed' if iterable else
+                            'dictionary_item_removed')
+                result.setdefault(category, {})[path] = old
+            elif type(old) is not type(new):
+                result.setdefault('type_changes', {})[path] = {
+                    'old_type': type(old), 'new_type': type(new),
+                    'old_value': old, 'new_value': new}
+            elif old != new:
+                result.setdefault('values_changed', {})[path] = {
+                    'old_value': old, 'new_value': new}
+        return result
+
+
+class NullJournal(object):
+    """ ChangeJournal which records nothing, used when there's no journal """
+
+    def record(self, path, old, new, iterable=False):
+        pass
+
+    def record_list(self, path, old, new):
+        pass
+
+    @contextmanager
+    def track(self, item, path='', keys=None):
+        yield
+
+
+NO_JOURNAL = NullJournal()
+
+
+def list_changes(old, new):
+    """ Return (index, old value, new value) for the changes from list old
+    to list new, MISSING for the side an item is missing from
+
+    As DeepDiff does, the lists are matched up with difflib, so that a
+    shortened or rotated list is reported as items removed and added,
+    unless comparing position by position reports no more changes.
+    """
+    matched = []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        # positions replaced one for one are changed values
+        common = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+        matched.extend((i1 + offset, old[i1 + offset], new[j1 + offset])
+                       for offset in range(common))
+        matched.extend((i, old[i], MISSING)
+                       for i in range(i1 + common, i2))
+        matched.extend((j, MISSING, new[j])
+                       for j in range(j1 + common, j2))
+    if len(matched) > 1:
+        positional = [
+            (i, old[i] if i < len(old) else MISSING,
+             new[i] if i < len(new) else MISSING)
+            for i in range(max(len(old), len(new)))
+            if i >= len(old) or i >= len(new) or old[i] != new[i]]
+        if len(matched) >= len(positional):
+            matched = positional
+    return matched
+
+
+def key_path(path, key):
+    """ path of key (dict key or list index) within path """
+    return '{}[{!r}]'.format(path, key)
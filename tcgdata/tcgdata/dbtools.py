@@ -0,0 +1,806 @@
+''' Helpers for working with the DynamoDB card and set tables '''
+import hashlib
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import boto3
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+from tcgdata.legality import LEGALITY_FORMATS
+
+logger = logging.getLogger(__name__)
+
+# DynamoDB limit on the number of requests in a single BatchWriteItem
+BATCH_WRITE_SIZE = 25
+
+# DynamoDB limit on the number of keys in a single BatchGetItem
+BATCH_GET_SIZE = 100
+
+# Card supertypes, the partition keys of the legality indexes
+SUPERTYPES = ['Pokémon', 'Trainer', 'Energy']
+
+# Number of seasons, the most recent in formats.json, given legality indexes.
+# A table has at most 20 GSIs and each adds to the cost of every write, so
+# older seasons are answered by scans.
+INDEXED_SEASONS = 1
+
+# code of the item in the set table recording the data's generation
+GENERATION_CODE = '__generation__'
+
+# Attribute holding the hash of each item's loaded content, see content_hash
+CONTENT_HASH = 'content_hash'
+
+# Errors which mean we should slow down and try again
+RETRY_EXCEPTIONS = ('ProvisionedThroughputExceededException',
+                    'ThrottlingException')
+
+
+# Token buckets pacing requests to throttled tables, see throttle()
+_limiters = {}
+
+
+class RateLimiter(object):
+    """ Token bucket of capacity units shared by the threads using a table
+
+    Requests take an estimate of the capacity they will use before they are
+    sent and settle the difference once the response reports what was
+    actually consumed.  The bucket may go into debt, in which case the next
+    request waits until it has been paid off, so the long run rate stays at
+    or below rate units per second.
+    """
+
+    def __init__(self, rate, burst=None):
+        """ rate -- capacity units per second, None for no limit
+            burst -- most units which can be saved up (default one second)
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, units=1):
+        """ take units from the bucket, waiting if it is in debt """
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.tokens = self.tokens - units
+        if wait:
+            time.sleep(wait)
+
+    def settle(self, estimate, consumed):
+        """ correct the bucket once the consumed capacity is known """
+        if not self.rate or consumed is None:
+            return
+        with self.lock:
+            self.tokens = self.tokens + estimate - consumed
+
+
+def throttle(table, fraction=0.9):
+    """ Pace all requests this module makes to table under its capacity
+
+    The provisioned read and write capacity is read from the table (and its
+    global secondary indexes) and requests are limited to fraction of it,
+    using the ConsumedCapacity DynamoDB returns to charge for what each
+    request actually used.  Writes are paced by the smallest write capacity
+    of the table and its indexes, as every write may also update the indexes.
+    Tables using on-demand capacity, or a fraction of 0, are not limited.
+    """
+    if not fraction:
+        _limiters.pop(table.name, None)
+        return
+    description = table.meta.client.describe_table(
+        TableName=table.name)['Table']
+    if (description.get('BillingModeSummary', {}).get('BillingMode') ==
+            'PAY_PER_REQUEST'):
+        _limiters.pop(table.name, None)
+        logger.info('{} is on-demand, not rate limited'.format(table.name))
+        return
+
+    def _rate(throughput, units):
+        return throughput.get('ProvisionedThroughput', {}).get(units, 0)
+
+    limiters = {('read', None): RateLimiter(
+        _rate(description, 'ReadCapacityUnits') * fraction)}
+    writerates = [_rate(description, 'WriteCapacityUnits')]
+    for index in description.get('GlobalSecondaryIndexes', []):
+        limiters[('read', index['IndexName'])] = RateLimiter(
+            _rate(index, 'ReadCapacityUnits') * fraction)
+        writerates.append(_rate(index, 'WriteCapacityUnits'))
+    limiters[('write', None)] = RateLimiter(min(writerates) * fraction)
+    _limiters[table.name] = limiters
+    logger.info('Rate limiting {} to {:g} reads/s and {:g} writes/s'.format(
+        table.name, limiters[('read', None)].rate,
+        limiters[('write', None)].rate))
+
+
+def _limiter(table_name, kind='read', index=None):
+    """ the RateLimiter for kind ('read' or 'write') requests to a table or
+    one of its indexes, None if the table isn't throttled
+    """
+    return _limiters.get(table_name, {}).get((kind, index))
+
+
+def _consumed(response, table_name):
+    """ capacity units used by a request, from its ConsumedCapacity
+
+    With ReturnConsumedCapacity='INDEXES' this is the largest amount used
+    from the table or any one of its indexes.
+    """
+    consumed = response.get('ConsumedCapacity')
+    if isinstance(consumed, list):
+        consumed = [capacity for capacity in consumed
+                    if capacity.get('TableName') == table_name]
+        consumed = consumed[0] if consumed else None
+    if not consumed:
+        return None
+    units = [consumed.get('Table', {}).get('CapacityUnits', 0)]
+    for indexes in ('GlobalSecondaryIndexes', 'LocalSecondaryIndexes'):
+        units.extend(index.get('CapacityUnits', 0)
+                     for index in consumed.get(indexes, {}).values())
+    if not any(units):
+        return consumed.get('CapacityUnits')
+    return max(units)
+
+
+def _limited(limiter, request, estimate, table_name, request_kw):
+    """ make request(**request_kw) paced by limiter, may be None """
+    if limiter is None:
+        return request(**request_kw)
+    limiter.acquire(estimate)
+    response = request(ReturnConsumedCapacity='INDEXES', **request_kw)
+    limiter.settle(estimate, _consumed(response, table_name))
+    return response
+
+
+def batch_write_items(table, items, key_schema, workers=4, progress=500,
+                      max_retries=10, delete=False):
+    """ Write items to the table with BatchWriteItem across a thread pool
+
+    Items are grouped into batches of 25 and each batch is written by one of
+    the worker threads.  UnprocessedItems and throttling errors are retried
+    with capped exponential backoff.  items can be any iterable (e.g. a
+    generator), only a few batches per worker are held in memory at a time.
+
+    Position arguments:
+        table -- dynamodb table to write to
+        items -- iterable of items to put
+        key_schema -- table keys, used to keep duplicate keys out of a batch
+
+    Keyword arguments:
+        workers -- number of threads writing batches (default 4)
+        progress -- log progress every this many items (default 500)
+        max_retries -- give up on a batch after this many retries
+        delete -- items are the keys of items to delete rather than put
+
+    Returns the number of items written
+    """
+    keynames = [keyattribute['AttributeName'] for keyattribute in key_schema]
+    client = table.meta.client
+    itemcount = 0
+    pending = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def _submit(batch):
+            # Bound the number of batches in flight so a generator of items
+            # isn't read into memory faster than it can be written
+            while len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    future.result()
+            if delete:
+                requests = [{'DeleteRequest': {'Key': key}} for key in batch]
+            else:
+                requests = [{'PutRequest': {'Item': item}} for item in batch]
+            pending.add(executor.submit(
+                _write_batch, client, table.name, requests, max_retries))
+
+        batch = []
+        batchkeys = set()
+        for item in items:
+            # BatchWriteItem rejects batches which contain the same key twice
+            key = tuple(item[keyname] for keyname in keynames)
+            if len(batch) == BATCH_WRITE_SIZE or key in batchkeys:
+                _submit(batch)
+                batch = []
+                batchkeys = set()
+            batch.append(item)
+            batchkeys.add(key)
+            itemcount = itemcount + 1
+            if itemcount % progress == 0:
+                logger.info('Queued {} items for {}'.format(itemcount,
+                                                            table.name))
+        if batch:
+            _submit(batch)
+        for future in pending:
+            future.result()
+
+    logger.info('{} {} items {} {}'.format(
+        'Deleted' if delete else 'Wrote', itemcount,
+        'from' if delete else 'to', table.name))
+    return itemcount
+
+
+def _write_batch(client, table_name, requests, max_retries):
+    """ Write a single batch, retrying unprocessed items with backoff """
+    retries = 0
+    while requests:
+        try:
+            response = _limited(
+                _limiter(table_name, 'write'), client.batch_write_item,
+                len(requests), table_name,
+                {'RequestItems': {table_name: requests}})
+            requests = response.get('UnprocessedItems', {}).get(
+                table_name, [])
+            if not requests:
+                return
+            logger.debug('{} unprocessed items, retries={}'.format(
+                len(requests), retries))
+        except ClientError as err:
+            if err.response['Error']['Code'] not in RETRY_EXCEPTIONS:
+                raise
+            logger.debug('Throttled writing batch, retries={}'.format(retries))
+        if retries == max_retries:
+            raise Exception('Gave up writing batch to {} after {} '
+                            'retries'.format(table_name, retries))
+        backoff(retries)
+        retries = retries + 1
+
+
+def backoff(retries, base=0.05, cap=20):
+    """ sleep for a capped exponential backoff with full jitter """
+    time.sleep(random.uniform(0, min(cap, base * 2 ** retries)))
+
+
+def scan_pages(table, segments=1, max_retries=10, plain=False, **scan_kw):
+    """ Scan the table and yield each page of items as it arrives
+
+    With segments > 1 the table is scanned in parallel: each segment
+    (Segment/TotalSegments) is paged through by its own thread and pages are
+    yielded in the order they are received.  Throttling is retried with
+    capped exponential backoff plus jitter.
+
+    Keyword arguments:
+        segments -- number of parallel scan segments (default 1)
+        max_retries -- give up after this many consecutive throttles
+        plain -- return numbers as int/float rather than Decimal, see
+                 plain_client
+        scan_kw -- passed through to scan (e.g. FilterExpression)
+    """
+    for segment, page in _scan_segments(table, segments, max_retries,
+                                        scan_kw, plain):
+        yield page
+
+
+def scan_items(table, filter=None, segments=1, plain=False, **scan_kw):
+    """ Scan the table and return a list of all the items
+
+    The pages of each segment are merged in segment order, so for a given
+    number of segments the order of the items is the same from run to run.
+    See scan_pages.
+    """
+    if filter:
+        scan_kw['FilterExpression'] = filter
+    segment_items = [[] for segment in range(max(segments, 1))]
+    for segment, page in _scan_segments(table, segments, 10, scan_kw,
+                                        plain):
+        segment_items[segment].extend(page)
+    items = []
+    for segment_item in segment_items:
+        items.extend(segment_item)
+    return items
+
+
+def _scan_segments(table, segments, max_retries, scan_kw, plain=False):
+    """ generator of (segment, page) for a, possibly parallel, scan """
+    client = table.meta.client
+    plain = _plain(table, plain)
+    if plain:
+        client = plain_client(table)
+        scan_kw = plain_request_kw(scan_kw)
+    if segments <= 1:
+        for page in _scan_segment(client, table.name, scan_kw, max_retries,
+                                  plain):
+            yield 0, page
+        return
+
+    pages = queue.Queue(maxsize=segments * 2)
+    done = object()
+    # set if the consumer stops early so the workers don't block forever
+    stop = threading.Event()
+
+    def _put(obj):
+        while not stop.is_set():
+            try:
+                pages.put(obj, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _worker(segment):
+        try:
+            segment_kw = dict(scan_kw, Segment=segment,
+                              TotalSegments=segments)
+            for page in _scan_segment(client, table.name, segment_kw,
+                                      max_retries, plain):
+                if stop.is_set():
+                    return
+                _put((segment, page))
+        except Exception as e:
+            _put(e)
+        _put(done)
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        for segment in range(segments):
+            executor.submit(_worker, segment)
+        try:
+            remaining = segments
+            while remaining:
+                page = pages.get()
+                if page is done:
+                    remaining = remaining - 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            stop.set()
+
+
+def _scan_segment(client, table_name, scan_kw, max_retries, plain=False):
+    """ page through one scan (or scan segment), yielding lists of items """
+    # We cannot begin with ExclusiveStartKey=None, so we use kwargs sans that
+    # the first time, then update to include it subsequently.
+    scan_kw = dict(scan_kw, TableName=table_name)
+    retries = 0
+    while True:
+        try:
+            response = _limited(
+                _limiter(table_name, index=scan_kw.get('IndexName')),
+                client.scan, 1, table_name, _request_kw(scan_kw))
+        except ClientError as err:
+            if err.response['Error']['Code'] not in RETRY_EXCEPTIONS:
+                raise
+            if retries == max_retries:
+                raise
+            logger.info('Scan throttled, backing off retries={}'.format(
+                retries))
+            backoff(retries)
+            retries = retries + 1
+            continue
+        retries = 0          # if successful, reset count
+        yield _items(response, plain)
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        scan_kw['ExclusiveStartKey'] = last_key
+
+
+def _request_kw(request_kw):
+    """ copy of request keyword arguments for a single request
+
+    boto3 adds the placeholders it generates for condition expressions to
+    ExpressionAttributeNames in place, so each request gets its own copy
+    rather than sharing one between pages or threads.
+    """
+    if 'ExpressionAttributeNames' in request_kw:
+        request_kw = dict(request_kw, ExpressionAttributeNames=dict(
+            request_kw['ExpressionAttributeNames']))
+    return request_kw
+
+
+def projection(fields):
+    """ return ProjectionExpression keyword arguments for a list of fields
+
+    Fields are attribute names or document paths such as 'attacks.name' or
+    'attacks[0].damage'.  Every name is replaced by a placeholder so reserved
+    words (e.g. name, text, number) can be used.
+    """
+    names = {}
+    paths = []
+    for field in fields:
+        path = []
+        for element in field.split('.'):
+            attribute, bracket, index = element.partition('[')
+            if attribute not in names:
+                names[attribute] = '#p{}'.format(len(names))
+            path.append(names[attribute] + bracket + index)
+        paths.append('.'.join(path))
+    return {'ProjectionExpression': ', '.join(paths),
+            'ExpressionAttributeNames': {placeholder: attribute
+                                         for attribute, placeholder
+                                         in names.items()}}
+
+
+def card_key(cardid):
+    """ return the card table key {set_code, number} for a card id
+
+    For some sets, card number contains alpha characters, these are always
+    uppercase, card ids are not. e.g. g1-rc15 vs. g1 RC15
+    """
+    [cardset, cardnumber] = cardid.rsplit('-', 1)
+    return {'set_code': cardset, 'number': cardnumber.upper()}
+
+
+def intersect_ids(sources):
+    """ return the card ids in every one of the lists in sources, in the
+    order of the first list and without repeats
+    """
+    others = [set(source) for source in sources[1:]]
+    seen = set()
+    cardids = []
+    for cardid in sources[0]:
+        if cardid not in seen and all(cardid in other for other in others):
+            seen.add(cardid)
+            cardids.append(cardid)
+    return cardids
+
+
+def get_item(table, key, max_retries=10, **get_kw):
+    """ GetItem with backoff on throttling, returns the item or None """
+    retries = 0
+    while True:
+        try:
+            return _limited(_limiter(table.name), table.get_item, 1,
+                            table.name, dict(_request_kw(get_kw), Key=key)
+                            ).get('Item')
+        except ClientError as err:
+            if (err.response['Error']['Code'] not in RETRY_EXCEPTIONS or
+                    retries == max_retries):
+                raise
+            backoff(retries)
+            retries = retries + 1
+
+
+def batch_get_items(table, keys, max_retries=10, **get_kw):
+    """ Fetch items by key with BatchGetItem, 100 keys per request
+
+    UnprocessedKeys and throttling are retried with capped exponential
+    backoff.  Keys which don't exist are skipped.  Items are returned in no
+    particular order.
+
+    get_kw -- added to the request for the table (e.g. ProjectionExpression)
+    """
+    client = table.meta.client
+    items = []
+    # BatchGetItem rejects requests which contain the same key twice
+    uniquekeys = []
+    for key in keys:
+        if key not in uniquekeys:
+            uniquekeys.append(key)
+    keys = uniquekeys
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request = dict(get_kw, Keys=keys[i:i + BATCH_GET_SIZE])
+        retries = 0
+        while request:
+            try:
+                response = _limited(
+                    _limiter(table.name), client.batch_get_item,
+                    len(request['Keys']), table.name,
+                    {'RequestItems': {table.name: request}})
+                items.extend(response['Responses'].get(table.name, []))
+                request = response.get('UnprocessedKeys', {}).get(table.name)
+                if not request:
+                    break
+            except ClientError as err:
+                if err.response['Error']['Code'] not in RETRY_EXCEPTIONS:
+                    raise
+            if retries == max_retries:
+                raise Exception('Gave up reading batch from {} after {} '
+                                'retries'.format(table.name, retries))
+            backoff(retries)
+            retries = retries + 1
+    return items
+
+
+def query_pages(table, max_retries=10, plain=False, **query_kw):
+    """ Query the table, yielding each page of items
+
+    plain -- return numbers as int/float rather than Decimal, see
+             plain_client
+    query_kw -- passed through to query (e.g. KeyConditionExpression)
+    """
+    client = table.meta.client
+    plain = _plain(table, plain)
+    if plain:
+        client = plain_client(table)
+        query_kw = plain_request_kw(query_kw)
+    query_kw['TableName'] = table.name
+    retries = 0
+    while True:
+        try:
+            response = _limited(
+                _limiter(table.name, index=query_kw.get('IndexName')),
+                client.query, 1, table.name, _request_kw(query_kw))
+        except ClientError as err:
+            if (err.response['Error']['Code'] not in RETRY_EXCEPTIONS or
+                    retries == max_retries):
+                raise
+            backoff(retries)
+            retries = retries + 1
+            continue
+        retries = 0
+        yield _items(response, plain)
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        query_kw['ExclusiveStartKey'] = last_key
+
+
+def query_items(table, plain=False, **query_kw):
+    """ Query the table and return a list of all the items """
+    items = []
+    for page in query_pages(table, plain=plain, **query_kw):
+        items.extend(page)
+    return items
+
+
+# Low level clients, without boto3's Decimal (de)serialization, by endpoint
+_plain_clients = {}
+_plain_clients_lock = threading.Lock()
+
+
+def plain_client(table):
+    """ Return a low level DynamoDB client for the table's endpoint
+
+    The resource layer deserializes every number into a Decimal.  Requests
+    made through this client return raw attribute values, which _items
+    decodes with plain_value straight into int and float.
+    """
+    meta = table.meta.client.meta
+    key = (meta.endpoint_url, meta.region_name)
+    with _plain_clients_lock:
+        if key not in _plain_clients:
+            _plain_clients[key] = boto3.client(
+                'dynamodb', endpoint_url=meta.endpoint_url,
+                region_name=meta.region_name)
+        return _plain_clients[key]
+
+
+def _plain(table, plain):
+    """ plain, unless the table's client already returns int/float (e.g. a
+    storage.SQLiteTable)
+    """
+    return plain and not getattr(table.meta.client, 'plain', False)
+
+
+def plain_request_kw(request_kw):
+    """ Convert resource style request arguments for plain_client
+
+    Condition objects (Key/Attr) are built into expression strings with
+    their placeholders and values are serialized to attribute values.
+    """
+    request_kw = dict(request_kw)
+    builder = ConditionExpressionBuilder()
+    serializer = TypeSerializer()
+    names = dict(request_kw.get('ExpressionAttributeNames', {}))
+    values = {placeholder: serializer.serialize(value)
+              for placeholder, value
+              in request_kw.get('ExpressionAttributeValues', {}).items()}
+    for argument in ('KeyConditionExpression', 'FilterExpression'):
+        condition = request_kw.get(argument)
+        if isinstance(condition, ConditionBase):
+            expression = builder.build_expression(
+                condition,
+                is_key_condition=argument == 'KeyConditionExpression')
+            request_kw[argument] = expression.condition_expression
+            names.update(expression.attribute_name_placeholders)
+            values.update(
+                (placeholder, serializer.serialize(value))
+                for placeholder, value
+                in expression.attribute_value_placeholders.items())
+    if names:
+        request_kw['ExpressionAttributeNames'] = names
+    if values:
+        request_kw['ExpressionAttributeValues'] = values
+    return request_kw
+
+
+def _items(response, plain=False):
+    """ the Items of a response, decoded if it came from a plain_client """
+    items = response['Items']
+    if plain:
+        items = [{name: plain_value(value) for name, value in item.items()}
+                 for item in items]
+    return items
+
+
+def plain_value(value):
+    """ Decode a DynamoDB attribute value, numbers become int or float
+
+    Numbers are converted the same way as querycard.replace_decimals: whole
+    numbers become int, anything else a float.
+    """
+    [(kind, data)] = value.items()
+    if kind == 'S':
+        return data
+    if kind == 'N':
+        return _plain_number(data)
+    if kind == 'M':
+        return {name: plain_value(item) for name, item in data.items()}
+    if kind == 'L':
+        return [plain_value(item) for item in data]
+    if kind == 'BOOL':
+        return data
+    if kind == 'NULL':
+        return None
+    if kind == 'SS':
+        return set(data)
+    if kind == 'NS':
+        return set(_plain_number(number) for number in data)
+    if kind == 'BS':
+        return set(data)
+    # 'B'
+    return data
+
+
+def _plain_number(data):
+    """ int or float for a DynamoDB number string """
+    try:
+        return int(data)
+    except ValueError:
+        number = float(data)
+        return int(number) if number.is_integer() else number
+
+
+def legality_index_name(season, legalformat):
+    """ name of the sparse GSI of cards legal in a season's format """
+    return '{}_{}-index'.format(season, legalformat)
+
+
+def legality_index_attribute(season, legalformat):
+    """ name of the sparse attribute keying legality_index_name
+
+    The attribute only exists on cards which are legal in the format and
+    holds the card's supertype, so the index can be queried per supertype.
+    """
+    return '{}_{}_idx'.format(season, legalformat)
+
+
+def indexed_seasons(seasons):
+    """ the seasons given legality indexes, the INDEXED_SEASONS most recent
+    """
+    return sorted(seasons)[-INDEXED_SEASONS:]
+
+
+def is_legality_index(indexname):
+    """ True if indexname is a legality_index_name """
+    return any(indexname.endswith('_{}-index'.format(legalformat))
+               for legalformat in LEGALITY_FORMATS)
+
+
+def card_indexes(seasons, provisioned_throughput=None):
+    """ return (GlobalSecondaryIndexes, AttributeDefinitions) for the card
+    table
+
+    Indexes are created for the querycard access patterns:
+        name-index -- cards by name
+        supertype-index -- cards by supertype, sorted by name
+        <season>_<format>-index -- sparse index of legal cards by supertype,
+                                   for the indexed_seasons only
+
+    provisioned_throughput -- applied to each index, None for on-demand
+    """
+    def _index(name, hashkey, rangekey):
+        index = {
+            'IndexName': name,
+            'KeySchema': [
+                {'AttributeName': hashkey, 'KeyType': 'HASH'},
+                {'AttributeName': rangekey, 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'ALL'}}
+        if provisioned_throughput:
+            index['ProvisionedThroughput'] = provisioned_throughput
+        return index
+
+    indexes = [_index('name-index', 'name', 'id'),
+               _index('supertype-index', 'supertype', 'name')]
+    attributes = ['name', 'id', 'supertype']
+    for season in indexed_seasons(seasons):
+        for legalformat in LEGALITY_FORMATS:
+            attribute = legality_index_attribute(season, legalformat)
+            indexes.append(_index(legality_index_name(season, legalformat),
+                                  attribute, 'name'))
+            attributes.append(attribute)
+    return indexes, [{'AttributeName': attribute, 'AttributeType': 'S'}
+                     for attribute in attributes]
+
+
+def update_legality_index(item, seasons):
+    """ set or remove the sparse legality index attributes on a card from
+    its '<season>_<format>' legality flags
+
+    Only the indexed_seasons have the attributes, they are removed for the
+    other seasons.
+    """
+    indexed = indexed_seasons(seasons)
+    for season in seasons:
+        for legalformat in LEGALITY_FORMATS:
+            attribute = legality_index_attribute(season, legalformat)
+            if (season in indexed and
+                    item.get('{}_{}'.format(season, legalformat)) is True and
+                    item.get('supertype')):
+                item[attribute] = item['supertype']
+            else:
+                item.pop(attribute, None)
+
+
+def bump_generation(settable):
+    """ Record a new generation of the card data in the set table
+
+    Called by loadcards whenever the tables change, anything cached from an
+    earlier generation (e.g. querycard results) is then out of date.
+    Returns the new generation.
+    """
+    generation = uuid.uuid4().hex
+    settable.put_item(Item={'code': GENERATION_CODE,
+                            'generation': generation,
+                            'updated': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                     time.gmtime())})
+    logger.info('{} generation is now {}'.format(settable.name, generation))
+    return generation
+
+
+def table_generation(settable):
+    """ Return the current generation recorded in the set table, None if
+    there isn't one (or the table doesn't exist)
+    """
+    try:
+        item = get_item(settable, {'code': GENERATION_CODE},
+                        ConsistentRead=True)
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ResourceNotFoundException':
+            raise
+        return None
+    return item['generation'] if item else None
+
+
+def content_hash(item):
+    """ Return a hash of an item's content, ignoring its CONTENT_HASH
+
+    Numbers read back from the table as Decimal hash the same as the int or
+    float they were written as.
+    """
+    content = {name: value for name, value in item.items()
+               if name != CONTENT_HASH}
+    return hashlib.sha1(json.dumps(
+        content, sort_keys=True, ensure_ascii=False,
+        default=_hash_default).encode('utf-8')).hexdigest()
+
+
+def _hash_default(value):
+    """ json.dumps default for content_hash """
+    if isinstance(value, Decimal):
+        return _plain_number(str(value))
+    return str(value)
+
+
+def item_hashes(table, key_schema, segments=1):
+    """ Return {key tuple: CONTENT_HASH} for every item in the table
+
+    Only the keys and hashes are read (though a scan is charged for the whole
+    items).  Items without a hash map to None.  The generation marker in the
+    set table is left out.
+    """
+    keynames = [keyattribute['AttributeName'] for keyattribute in key_schema]
+    hashes = {}
+    for item in scan_items(table, segments=segments, plain=True,
+                           **projection(keynames + [CONTENT_HASH])):
+        key = tuple(item[keyname] for keyname in keynames)
+        if key == (GENERATION_CODE,):
+            continue
+        hashes[key] = item.get(CONTENT_HASH)
+    return hashes
@@ -0,0 +1,184 @@
+''' Dump the card table back out to per-set json files, the reverse of
+loadcards.
+'''
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import tcgdata.cardfiles as cardfiles
+import tcgdata.dbtools as dbtools
+import tcgdata.storage as storage
+
+logger = logging.getLogger(__name__)
+
+# Nested attributes loadcards adds, which filecard drops without a warning
+LOADED_KEYS = {'.attacks': ['damageBase', 'damageModifier']}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Dump the card table to per-set json files')
+    parser.add_argument('--carddir', nargs=1, required=True,
+                        help='directory to write the set files to')
+    parser.add_argument('--formats', nargs='?', type=argparse.FileType('r'),
+                        required=False, default='formats.json',
+                        help='formats json file')
+    parser.add_argument('-t', '--test', action='store_true', required=False,
+                        help='dump the test table')
+    parser.add_argument('-l', '--localdb', action='store_true',
+                        help='use local database', required=False)
+    parser.add_argument('--sqlite', required=False, metavar='PATH',
+                        help='use an SQLite database file instead of '
+                        'dynamodb')
+    parser.add_argument('--segments', type=int, default=4, required=False,
+                        help='number of parallel scan segments')
+    parser.add_argument('--jobs', '-j', type=int, required=False, default=4,
+                        help='number of set files to write in parallel')
+    parser.add_argument('--capacity', type=float, default=0.9,
+                        required=False,
+                        help="fraction of the table's provisioned read "
+                        "capacity to use, 0 for no limit (not limited with "
+                        "--localdb)")
+    parser.add_argument('-d', '--debug', action="store_const",
+                        help="Print lots of debugging statements",
+                        dest="loglevel", const=logging.DEBUG,
+                        default=logging.WARNING)
+    parser.add_argument("-v", "--verbose", action="store_const",
+                        help="increase output verbosity",
+                        dest='loglevel', const=logging.INFO)
+    args = parser.parse_args()
+
+    # Set log level and configure log formatter
+    logger.setLevel(args.loglevel)
+    logFormatter = logging.Formatter(
+        '%(asctime)s [%(filename)s] [%(funcName)s] [%(levelname)s] ' +
+        '[%(lineno)d] %(message)s')
+    logger.handlers = []
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setFormatter(logFormatter)
+    logger.addHandler(consoleHandler)
+
+    if not os.path.isdir(args.carddir[0]):
+        print('--carddir must be a directory')
+        sys.exit(2)
+    formats = json.load(args.formats)
+
+    # Get the service resource.
+    dynamodb = storage.connect(args.localdb, args.sqlite)
+    cardtable = dynamodb.Table('test_cards' if args.test else 'tcg_cards')
+    if not args.localdb:
+        dbtools.throttle(cardtable, args.capacity)
+
+    sets = scan_sets(cardtable, formats['keyorder'], args.segments)
+    cardcount = 0
+    for setcode, set_file_name, cardtotal, changed in write_sets(
+            args.carddir[0], sets, formats['setfiles'], args.jobs):
+        print('Dumping set {} to {} ({} cards, {})'.format(
+            setcode, set_file_name, cardtotal,
+            'changed' if changed else 'unchanged'))
+        cardcount = cardcount + cardtotal
+    print('Dumped {} cards from {}'.format(cardcount, cardtable.name))
+
+
+def scan_sets(table, keyorder, segments=4):
+    """ Scan the card table and return {setcode: [cards]}
+
+    The segments are scanned in parallel and each card is routed to its set
+    as it arrives, converted back to the card file format (see filecard).
+    The cards of each set are in card number order.
+    """
+    sets = {}
+    for page in dbtools.scan_pages(table, segments=segments, plain=True):
+        for item in page:
+            sets.setdefault(item['set_code'], []).append(
+                filecard(item, keyorder))
+    for cards in sets.values():
+        cards.sort(key=lambda card: number_key(card['number']))
+    logger.info('Scanned {} sets from {}'.format(len(sets), table.name))
+    return sets
+
+
+def write_sets(dirpath, sets, setfiles, jobs=4):
+    """ Write each set with cardfiles.writeset across a thread pool
+
+    Sets not listed in setfiles are written to '<setcode>.json'.  Yields
+    (setcode, set file name, number of cards, True if the file changed) in
+    setcode order.
+    """
+    for setcode in sets:
+        if setcode not in setfiles:
+            logger.warning('{} is not in setfiles, writing {}.json'.format(
+                setcode, setcode))
+    names = {setcode: setfiles.get(setcode, setcode + '.json')
+             for setcode in sorted(sets)}
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        written = {setcode: executor.submit(
+            cardfiles.writeset, os.path.join(dirpath, name), sets[setcode])
+            for setcode, name in names.items()}
+        for setcode, name in names.items():
+            yield setcode, name, len(sets[setcode]), written[setcode].result()
+
+
+def filecard(item, keyorder):
+    """ Return a card table item in the card file format
+
+    Top level attributes are renamed from snake_case back to camelCase and
+    those loadcards adds (legality, set data, reprints, attack damageBase...)
+    which aren't in keyorder are dropped.  Any other nested keys which aren't
+    in keyorder are dropped with a warning.  Keys, including those of nested
+    attacks, abilities etc., are ordered by keyorder (see cardfiles.sortdict).
+    """
+    card = {}
+    for name, value in item.items():
+        name = camelcase(name)
+        if name not in keyorder['.']:
+            continue
+        # The table returns map attributes in no particular order, sortdict
+        # checks nested keys but only orders the top level
+        prefix = '.' + name
+        if prefix in keyorder:
+            if isinstance(value, dict):
+                value = cardfiles.sortdict(
+                    _known(value, keyorder[prefix], prefix, item.get('id')),
+                    keyorder[prefix])
+            elif isinstance(value, list):
+                value = [cardfiles.sortdict(
+                    _known(entry, keyorder[prefix], prefix, item.get('id')),
+                    keyorder[prefix]) if isinstance(entry, dict) else entry
+                    for entry in value]
+        card[name] = value
+    return cardfiles.sortdict(card, keyorder)
+
+
+def _known(entry, keys, prefix, cardid):
+    """ entry without the keys which aren't in keys, logging those which
+    loadcards doesn't add (see LOADED_KEYS) as they are lost from the dump
+    """
+    unknown = [name for name in entry
+               if name not in keys and name not in LOADED_KEYS.get(prefix, [])]
+    if unknown:
+        logger.warning('Dropping {} from {} of {}, not in keyorder'.format(
+            ', '.join(sorted(unknown)), prefix, cardid))
+    return {name: value for name, value in entry.items() if name in keys}
+
+
+def camelcase(name):
+    """ national_pokedex_number -> nationalPokedexNumber """
+    first, *rest = name.split('_')
+    return first + ''.join(word.capitalize() for word in rest)
+
+
+def number_key(number):
+    """ sort key putting card numbers in natural order, e.g. 2 before 10 and
+    RC2 before RC10
+    """
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part)
+            for part in re.findall(r'\d+|\D+', number)]
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 ''' Search through database and detect reprints '''
 import builtins
 import os
-import boto3
 import json
 import argparse
 import sys
@@ -14,6 +13,8 @@ from boto3.dynamodb.conditions import Key, Attr
 from fuzzywuzzy import fuzz
 from tcgdata.forms import Form, create_compare_form
 from tcgdata.forms import display_cards, review_cards_manually
+import tcgdata.dbtools as dbtools
+import tcgdata.storage as storage
 
 logger = logging.getLogger(__name__)
 # trootlogger=logging.getLogger()
@@ -65,6 +66,18 @@ def main():
                         help='find hard matches', required=False)
     parser.add_argument('-l', '--localdb', action='store_true',
                         help='use local database', required=False)
+    parser.add_argument('--sqlite', required=False, metavar='PATH',
+                        help='use an SQLite database file instead of '
+                        'dynamodb')
+    parser.add_argument('--segments', type=int, default=1, required=False,
+                        help='number of parallel scan segments (default 1), '
+                        'cards are compared in scan order so --startindex '
+                        'needs a single segment')
+    parser.add_argument('--capacity', type=float, default=0.9,
+                        required=False,
+                        help="fraction of the table's provisioned read "
+                        "capacity to use, 0 for no limit (not limited with "
+                        "--localdb)")
     parser.add_argument('-d', '--debug', action="store_const",
                         help="Set debug for local functions",
                         dest="loglevel", const=logging.DEBUG,
@@ -117,25 +130,27 @@ def main():
             'reprintsfile \'{}\' must exist in order to use '
             '--startindex'.format(args.reprintsfile[0]))
         sys.exit(2)
+    if args.startindex and args.segments > 1:
+        parser.error('--startindex can\'t be used with --segments, the order '
+                     'of a parallel scan isn\'t the order of a single one')
+        sys.exit(2)
 
     is_easymode = True if args.easy else False
 
     # Get the service resource.
-    if args.localdb:
-        dynamodb = boto3.resource(
-            'dynamodb', endpoint_url='http://localhost:8000')
-    else:
-        dynamodb = boto3.resource('dynamodb')
+    dynamodb = storage.connect(args.localdb, args.sqlite)
 
     cardbase_name = 'tcg_cards'
     cardtable = dynamodb.Table(cardbase_name)
 
     print('Connected to table {} created at {}\n'.format(
         cardbase_name, cardtable.creation_date_time))
+    if not args.localdb:
+        dbtools.throttle(cardtable, args.capacity)
 
     # if cardfilter = None, get all cards
     cardfilter = None
-    cards = query_cards(cardtable, cardfilter)
+    cards = query_cards(cardtable, cardfilter, args.segments)
 
     # initialise errorlist - if the file exists, load the json files
     if args.errorfile and os.path.isfile(args.errorfile[0]):
@@ -421,33 +436,16 @@ def find_reprints_pokemon(cards, index, find_easy=False):
         return reprintdict
 
 
-def query_cards(cardtable, filter):
-    """ Query the cardtable with the filter and return a list pokemon """
-
-    # We cannot begin with ExclusiveStartKey=None, so we use kwargs sans that
-    # the first time, then update to include it subsequently.
-    scan_kw = {}
-    if filter:
-        scan_kw.update({'FilterExpression': filter})
-    retries = 0
-    pokemon = []
-    while True:
-        try:
-            response = cardtable.scan(**scan_kw)
-            pokemon.extend(response['Items'])
-            last_key = response.get('LastEvaluatedKey')
-            print('len={} response[Count]={} last_key={}'.format(
-                len(pokemon), response['Count'], last_key))
-            if not last_key:
-                break
-            retries = 0          # if successful, reset count
-            scan_kw.update({'ExclusiveStartKey': last_key})
-        except ClientError as err:
-            if err.response['Error']['Code'] not in RETRY_EXCEPTIONS:
-                raise
-            print('WHOA, too fast, slow it down retries={}'.format(retries))
-            sleep(2 ** retries)
-            retries += 1     # TODO max limit
+def query_cards(cardtable, filter, segments=1):
+    """ Query the cardtable with the filter and return a list pokemon
+
+    Numbers are returned as int/float (see dbtools.plain_client).
+
+    segments -- number of parallel scan segments, see dbtools.scan_pages
+    """
+    pokemon = dbtools.scan_items(cardtable, filter, segments=segments,
+                                 plain=True)
+    print('len={}'.format(len(pokemon)))
     return pokemon
 
 
@@ -14,6 +14,7 @@ from fuzzywuzzy import fuzz
 from tcgdata.forms import Form, create_compare_form
 from tcgdata.forms import display_cards, review_cards_manually
 from tcgdata.cardfiles import readfiles, writefiles
+from tcgdata.nameindex import NameIndex
 import pylogging
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,8 @@ errorlist = []
 nomatchlist = {}
 forcematchlist = {}
 reprintslist = []
+# NameIndex of the cards, set by --namecandidates
+nameindex = None
 
 
 # Create custom exception for when Quit is chosen on the gui
@@ -36,6 +39,7 @@ def main():
     global nomatchlist
     global forcematchlist
     global reprintlist
+    global nameindex
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--hard', action='store_true',
@@ -57,6 +61,10 @@ def main():
     parser.add_argument('--formatsfile', type=argparse.FileType('r'),
                         required=False, default='formats.json',
                         help='formats json file')
+    parser.add_argument('--namecandidates', action='store_true',
+                        help='only compare cards with names close enough '
+                        'to be reprints, found with a name index, rather '
+                        'than every later card')
 
     # add logging arguments
     pylogging.add_arguments(parser)
@@ -100,6 +108,11 @@ def main():
     # Load the cards
     logger.info('Reading cards from {}'.format(args.carddir))
     cards = readfiles(args.carddir, formats['setfiles'])
+    if args.namecandidates:
+        nameindex = NameIndex()
+        for card in cards:
+            nameindex.add(card)
+        logger.info('Indexed {} names'.format(len(nameindex.names)))
 
     # initialise errorlist - if the file exists, load the json files
     if args.errorfile and os.path.isfile(args.errorfile):
@@ -268,11 +281,14 @@ def find_card_reprints(index, cards, find_easy=False):
     compare_response = {}
     reprintdict = {}
     card1 = cards[index]
+    candidates = name_candidates(card1)
     if find_easy:
         # check each card starting from the next card in the index, it is
         # presumed that the earlier cards have already been checked.
         for k in range(index + 1, len(cards)):
             card2 = cards[k]
+            if candidates is not None and card2['id'] not in candidates:
+                continue
             if compare_cards_easy(card1, card2)['matchlevel'] == 1:
                 if len(reprintdict) == 0:
                     reprintdict[card1['name']] = [card1['id']]
@@ -285,6 +301,8 @@ def find_card_reprints(index, cards, find_easy=False):
     # It's a detailed/fuzzy search (hard)
     for k in range(index + 1, len(cards)):
         card2 = cards[k]
+        if candidates is not None and card2['id'] not in candidates:
+            continue
 
         # first check the nomatches dictionary, if the cards are there, we
         # already know they don't match - so move along
@@ -412,6 +430,16 @@ def find_card_reprints(index, cards, find_easy=False):
         return reprintdict
 
 
+def name_candidates(card):
+    """ ids of the cards whose names are close enough to card's to be
+        reprints (and those forced to match it), None to compare every card
+    """
+    if nameindex is None:
+        return None
+    return (nameindex.candidates(card['name']) |
+            set(forcematchlist.get(card['id'], [])))
+
+
 def compare_cards_easy(card1, card2):
     """ Compare two pokémon cards
 
@@ -0,0 +1,117 @@
+''' What the card indexes (textindex, nameindex, attackindex) share: the
+json file they are saved to, the script building them from the card files
+and how words are normalized
+'''
+import abc
+import argparse
+import json
+import logging
+import os
+import re
+import unicodedata
+import tcgdata.cardfiles as cardfiles
+
+logger = logging.getLogger(__name__)
+
+
+def words(text):
+    """ lower case words of text without accents or apostrophes, e.g.
+    "Opponent's Pokémon" -> ['opponents', 'pokemon']
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r'[a-z0-9]+', re.sub(r"['’]", '', text))
+
+
+class IndexFile(abc.ABC):
+    """ Base class of the indexes saved to a json file
+
+    Subclasses set kind (for messages) and version, bumped when the file
+    format changes, and implement add, summary, to_json and from_json.
+    """
+
+    kind = 'index'
+    version = None
+
+    @abc.abstractmethod
+    def add(self, card):
+        """ index a card """
+
+    @abc.abstractmethod
+    def summary(self):
+        """ what was indexed, e.g. '120 names' """
+
+    @abc.abstractmethod
+    def to_json(self):
+        """ dict of the index's data to save """
+
+    @classmethod
+    @abc.abstractmethod
+    def from_json(cls, data):
+        """ index from the dict to_json returned """
+
+    def save(self, path):
+        """ write the index to a json file """
+        data = dict(self.to_json(), version=self.version)
+        tmppath = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmppath, 'w', encoding='utf-8') as index_file:
+            json.dump(data, index_file, ensure_ascii=False,
+                      separators=(',', ':'))
+        os.replace(tmppath, path)
+
+    @classmethod
+    def load(cls, path):
+        """ read an index written by save, None if there isn't a usable
+        one
+        """
+        try:
+            with open(path, encoding='utf-8') as index_file:
+                data = json.load(index_file)
+        except (OSError, ValueError) as e:
+            logger.warning('Can\'t read {} {}: {}'.format(cls.kind, path, e))
+            return None
+        if data.get('version') != cls.version:
+            logger.warning('{} is out of date, rebuild it'.format(path))
+            return None
+        return cls.from_json(data)
+
+
+def build_main(indexclass, description, default_output):
+    """ main of the scripts building an index from the card files
+
+        indexclass -- IndexFile subclass to build
+        description -- the script's description
+        default_output -- index file written if --output isn't given
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--carddir', nargs=1, required=True,
+                        help='directory of the set files')
+    parser.add_argument('--formats', nargs='?', type=argparse.FileType('r'),
+                        required=False, default='formats.json',
+                        help='formats json file')
+    parser.add_argument('--output', '-o', default=default_output,
+                        required=False,
+                        help='index file to write (default {})'.format(
+                            default_output))
+    parser.add_argument('-d', '--debug', action="store_const",
+                        help="Print lots of debugging statements",
+                        dest="loglevel", const=logging.DEBUG,
+                        default=logging.WARNING)
+    parser.add_argument("-v", "--verbose", action="store_const",
+                        help="increase output verbosity",
+                        dest='loglevel', const=logging.INFO)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel)
+
+    formats = json.load(args.formats)
+    index = indexclass()
+    for setcode, setfile in formats['setfiles'].items():
+        set_file_path = os.path.join(args.carddir[0], setfile)
+        if not os.path.isfile(set_file_path):
+            logger.warning('Skipping {}, {} not found'.format(setcode,
+                                                               set_file_path))
+            continue
+        for card in cardfiles.readset(set_file_path):
+            index.add(card)
+    index.save(args.output)
+    print('Indexed {} to {}'.format(index.summary(), args.output))
@@ -0,0 +1,82 @@
+''' Card legality compiled from the seasons section of formats.json '''
+import json
+
+# Formats which have a legality flag ('<season>_<format>') on each card
+LEGALITY_FORMATS = ['standard', 'expanded']
+
+
+class LegalityIndex(object):
+    """ The season rules of formats.json compiled for O(1) legality checks
+
+    Each '<season>_<format>' flag is given a bit.  Set codes map to the mask
+    of the flags they are legal for, banned card ids to the mask of the flags
+    they are banned from, and split sets (where only cards from a number up
+    are legal) to a list of (bit, number prefix, minimum number) rules.
+    """
+
+    def __init__(self, seasons):
+        """ seasons -- the seasons section of formats.json """
+        self.flags = []
+        self.bits = {}
+        self.sets = {}
+        self.banned = {}
+        self.split_sets = {}
+        for season in seasons:
+            for legalformat in LEGALITY_FORMATS:
+                bit = 1 << len(self.flags)
+                self.flags.append('{}_{}'.format(season, legalformat))
+                self.bits[self.flags[-1]] = bit
+                for setcode in seasons[season][
+                        '{}_legal_sets'.format(legalformat)]:
+                    self.sets[setcode] = self.sets.get(setcode, 0) | bit
+                for cardid in seasons[season][
+                        'banned_{}_cards'.format(legalformat)]:
+                    self.banned[cardid] = self.banned.get(cardid, 0) | bit
+                # To date split sets are only standard legal promo series
+                for split_set in seasons[season].get(
+                        '{}_legal_split_sets'.format(legalformat), []):
+                    self.split_sets.setdefault(split_set['set'], []).append(
+                        (bit, split_set.get('number_prefix'),
+                         split_set['min']))
+
+    @classmethod
+    def from_file(cls, path):
+        """ compile the seasons of a formats.json file """
+        with open(path) as json_file:
+            return cls(json.load(json_file)['seasons'])
+
+    def mask(self, setcode, number, cardid):
+        """ Return the mask of the flags a card is legal for
+
+        Raises ValueError if the card is in a split set and its number
+        doesn't have the expected prefix.
+        """
+        mask = self.sets.get(setcode, 0)
+        banned = self.banned.get(cardid, 0)
+        for bit, prefix, minimum in self.split_sets.get(setcode, ()):
+            if banned & bit:
+                continue
+            if prefix:
+                if not number.startswith(prefix):
+                    # the expected prefix doesn't match the card information
+                    raise ValueError
+                cardnum = int(number.strip(prefix))
+            else:
+                cardnum = int(number)
+            if cardnum >= minimum:
+                mask = mask | bit
+        return mask & ~banned
+
+    def legality(self, setcode, number, cardid):
+        """ Return {'<season>_<format>': bool} for a card """
+        mask = self.mask(setcode, number, cardid)
+        return {flag: bool(mask & self.bits[flag]) for flag in self.flags}
+
+    def card_legality(self, card):
+        """ legality for a card record with set_code, number and id """
+        return self.legality(card['set_code'], card['number'], card['id'])
+
+    def is_legal(self, setcode, number, cardid, season, legalformat):
+        """ True if a card is legal in a season's format """
+        bit = self.bits.get('{}_{}'.format(season, legalformat), 0)
+        return bool(self.mask(setcode, number, cardid) & bit)
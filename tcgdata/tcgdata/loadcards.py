@@ -1,18 +1,35 @@
 ''' Load cards into the database and/or optionally post-process the data '''
-import boto3
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Attr
 
 # For creating an outputfile of changes
 from dictdiffer import diff
 from pprint import pformat
-from deepdiff import DeepDiff
 from copy import deepcopy
 
+import codecs
 import json
 import argparse
 import logging
-import re
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+import tcgdata.cardfilters as cardfilters
+import tcgdata.dbtools as dbtools
+import tcgdata.storage as storage
+import tcgdata.textindex as textindex
+import tcgdata.nameindex as nameindex
+import tcgdata.attackindex as attackindex
+import tcgdata.changes as changes
+from tcgdata.legality import LegalityIndex
+
+# Optional, faster incremental JSON parser, see iter_json_array
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 # Set up logging
 # logger = logging.getLogger(__name__).addHandler(logging.NullHandler)
@@ -44,6 +61,9 @@ logging.getLogger('boto3').setLevel(logging.WARNING)
             Effect to other player: no_items, no_supporter,
 """
 
+# Text rules applied to the cards (see the rules section of formats.json)
+LOAD_TEXT_RULES = ['x_to_times', 'quote_to_apostrophe', 'clean_attack_text']
+
 
 def main():
 
@@ -60,6 +80,10 @@ def main():
         action='store_true', help='use local database instad of dynamodb',
         required=False
     )
+    parser.add_argument(
+        '--sqlite', required=False, metavar='PATH',
+        help='use an SQLite database file instead of dynamodb'
+    )
     parsegroup.add_argument(
         '-kdb', '--killdb',
         action='store_true', help='delete databases if needed',
@@ -85,14 +109,64 @@ def main():
         help="Process existing table", action="store_true",
         required=False
     )
+    parsegroup.add_argument(
+        "--sync", action="store_true", required=False,
+        help="update existing tables in place, writing and deleting only "
+        "the items which differ from the local files"
+    )
+    parser.add_argument(
+        "--textindex", nargs='?', const=textindex.TEXT_INDEX_FILE,
+        required=False, metavar='PATH',
+        help="also build the text search index used by querycards --search "
+        "(default {})".format(textindex.TEXT_INDEX_FILE)
+    )
+    parser.add_argument(
+        "--nameindex", nargs='?', const=nameindex.NAME_INDEX_FILE,
+        required=False, metavar='PATH',
+        help="also build the fuzzy name index used by querycards "
+        "--fuzzyname (default {})".format(nameindex.NAME_INDEX_FILE)
+    )
+    parser.add_argument(
+        "--attackindex", nargs='?', const=attackindex.ATTACK_INDEX_FILE,
+        required=False, metavar='PATH',
+        help="also build the damage, cost and HP index used by querycards "
+        "--damage, --cost and --hp (default {})".format(
+            attackindex.ATTACK_INDEX_FILE)
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, required=False,
+        help="number of threads writing batches to the tables"
+    )
+    parser.add_argument(
+        "--ondemand", action="store_true", required=False,
+        help="create the tables with on-demand (pay per request) billing"
+    )
+    parser.add_argument(
+        "--rcu", type=int, default=1, required=False,
+        help="provisioned read capacity units for new tables (default 1)"
+    )
+    parser.add_argument(
+        "--wcu", type=int, default=1, required=False,
+        help="provisioned write capacity units for new tables (default 1)"
+    )
+    parser.add_argument(
+        "--bulkwcu", type=int, required=False,
+        help="raise the card table's write capacity to this while loading "
+        "and restore it afterwards (provisioned tables only, DynamoDB limits "
+        "how often capacity can be decreased)"
+    )
+    parser.add_argument(
+        "--capacity", type=float, default=0.9, required=False,
+        help="fraction of the tables' provisioned capacity to use, 0 for no "
+        "limit (not limited with --localdb)"
+    )
     args = parser.parse_args()
 
     # Get the service resource.
-    if args.localdb:
-        dynamodb = boto3.resource(
-            'dynamodb', endpoint_url='http://localhost:8000')
-    else:
-        dynamodb = boto3.resource('dynamodb')
+    dynamodb = storage.connect(args.localdb, args.sqlite)
+
+    # DynamoDB local doesn't enforce provisioned capacity
+    capacity = 0 if args.localdb or args.sqlite else args.capacity
 
     # Set log level and configure log formatter
     logger.setLevel(args.loglevel)
@@ -137,15 +211,16 @@ def main():
     cardbase_AttributeDefinitions = [
         {'AttributeName': 'set_code', 'AttributeType': 'S'},
         {'AttributeName': 'number', 'AttributeType': 'S'}]
-    cardbase_ProvisionedThroughput = {
-        'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+    # None for on-demand billing
+    cardbase_ProvisionedThroughput = None if args.ondemand else {
+        'ReadCapacityUnits': args.rcu, 'WriteCapacityUnits': args.wcu}
 
     setbase_KeySchema = [
         {'AttributeName': 'code', 'KeyType': 'HASH'}]
     setbase_AttributeDefinitions = [
         {'AttributeName': 'code', 'AttributeType': 'S'}]
-    setbase_ProvisionedThroughput = {
-        'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+    setbase_ProvisionedThroughput = None if args.ondemand else {
+        'ReadCapacityUnits': args.rcu, 'WriteCapacityUnits': args.wcu}
 
     # Get existing DynamoDB table names
     existing_tables = []
@@ -154,7 +229,7 @@ def main():
     logger.info('found existing table names {}'.format(existing_tables))
 
     # If database exists and wasn't told to delete first, exit.
-    if not args.postprocess:
+    if not args.postprocess and not args.sync:
         for name in [cardbase_name, setbase_name]:
             if name in existing_tables and not args.killdb:
                 logger.error(
@@ -170,11 +245,13 @@ def main():
     tcgdata['sets'] = {}
     tcgdata['reprints'] = []
     with open(formats_initfile) as json_file:
-        items = json.load(json_file)
+        items = formats = json.load(json_file)
         for item in items:
             if item == 'seasons' or item == 'abbreviations':
                 for entry in items[item]:
                     tcgdata[item][entry] = items[item][entry]
+    # Compile the season rules once for update_card_legality
+    tcgdata['legality'] = LegalityIndex(tcgdata['seasons'])
 
     # Load reprints file - generated by find_reprints script
     try:
@@ -191,6 +268,10 @@ def main():
     # same card name
     for i_reprint in reprints:
         tcgdata['reprints'].append(i_reprint)
+    # The reprint data and legality is set on the cards as they are loaded
+    tcgdata['reprintgroups'] = reprint_groups(tcgdata['reprints'],
+                                              tcgdata['legality'])
+    tcgdata['reprintcards'] = set()
 
     for season in tcgdata['seasons']:
         legalsets = ''
@@ -199,109 +280,374 @@ def main():
             legalsets = legalsets + tcgdata['abbreviations'][set]['abbr'] + ' '
         logger.info('Season {} Standard Format: {}'.format(season, legalsets))
 
+    # Secondary indexes on the card table for the querycard access patterns
+    (cardbase_GlobalSecondaryIndexes,
+     cardbase_IndexAttributeDefinitions) = dbtools.card_indexes(
+        tcgdata['seasons'], cardbase_ProvisionedThroughput)
+
     if not args.postprocess:
-        # Load sets into table and into memory
-        settable = create_table(dynamodb, setbase_name,
-                                setbase_KeySchema,
-                                setbase_AttributeDefinitions,
-                                setbase_ProvisionedThroughput,
-                                args.killdb, existing_tables)
-        if (settable):
-            tcgdata['sets'] = populate_table(settable, setbase_initfile,
-                                             setbase_KeySchema,
-                                             filters=[delete_nulls,
-                                                      remove_oldtags],
-                                             returndict=True)
-
-        '''
-        Thoughts on sets:
-            release_date is in format MM/DD/YYYY - can sort these by release
-                issue: promos, which may need to handle differently anyway as
-                the release dates per-card affect whether they are legal or not
-                for competative play.
-                * May want this also to maintain order, be able to access,ouput
-                sets in order.
-                Idea:
-
-                Errata - keep a json of errata.  Need to know the card/set, the
-                specific attribute of the errata (text, attack, energy, etc.)
-                and the updated value.
-                json:
-                    errata:{set, index, field, errata_update
-                    TODO: what to represent in the database?
-
-            Q: Are restored pokemon evolved?
-        '''
-        #  create and populate the tables.
-        cardtable = create_table(dynamodb, cardbase_name,
-                                 cardbase_KeySchema,
-                                 cardbase_AttributeDefinitions,
-                                 cardbase_ProvisionedThroughput,
-                                 args.killdb, existing_tables)
-        if (cardtable):
-            populate_table(cardtable, cardbase_initfile, cardbase_KeySchema,
-                           filters=[delete_nulls,
-                                    remove_oldtags,
-                                    sort_energy,
-                                    x_to_times,
-                                    quote_to_apostrophe,
-                                    clean_attack_text,
-                                    update_card_legality,
-                                    update_set_data],
-                           tcgdata=tcgdata,
-                           updatefile=updatefile)
-    # Postprocess
+        table_specs = [
+            table_spec(setbase_name,
+                       setbase_KeySchema,
+                       setbase_AttributeDefinitions,
+                       setbase_ProvisionedThroughput),
+            table_spec(cardbase_name,
+                       cardbase_KeySchema,
+                       cardbase_AttributeDefinitions +
+                       cardbase_IndexAttributeDefinitions,
+                       cardbase_ProvisionedThroughput,
+                       cardbase_GlobalSecondaryIndexes)]
+        # Sync updates the tables which exist and creates the others
+        if args.sync:
+            table_specs = [spec for spec in table_specs
+                           if spec['TableName'] not in existing_tables]
+        # Create both tables at once rather than one after the other
+        created = dict(zip([spec['TableName'] for spec in table_specs],
+                           create_tables(dynamodb, table_specs, args.killdb,
+                                         existing_tables)))
+        settable = created.get(setbase_name, dynamodb.Table(setbase_name))
+        cardtable = created.get(cardbase_name, dynamodb.Table(cardbase_name))
     else:
+        settable = dynamodb.Table(setbase_name)
         cardtable = dynamodb.Table(cardbase_name)
-
-    # Update reprints and legality based on reprint database
-    update_reprints_and_legality(
-        cardtable, tcgdata['reprints'], tcgdata['seasons'])
+    if (cardtable):
+        dbtools.throttle(cardtable, capacity)
+
+    # Existing tables may predate the indexes, or the indexed seasons
+    if cardbase_name in existing_tables and (args.postprocess or args.sync):
+        ensure_indexes(cardtable, cardbase_GlobalSecondaryIndexes,
+                       cardbase_IndexAttributeDefinitions,
+                       tcgdata['seasons'], cardbase_KeySchema,
+                       workers=args.workers)
+
+    # Invalidate cached query results before the tables change, and again
+    # once they are complete (below), so results cached mid-load don't last
+    if (settable):
+        dbtools.bump_generation(settable)
+
+    with bulk_write_capacity(cardtable, args.bulkwcu, capacity):
+        if not args.postprocess:
+            # Load sets into table and into memory
+            if (settable):
+                dbtools.throttle(settable, capacity)
+                tcgdata['sets'] = populate_table(settable, setbase_initfile,
+                                                 setbase_KeySchema,
+                                                 filters=[delete_nulls,
+                                                          remove_oldtags],
+                                                 returndict=True,
+                                                 workers=args.workers,
+                                                 sync=args.sync)
+
+            '''
+            Thoughts on sets:
+                release_date is in format MM/DD/YYYY - can sort these by
+                release issue: promos, which may need to handle differently
+                anyway as the release dates per-card affect whether they are
+                legal or not for competative play.
+                    * May want this also to maintain order, be able to
+                    access,ouput sets in order.
+                    Idea:
+
+                    Errata - keep a json of errata.  Need to know the
+                    card/set, the specific attribute of the errata (text,
+                    attack, energy, etc.) and the updated value.
+                    json:
+                        errata:{set, index, field, errata_update
+                        TODO: what to represent in the database?
+
+                Q: Are restored pokemon evolved?
+            '''
+            #  populate the card table.
+            if (cardtable):
+                # The text rules are applied in one pass
+                textcounts = {}
+                normalize_text = partial(
+                    cardfilters.normalize_text,
+                    normalizer=cardfilters.TextNormalizer.from_formats(
+                        formats, LOAD_TEXT_RULES),
+                    counts=textcounts)
+                card_filters = [delete_nulls,
+                                remove_oldtags,
+                                sort_energy,
+                                update_attack_damage,
+                                normalize_text,
+                                update_card_legality,
+                                update_reprints,
+                                update_set_data]
+                # Index the cards as they are loaded, [(file, index)]
+                cardindexes = []
+                for path, indexclass in [
+                        (args.textindex, textindex.TextIndex),
+                        (args.nameindex, nameindex.NameIndex),
+                        (args.attackindex, attackindex.AttackIndex)]:
+                    if path:
+                        cardindexes.append((path, indexclass()))
+                        card_filters.append(
+                            partial(index_card, index=cardindexes[-1][1]))
+                populate_table(cardtable, cardbase_initfile,
+                               cardbase_KeySchema,
+                               filters=card_filters,
+                               tcgdata=tcgdata,
+                               updatefile=updatefile,
+                               workers=args.workers,
+                               sync=args.sync)
+                missing_reprints(tcgdata['reprintgroups'],
+                                 tcgdata['reprintcards'])
+                for rule in LOAD_TEXT_RULES:
+                    logger.info('{}: {} replacements'.format(
+                        rule, textcounts.get(rule, 0)))
+                for path, index in cardindexes:
+                    index.save(path)
+                    print('Indexed {} to {}'.format(index.summary(), path))
+        else:
+            # Update reprints and legality of the loaded cards based on the
+            # reprint database, loading does this as the cards are filtered
+            update_reprints_and_legality(cardtable, tcgdata,
+                                         cardbase_KeySchema,
+                                         workers=args.workers)
+
+    if (settable):
+        dbtools.bump_generation(settable)
     logger.info('Tables found: {}'.format(list(dynamodb.tables.all())))
 
 
 def create_table(database, table_name, key_schema, attribute_definitions,
-                 provisioned_throughput, killdb, existing_tables):
+                 provisioned_throughput, killdb, existing_tables,
+                 global_secondary_indexes=None):
     """ Create the DynamoDB Table """
-    logger.debug('In create_table, attempting to create {}'.format(table_name))
-    if killdb and table_name in existing_tables:
-        logger.debug(
-            'Attempting to delete existing table {}'.format(table_name))
-
-        table = database.Table(table_name)
-        table.delete()
-        table.meta.client.get_waiter(
-            'table_not_exists').wait(TableName=table_name)
-        logger.info('Table {} Deleted'.format(table_name))
-    logger.info('Attempting to create table {}'.format(table_name))
+    return create_tables(database, [table_spec(table_name, key_schema,
+                                               attribute_definitions,
+                                               provisioned_throughput,
+                                               global_secondary_indexes)],
+                         killdb, existing_tables)[0]
+
+
+def table_spec(table_name, key_schema, attribute_definitions,
+               provisioned_throughput, global_secondary_indexes=None):
+    """ Return the create_table arguments for a table
+
+    provisioned_throughput -- None for on-demand (pay per request) billing
+    """
+    spec = {'TableName': table_name,
+            'KeySchema': key_schema,
+            'AttributeDefinitions': attribute_definitions}
+    if provisioned_throughput:
+        spec['ProvisionedThroughput'] = provisioned_throughput
+    else:
+        spec['BillingMode'] = 'PAY_PER_REQUEST'
+    if global_secondary_indexes:
+        spec['GlobalSecondaryIndexes'] = global_secondary_indexes
+    return spec
+
+
+def create_tables(database, table_specs, killdb, existing_tables):
+    """ Create the DynamoDB Tables described by table_specs (see table_spec)
+
+    All the deletes (with killdb), and then all the creates, are issued
+    before waiting on any of them, so the tables are built concurrently.
+    Returns a list with the table, or False if it couldn't be created, for
+    each spec.
+    """
+    client = database.meta.client
+    names = [spec['TableName'] for spec in table_specs]
+    if killdb:
+        deleting = [name for name in names if name in existing_tables]
+        for table_name in deleting:
+            logger.debug(
+                'Attempting to delete existing table {}'.format(table_name))
+            database.Table(table_name).delete()
+        for table_name in deleting:
+            client.get_waiter('table_not_exists').wait(TableName=table_name)
+            logger.info('Table {} Deleted'.format(table_name))
+
+    tables = []
+    for spec in table_specs:
+        logger.info('Attempting to create table {}'.format(spec['TableName']))
+        try:
+            tables.append(database.create_table(**spec))
+        except ClientError as e:
+            logger.error("Unexpected error: {}".format(e))
+            tables.append(False)
+    # Wait until the tables exist.
+    for table in tables:
+        if table:
+            client.get_waiter('table_exists').wait(TableName=table.name)
+            logger.info('Table {} created'.format(table.name))
+    return tables
+
+
+def ensure_indexes(table, global_secondary_indexes, attribute_definitions,
+                   seasons, key_schema, workers=4):
+    """ Bring the global secondary indexes of an existing table up to date
+
+    Legality indexes of seasons which are no longer indexed are deleted, the
+    legality index attributes of the cards are backfilled (see
+    backfill_legality_index) and then any missing indexes are created, so
+    they hold every card from the start.
+
+    DynamoDB only allows one index to be created or deleted per update, so
+    each is done in turn and we wait for the table to become active.
+    """
+    wanted = [index['IndexName'] for index in global_secondary_indexes]
+    existing = [index['IndexName']
+                for index in table.global_secondary_indexes or []]
+    for indexname in existing:
+        if indexname in wanted or not dbtools.is_legality_index(indexname):
+            continue
+        logger.info('Deleting index {} on {}'.format(indexname, table.name))
+        try:
+            table.update(GlobalSecondaryIndexUpdates=[
+                {'Delete': {'IndexName': indexname}}])
+        except ClientError as e:
+            logger.error("Unexpected error: {}".format(e))
+            quit()
+        wait_until_active(table)
+        logger.info('Index {} deleted'.format(indexname))
+
+    backfill_legality_index(table, seasons, key_schema, workers=workers)
+
+    for index in global_secondary_indexes:
+        if index['IndexName'] in existing:
+            continue
+        logger.info('Creating index {} on {}'.format(index['IndexName'],
+                                                      table.name))
+        keys = [key['AttributeName'] for key in index['KeySchema']]
+        try:
+            table.update(
+                AttributeDefinitions=[
+                    attribute for attribute in attribute_definitions
+                    if attribute['AttributeName'] in keys],
+                GlobalSecondaryIndexUpdates=[{'Create': index}])
+        except ClientError as e:
+            logger.error("Unexpected error: {}".format(e))
+            quit()
+        wait_until_active(table)
+        logger.info('Index {} created'.format(index['IndexName']))
+
+
+def backfill_legality_index(table, seasons, key_schema, workers=4):
+    """ Set the legality index attributes of every card in the table from
+    its legality flags, see dbtools.update_legality_index
+
+    Cards loaded before the indexes were added, or before the indexed seasons
+    changed, don't have the right attributes, and neither the reprints
+    postprocess nor --sync rewrite every card.  Only the cards which change
+    are written back.  Returns the number written.
+    """
+    def _changed(pages):
+        for page in pages:
+            for item in page:
+                original = dict(item)
+                dbtools.update_legality_index(item, seasons)
+                if item == original:
+                    continue
+                if dbtools.CONTENT_HASH in item:
+                    item[dbtools.CONTENT_HASH] = dbtools.content_hash(item)
+                yield item
+
     try:
-        table = database.create_table(
-            TableName=table_name,
-            KeySchema=key_schema,
-            AttributeDefinitions=attribute_definitions,
-            ProvisionedThroughput=provisioned_throughput
-        )
-        # Wait until the table exists.
-        table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
+        itemcount = dbtools.batch_write_items(
+            table, _changed(dbtools.scan_pages(table)), key_schema,
+            workers=workers)
     except ClientError as e:
-        logger.error("Unexpected error: {}".format(e))
-        return False
-    logger.info('Table {} created'.format(table_name))
-    return table
+        logger.error('Error {}'.format(e))
+        quit()
+    print('Backfilled the legality index attributes of {} cards in {}'.format(
+        itemcount, table.name))
+    return itemcount
+
+
+def wait_until_active(table):
+    """ Wait for the table and all its indexes to become active """
+    while True:
+        table.reload()
+        statuses = [index.get('IndexStatus')
+                    for index in table.global_secondary_indexes or []]
+        if (table.table_status == 'ACTIVE' and
+                all(status == 'ACTIVE' for status in statuses)):
+            return
+        time.sleep(5)
+
+
+@contextmanager
+def bulk_write_capacity(table, write_capacity, capacity=0.9):
+    """ Raise the write capacity of a table and its indexes for a bulk load
+
+    The original throughput is restored when the block exits, even on an
+    error.  Does nothing if write_capacity is not set or the table is
+    on-demand.  The rate limiter (see dbtools.throttle) is updated to match.
+
+    Position arguments:
+        table -- dynamodb table
+        write_capacity -- write capacity units to use during the load
+
+    Keyword arguments:
+        capacity -- fraction of provisioned capacity for dbtools.throttle
+    """
+    if (not table or not write_capacity or
+            (table.billing_mode_summary or {}).get('BillingMode') ==
+            'PAY_PER_REQUEST'):
+        yield
+        return
+
+    def _throughput(throughput):
+        return {'ReadCapacityUnits': throughput['ReadCapacityUnits'],
+                'WriteCapacityUnits': throughput['WriteCapacityUnits']}
+
+    def _update(table_throughput, index_throughputs):
+        table.update(
+            ProvisionedThroughput=table_throughput,
+            GlobalSecondaryIndexUpdates=[
+                {'Update': {'IndexName': name,
+                            'ProvisionedThroughput': throughput}}
+                for name, throughput in index_throughputs.items()])
+        wait_until_active(table)
+        dbtools.throttle(table, capacity)
+
+    original = _throughput(table.provisioned_throughput)
+    if original['WriteCapacityUnits'] >= write_capacity:
+        yield
+        return
+    # DynamoDB rejects updates which don't change an index's throughput
+    original_indexes = {
+        index['IndexName']: _throughput(index['ProvisionedThroughput'])
+        for index in table.global_secondary_indexes or []
+        if index['ProvisionedThroughput']['WriteCapacityUnits'] <
+        write_capacity}
+    logger.info('Raising write capacity of {} to {}'.format(table.name,
+                                                            write_capacity))
+    _update(dict(original, WriteCapacityUnits=write_capacity),
+            {name: dict(throughput, WriteCapacityUnits=write_capacity)
+             for name, throughput in original_indexes.items()})
+    try:
+        yield
+    finally:
+        logger.info('Restoring write capacity of {} to {}'.format(
+            table.name, original['WriteCapacityUnits']))
+        _update(original, original_indexes)
 
 
 def populate_table(table, init_file, key_schema, filters=[],
-                   returndict=False, tcgdata=False, updatefile=False):
+                   returndict=False, tcgdata=False, updatefile=False,
+                   workers=4, sync=False):
     """ Populate the table with json specified in init_file, opt: return the data
     Position arguments:
         table -- dynamodb to populate
         init_file -- card file to load from
-        key_schema -- table keys, used for debugging
+        key_schema -- table keys, used to batch the writes
 
     Keyword arguments:
         returndict -- boolean, return a list of populated items (default False)
         filters -- list of filter functions to run on each item.
-        updatefile -- output file to record updtes
+        updatefile -- output file to record updtes, made from the edits
+                      the filters record in a changes.ChangeJournal
+        workers -- number of threads writing batches to the table
+        sync -- only write the items whose content differs from the table's,
+                and delete the table's items which aren't in init_file
+
+    Items are written with BatchWriteItem, 25 at a time, see
+    dbtools.batch_write_items.  Each item is stored with a hash of its
+    filtered content (dbtools.CONTENT_HASH), which sync compares against.
 
     Note: dict keys which have a value of None and string values of ''
     are removed before inserting into the table (DynamoDB requirements).
@@ -311,68 +657,178 @@ def populate_table(table, init_file, key_schema, filters=[],
     logger.debug('Populating table from {}'.format(init_file))
     # In case we need to store in memory
     returnedset = {}
-    with open(init_file) as json_file:
-        items = json.load(json_file)
-        if updatefile:
-            # make backup for later diffing
-            orig_items = deepcopy(items)
-        itemcount = 0
+
+    def _filtered_items(items):
         for item in items:
             logger.debug('Orig:\n{}\n'.format(item))
+            # The filters record their edits in the journal as they go
+            journal = changes.ChangeJournal() if updatefile else None
             for filter in filters:
-                filter(item=item, tcgdata=tcgdata)
+                filter(item=item, tcgdata=tcgdata, journal=journal)
             logger.debug('After Processing:\n{}\n'.format(item))
+            if updatefile:
+                print(pformat(journal.diff(item['id'])), file=updatefile)
+            item[dbtools.CONTENT_HASH] = dbtools.content_hash(item)
 
             # If returning in-memory
             if returndict:
                 # TODO - Fix this as it currenlty only works for sets
                 returnedset[item['code']] = item
                 # returnedset.append(item)
-            try:
-                table.put_item(
-                    Item=item
-                )
-                # If debugging, pull from the database to validate_template
-                if logger.getEffectiveLevel() == logging.DEBUG:
-                    mykey = {}
-                    for keyattribute in key_schema:
-                        mykey[keyattribute['AttributeName']
-                              ] = item[keyattribute['AttributeName']]
-                    logger.debug('Querying table with {}'.format(mykey))
-                    response = table.get_item(
-                        Key=mykey
-                    )
-                    logger.debug(
-                        'From DynamoDB:\n{}\n'.format(response['Item']))
-            except ClientError as e:
-                logger.error(item)
-                logger.error('Error {}'.format(e))
-                quit()
-            print('{}\t\t{}'.format(itemcount, item['name']))
-            # print('\r{}\t\t{:50}'.format(
-            # itemcount, item['name']), end='', flush=True)
-            itemcount = itemcount + 1
-
-            # Break early for testing
-            # if itemcount == 100:
-            #     break
-    print()
+            yield item
+
+    keynames = [keyattribute['AttributeName'] for keyattribute in key_schema]
+    # {key: content hash} of the items in the table, for sync
+    stored = {}
+    counts = {'unchanged': 0}
+
+    def _changed_items(items):
+        for item in items:
+            key = tuple(item[keyname] for keyname in keynames)
+            if stored.pop(key, None) == item[dbtools.CONTENT_HASH]:
+                counts['unchanged'] = counts['unchanged'] + 1
+                continue
+            yield item
+
+    # Items are parsed and filtered one at a time by a producer thread while
+    # the batches are written, so memory doesn't grow with the file size
+    with open(init_file, 'rb') as json_file:
+        try:
+            items = _filtered_items(iter_json_array(json_file))
+            if sync:
+                stored = dbtools.item_hashes(table, key_schema)
+                items = _changed_items(items)
+            itemcount = dbtools.batch_write_items(
+                table, pipeline(items), key_schema, workers=workers)
+            # Whatever is left in the table isn't in init_file any more
+            deletecount = 0
+            if sync and stored:
+                deletecount = dbtools.batch_write_items(
+                    table, [dict(zip(keynames, key)) for key in stored],
+                    key_schema, workers=workers, delete=True)
+        except ClientError as e:
+            logger.error('Error {}'.format(e))
+            quit()
+    if sync:
+        print('Synced {}: {} written, {} deleted, {} unchanged'.format(
+            table.name, itemcount, deletecount, counts['unchanged']))
+    else:
+        print('Loaded {} items into {}'.format(itemcount, table.name))
     if updatefile:
-        logger.info('Creating updatefile...')
-        for i, item in enumerate(items):
-            diffresult = pformat(
-                DeepDiff(orig_items[i], item, verbose_level=2))
-            diffresult = diffresult.replace('root', item['id'])
-            print(diffresult, file=updatefile)
-
-        # diffresult = diff(orig_items, items)
-        # diffresult = DeepDiff(orig_items, items)
-        # pprint.pprint(diffresult, updatefile)
-        # print(pprint(diffresult), file=updatefile)
         logger.info('updatefile created')
     return returnedset
 
 
+def iter_json_array(json_file, chunksize=65536):
+    """ Generator of the elements of a JSON array in a file, read
+    incrementally so the whole array is never in memory
+
+    Uses ijson when it is installed, otherwise decodes one element at a time
+    from a buffer with json.JSONDecoder.raw_decode.  Either way the elements
+    are the same as json.load would return.  Raises ValueError, naming the
+    file, if the file doesn't hold a JSON array or ends before it does.
+
+    json_file -- file opened in binary mode
+    """
+    name = getattr(json_file, 'name', json_file)
+    if ijson:
+        events = ijson.parse(json_file, use_float=True)
+        try:
+            prefix, event, value = next(events, (None, None, None))
+            if event != 'start_array':
+                raise ValueError('{} is not a JSON array'.format(name))
+            yield from ijson.items(events, 'item')
+        except ijson.JSONError as e:
+            raise ValueError('Error reading {}: {}'.format(name, e)) from e
+        return
+
+    decoder = json.JSONDecoder()
+    reader = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    index = 0
+    started = eof = False
+    while True:
+        # skip whitespace, the opening '[' and the ',' between elements
+        while index < len(buffer) and buffer[index] in ' \t\r\n,[':
+            if buffer[index] == '[':
+                if started:
+                    break
+                started = True
+            index = index + 1
+        if not started and index < len(buffer):
+            raise ValueError('{} is not a JSON array'.format(name))
+        if started and buffer[index:index + 1] == ']':
+            return
+        if started and index < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, index)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError('Error reading {}: {}'.format(
+                        name, e)) from e
+                end = None
+            # a value at the end of the buffer may be incomplete (e.g. a
+            # number), so only take it once a separator follows it
+            if end is not None and (eof or buffer[end:end + 1] in
+                                    (' ', '\t', '\r', '\n', ',', ']')):
+                yield item
+                index = end
+                continue
+        if eof:
+            if not started:
+                raise ValueError('{} is not a JSON array'.format(name))
+            raise ValueError('{} ends before the end of its JSON '
+                             'array'.format(name))
+        chunk = json_file.read(chunksize)
+        eof = not chunk
+        buffer = buffer[index:] + reader.decode(chunk, final=eof)
+        index = 0
+
+
+def pipeline(items, maxsize=1000):
+    """ Run the items generator in a producer thread, yielding its items
+
+    At most maxsize items are buffered between the producer and the
+    consumer.  Exceptions in the producer are raised in the consumer.
+    """
+    itemqueue = queue.Queue(maxsize=maxsize)
+    done = object()
+    # set if the consumer stops early so the producer doesn't block forever
+    stop = threading.Event()
+
+    def _put(obj):
+        while not stop.is_set():
+            try:
+                itemqueue.put(obj, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _producer():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                _put(item)
+        except Exception as e:
+            _put(e)
+        _put(done)
+
+    producer = threading.Thread(target=_producer, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = itemqueue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
 def update_item(table, item):
     """ update replace the item in the table """
     try:
@@ -390,20 +846,31 @@ def delete_nulls(**kwargs):
 
     Required keywork arguments:
         item: item to delete nulls from
+    Optional keyword arguments:
+        journal: changes.ChangeJournal to record the deletions in
+        path: path of item within the card, for the journal
     """
     d = kwargs['item']
+    journal = kwargs.get('journal') or changes.NO_JOURNAL
+    path = kwargs.get('path', '')
     if isinstance(d, dict):
         for k, v in list(d.items()):
             if isinstance(v, list) or isinstance(v, dict):
-                delete_nulls(item=v)
+                delete_nulls(item=v, journal=journal,
+                             path=changes.key_path(path, k))
             elif v == '' or v is None or v == 'None':
                 del d[k]
+                journal.record(changes.key_path(path, k), v, changes.MISSING)
     elif isinstance(d, list):
-        while '' in d:
-            d.remove('')
-        for v in d:
+        if '' in d:
+            old = list(d)
+            while '' in d:
+                d.remove('')
+            journal.record_list(path, old, d)
+        for i, v in enumerate(d):
             if isinstance(v, dict):
-                delete_nulls(item=v)
+                delete_nulls(item=v, journal=journal,
+                             path=changes.key_path(path, i))
 
 
 def remove_oldtags(**kwargs):
@@ -413,61 +880,33 @@ def remove_oldtags(**kwargs):
         item - item to modify
     """
     item = kwargs['item']
-    item.pop('standard_legal', None)
-    item.pop('expanded_legal', None)
+    journal = kwargs.get('journal') or changes.NO_JOURNAL
+    with journal.track(item):
+        item.pop('standard_legal', None)
+        item.pop('expanded_legal', None)
 
 
 def update_card_legality(**kwargs):
     """ Strip any existing legal and replace with updated information.  Note:
     this does *not* handle setting legality on the reprints, it just sets the
-    legality based upon the approved sets.  Reprints are marked as legal in a
-    postprocess once all cards are loaded.
+    legality based upon the approved sets.  Reprints are marked as legal by
+    update_reprints, the next filter.
 
     Required keyword arguments
-        tcg_seasons -- set structure to identify legal/non-leagal cards
+        tcgdata -- tcgdata['legality'] is the LegalityIndex compiled from
+                   tcgdata['seasons']
         item -- item to modify
     """
     item = kwargs['item']
     tcg_seasons = kwargs['tcgdata']['seasons']
+    journal = kwargs.get('journal') or changes.NO_JOURNAL
 
-    # Check each season's legality and assign properly
-    for season in tcg_seasons:
-
-        #  Set all to false initially
-        item[season + '_standard'] = False
-        item[season + '_expanded'] = False
-        standard_banned = expanded_banned = False
-
-        # Check to see if the card is banned
-        if item['id'] in tcg_seasons[season]['banned_standard_cards']:
-            standard_banned = True
-        if item['id'] in tcg_seasons[season]['banned_expanded_cards']:
-            expanded_banned = True
-
-        if (item['set_code'] in tcg_seasons[season]['standard_legal_sets'] and
-                not standard_banned):
-            item[season + '_standard'] = True
-        if (item['set_code'] in tcg_seasons[season]['expanded_legal_sets'] and
-                not expanded_banned):
-            item[season + '_expanded'] = True
-
-        # Check split sets where only cards above a certain number are
-        # standard legal.  To date these are only promo series cards.
-        for split_set in tcg_seasons[season]['standard_legal_split_sets']:
-            if item['set_code'] == split_set['set'] and not standard_banned:
-                if 'number_prefix' in split_set:
-                    if item['number'].startswith(split_set['number_prefix']):
-                        cardnum = int(item['number'].strip(
-                            split_set['number_prefix']))
-                        if cardnum >= split_set['min']:
-                            item[season + '_standard'] = True
-                    else:
-                        # Raise an error, the expected prefix doesn't match the
-                        # card information
-                        raise ValueError
-                else:
-                    if int(item['number']) >= split_set['min']:
-                        item[season + '_standard'] = True
+    with journal.track(item):
+        # Set each season's legality from the compiled rules
+        item.update(kwargs['tcgdata']['legality'].card_legality(item))
+
+        # Keep the sparse legality index attributes in step with the flags
+        dbtools.update_legality_index(item, tcg_seasons)
 
 
 def update_set_data(**kwargs):
@@ -481,206 +920,198 @@ def update_set_data(**kwargs):
     item = kwargs['item']
     tcg_abbreviations = kwargs['tcgdata']['abbreviations']
     tcg_sets = kwargs['tcgdata']['sets']
+    journal = kwargs.get('journal') or changes.NO_JOURNAL
 
-    # Add set data
-    item['set_total_cards'] = tcg_sets[item['set_code']]['total_cards']
-    item['set_release_date'] = tcg_sets[item['set_code']]['release_date']
+    with journal.track(item):
+        # Add set data
+        item['set_total_cards'] = tcg_sets[item['set_code']]['total_cards']
+        item['set_release_date'] = tcg_sets[item['set_code']]['release_date']
 
-    if item['set_code'] in tcg_abbreviations:
-        setcode = item['set_code']
-        item['abbr'] = tcg_abbreviations[setcode]['abbr']
-        item['set'] = tcg_abbreviations[setcode]['name']
+        if item['set_code'] in tcg_abbreviations:
+            setcode = item['set_code']
+            item['abbr'] = tcg_abbreviations[setcode]['abbr']
+            item['set'] = tcg_abbreviations[setcode]['name']
 
 
-def update_reprints_and_legality(table, tcg_reprints, tcg_seasons):
-    """ Loop throgh cards and add list of reprints """
+def index_card(**kwargs):
+    """ Add the item to an indexfile.IndexFile (the text, name or attack
+    index), doesn't change the item
 
-    # Check to see if the name matches and the card is listed
-    #  -- Note also checking to see if the card is listed under any reprint
-    # and will raise an error if name doesn't match.  Error Checking
+    Required keyword arguments
+        index -- the index to add to
+    """
+    kwargs['index'].add(kwargs['item'])
 
-    logger.info('Updating reprints data')
-    # Cards in tcg_repritns are in a cardname:[list...] structure
-    for card in tcg_reprints:
-        [(cardname, cardprint_ids)] = card.items()
 
-        # list to hold records of each card in cardprint_ids, this will be
-        # used later to update the records before writing them back to the db
-        cardprint_data = []
+def reprint_groups(tcg_reprints, legality):
+    """ Return {(set_code, number): (card name, reprint ids, legality flags)}
+    for the cards in the reprint groups of tcg_reprints
 
-        # Check to see each card in the reprint list exists in the database
-        # if found, add the reprint list to the card record
+    The legality flags are those granted to the card by its reprints: the
+    '<season>_<format>' flags any card in its group is legal for, from
+    legality (a LegalityIndex).  As the groups are worked through in order, a
+    card in several groups passes what it was granted by one on to the
+    next, and has the reprints of the last.
+    """
+    # card key: flags it is legal for
+    cardflags = {}
+    groups = {}
+    for card in tcg_reprints:
+        [(cardname, cardprint_ids)] = card.items()
+        keys = []
         for cardprint_id in cardprint_ids:
-            [cardset, cardnumber] = cardprint_id.split('-')
-            # For some sets, card number contains alpha characters, these
-            # are always uppercase, card ids are not. e.g. g1-rc15 vs. g1 RC15
-            response = table.query(
-                KeyConditionExpression=Key('set_code').eq(cardset) &
-                Key('number').eq(cardnumber.upper())
-            )
-
-            # check the response from the database
-            item = response['Items']
-            if len(item) != 1:
-                print('Error finding card {} ({}), recieved {} cards after'
-                      'query'.format(cardprint_id, cardname, len(item)))
-            else:
-                cardprint_data.append(item[0])
-
-        # loop throug the loaded card records and set the 'reprints' value, at
-        # the same time, verify the names match for error checking
-        #
-        # Also: check for each season, if *any* of the cards are marked legal
-        # for a season, set the legal flag and take a second pass through
-        # marking all reprint cards as legal for that season and update the
-        # database.
-
-        # list of formats identified as legal for the card
-        legalformats = []
-
-        # search through reprints, set reprints attribute and also check
-        # if any of them are legal in each format
-        for cardprint in cardprint_data:
-            if cardprint['name'] == cardname:
-                cardprint['reprints'] = cardprint_ids
-                for season in tcg_seasons:
-                    if cardprint[season + '_standard'] is True:
-                        legalformats.append(season + '_standard')
-                    if cardprint[season + '_expanded'] is True:
-                        legalformats.append(season + '_expanded')
-            else:
-                print('Error found match on card {} with id {} with '
-                      'reprints name {}'.format(cardprint['name'],
-                                                cardprint['id'], cardname))
-                raise ValueError
-
-        # For each legal format - update the legality of all reprints and
-        # update and the database
-        for cardprint in cardprint_data:
-            for season_format in legalformats:
-                cardprint[season_format] = True
-            try:
-                table.put_item(
-                    Item=cardprint
-                )
-            except ClientError as e:
-                logger.error(cardprint)
-                logger.error('Error {}'.format(e))
-                quit()
+            key = dbtools.card_key(cardprint_id)
+            key = (key['set_code'], key['number'])
+            if key not in cardflags:
+                cardflags[key] = set(
+                    flag for flag, legal in legality.legality(
+                        key[0], key[1], cardprint_id).items() if legal)
+            keys.append(key)
+        legalflags = set()
+        for key in keys:
+            legalflags.update(cardflags[key])
+        for key in keys:
+            cardflags[key].update(legalflags)
+            groups[key] = (cardname, cardprint_ids, cardflags[key])
+    return groups
+
+
+def set_reprints(item, groups, tcg_seasons):
+    """ Set the reprints of a card and the legality they grant from groups
+    (see reprint_groups), or remove its reprints if it isn't in a group
+
+    The card's own legality flags must be set first (see
+    update_card_legality), reprint legality is only ever added to them.
+    Raises ValueError if the card's name isn't that of its group.
+    """
+    group = groups.get((item['set_code'], item['number']))
+    if group is None:
+        item.pop('reprints', None)
+    else:
+        cardname, cardprint_ids, legalflags = group
+        if item['name'] != cardname:
+            print('Error found match on card {} with id {} with '
+                  'reprints name {}'.format(item['name'], item['id'],
+                                            cardname))
+            raise ValueError
+        item['reprints'] = list(cardprint_ids)
+        for legalflag in legalflags:
+            item[legalflag] = True
+    dbtools.update_legality_index(item, tcg_seasons)
+
+
+def update_reprints(**kwargs):
+    """ Add the list of reprints and the reprint legality to a card, and
+    remove them from cards which are no longer in a reprint group, so the
+    content hash covers the card as it is stored
+
+    Required keyword arguments
+        tcgdata -- tcgdata['reprintgroups'] (see reprint_groups), the keys
+                   of the cards found are added to tcgdata['reprintcards']
+        item -- item to modify, after update_card_legality
+    """
+    item = kwargs['item']
+    tcgdata = kwargs['tcgdata']
+    journal = kwargs.get('journal') or changes.NO_JOURNAL
+    with journal.track(item):
+        set_reprints(item, tcgdata['reprintgroups'], tcgdata['seasons'])
+    key = (item['set_code'], item['number'])
+    if key in tcgdata['reprintgroups']:
+        tcgdata['reprintcards'].add(key)
+
+
+def missing_reprints(groups, found):
+    """ print the cards in the reprint groups which weren't found """
+    for key in sorted(set(groups) - set(found)):
+        print('Error finding card {}-{} ({})'.format(key[0], key[1],
+                                                     groups[key][0]))
+
+
+def update_reprints_and_legality(table, tcgdata, key_schema, workers=4):
+    """ Set the reprints and reprint legality of the cards in the table from
+    tcgdata['reprintgroups'], for --postprocess
+
+    The cards in the groups are read with BatchGetItem, along with the cards
+    which have reprints, which may no longer be in a group.  Their legality
+    is worked out again from the seasons and the groups, so legality granted
+    by a group which is gone is removed, and only the cards which changed
+    are written back (with their content hash updated) with batched writes.
+    """
+    logger.info('Updating reprints data')
+    groups = tcgdata['reprintgroups']
+    keys = set(groups)
+    for item in dbtools.scan_items(table, Attr('reprints').exists(),
+                                   **dbtools.projection(['set_code',
+                                                         'number'])):
+        keys.add((item['set_code'], item['number']))
+    cards = {}
+    for item in dbtools.batch_get_items(
+            table, [{'set_code': key[0], 'number': key[1]}
+                    for key in sorted(keys)]):
+        cards[(item['set_code'], item['number'])] = item
+    logger.info('Read {} reprint cards'.format(len(cards)))
+    missing_reprints(groups, cards)
+
+    changed = []
+    for key, item in cards.items():
+        original = deepcopy(item)
+        item.update(tcgdata['legality'].card_legality(item))
+        set_reprints(item, groups, tcgdata['seasons'])
+        if item == original:
+            continue
+        if dbtools.CONTENT_HASH in item:
+            item[dbtools.CONTENT_HASH] = dbtools.content_hash(item)
+        changed.append(item)
+    logger.info('{} of {} reprint cards changed'.format(len(changed),
+                                                        len(cards)))
+    try:
+        dbtools.batch_write_items(table, changed, key_schema, workers=workers)
+    except ClientError as e:
+        logger.error('Error {}'.format(e))
+        quit()
 
 
 def sort_energy(**kwargs):
     """ Ensure energy costs are sorted - allows for better matching """
     item = kwargs['item']
+    journal = kwargs.get('journal') or changes.NO_JOURNAL
     if item.get('attacks'):
-        for attack in item['attacks']:
-            if attack.get('cost'):
-                attack['cost'].sort(reverse=True)
-                if attack['cost'] != ['Free']:
-                    attack['convertedEnergyCost'] = len(attack['cost'])
+        for i, attack in enumerate(item['attacks']):
+            path = changes.key_path(changes.key_path('', 'attacks'), i)
+            costpath = changes.key_path(path, 'cost')
+            with journal.track(attack, path, keys=['convertedEnergyCost']):
+                if attack.get('cost'):
+                    old = list(attack['cost'])
+                    attack['cost'].sort(reverse=True)
+                    journal.record_list(costpath, old, attack['cost'])
+                    if attack['cost'] != ['Free']:
+                        attack['convertedEnergyCost'] = len(attack['cost'])
+                    else:
+                        attack['convertedEnergyCost'] = 0
                 else:
+                    if 'cost' in attack:
+                        journal.record_list(costpath, attack['cost'],
+                                            ['Free'])
+                    else:
+                        journal.record(costpath, changes.MISSING, ['Free'])
+                    attack['cost'] = ['Free']
                     attack['convertedEnergyCost'] = 0
-            else:
-                attack['cost'] = ['Free']
-                attack['convertedEnergyCost'] = 0
-
-
-def quote_to_apostrophe(**kwargs):
-    """ Change single quotes to apostrophe characters
-    replace 's and 't with ’s and ’t
-
-    """
-    patterns = [
-        (r'\'s\b', r'’s'),
-        (r'\'t\b', r'’t')
-    ]
-
-    d = kwargs['item']
-    if isinstance(d, dict):
-        for k, v in list(d.items()):
-            if isinstance(v, list) or isinstance(v, dict):
-                quote_to_apostrophe(item=v)
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[k]))
-                        v = d[k] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[k]))
-    elif isinstance(d, list):
-        for i, v in enumerate(d):
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[i]))
-                        v = d[i] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[i]))
-            if isinstance(v, dict):
-                quote_to_apostrophe(item=v)
-
-
-def x_to_times(**kwargs):
-    """ Change where the letter x was used when it should have been \xd7
 
-    Patterns:
-
-    Change x to 'times' when letter x is used in x+d (e.g. x2) or d+ (e.g. 20x)
-            (r'\b(\d+)x\b', r'\1×'),
-            (r'\bx(\d+)\b', r'×\1')
-    \b matches empty string at beginning or end of a word
-
-    """
-    patterns = [
-        (r'\b(\d+)x\b', r'\1×'),
-        (r'\bx(\d+)\b', r'×\1')
-    ]
-
-    d = kwargs['item']
-    if isinstance(d, dict):
-        for k, v in list(d.items()):
-            if isinstance(v, list) or isinstance(v, dict):
-                x_to_times(item=v)
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[k]))
-                        v = d[k] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[k]))
-    elif isinstance(d, list):
-        for i, v in enumerate(d):
-            if isinstance(v, str):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, v):
-                        logger.debug('replacing[{}]'.format(d[i]))
-                        v = d[i] = re.sub(pattern, replacement, v)
-                        logger.debug('replaced [{}]'.format(d[i]))
-            if isinstance(v, dict):
-                x_to_times(item=v)
-
-
-def clean_attack_text(**kwargs):
-    """ Fix common errors in attack text
-
-    Patterns:
-    Change x to 'times' when letter x is used in x+d (e.g. x2) or d+ (e.g. 20x)
-            (r'\b(\d+)x\b', r'\1×'),
-            (r'\bx(\d+)\b', r'×\1')
 
+def update_attack_damage(**kwargs):
+    """ Add the numeric damageBase and damageModifier ('+', '-' or '×')
+    parsed from each attack's damage text, e.g. '30×' -> 30, '×', so
+    attacks can be compared by damage
     """
-    patterns = [
-        (r'^\(\d+×\)\s*', r''),
-        (r'^\(\d+\+\)\s*', r'')
-    ]
-
     item = kwargs['item']
-    if item.get('attacks'):
-        for attack in item['attacks']:
-            if attack.get('text'):
-                for pattern, replacement in patterns:
-                    if re.search(pattern, attack['text']):
-                        logger.debug('replacing[{}]'.format(attack['text']))
-                        attack['text'] = re.sub(
-                            pattern, replacement, attack['text'])
-                        logger.debug('replaced [{}]'.format(attack['text']))
+    journal = kwargs.get('journal') or changes.NO_JOURNAL
+    for i, attack in enumerate(item.get('attacks') or []):
+        path = changes.key_path(changes.key_path('', 'attacks'), i)
+        with journal.track(attack, path,
+                           keys=['damageBase', 'damageModifier']):
+            attack.pop('damageBase', None)
+            attack.pop('damageModifier', None)
+            attack.update(attackindex.damage_fields(attack))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+''' Character trigram index of card names for fuzzy name lookup '''
+from collections import Counter
+
+import tcgdata.indexfile as indexfile
+
+# Bump when the file format or normalizing changes
+INDEX_VERSION = 1
+
+# Default index file, written by loadcards --nameindex and buildnameindex
+NAME_INDEX_FILE = 'nameindex.json'
+
+# Least fuzz.ratio score find_reprints_local accepts for the names of
+# reprints, candidates keeps every name that could score it
+CANDIDATE_RATIO = 80
+
+
+def main():
+    indexfile.build_main(NameIndex, 'Build the fuzzy name index from the '
+                         'card files', NAME_INDEX_FILE)
+
+
+def normalize(name):
+    """ lower case name without accents, punctuation or repeated spaces,
+    e.g. 'Sceptile-EX' -> 'sceptile ex'
+    """
+    return ' '.join(indexfile.words(name))
+
+
+def trigrams(name):
+    """ set of the character trigrams of a normalized name, padded so the
+    start and end of the name count
+    """
+    padded = '  {} '.format(name)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class NameIndex(indexfile.IndexFile):
+    """ Trigram -> names index, ranking names by the Dice coefficient of
+    their trigrams, and names by length for reprint candidates
+
+    names -- {card name: [card ids]}
+    """
+
+    kind = 'name index'
+    version = INDEX_VERSION
+
+    def __init__(self, names=None):
+        self.names = {}
+        # normalized name: [card names], normalized name: trigram count,
+        # trigram: set of normalized names
+        self.normalized = {}
+        self.sizes = {}
+        self.postings = {}
+        # name length: [card names], card name: Counter of its characters
+        self.lengths = {}
+        self.characters = {}
+        for name, cardids in (names or {}).items():
+            for cardid in cardids:
+                self.add({'name': name, 'id': cardid})
+
+    def add(self, card):
+        """ index a card's name """
+        name = card.get('name')
+        if not name:
+            return
+        if name not in self.names:
+            self.names[name] = []
+            self.lengths.setdefault(len(name), []).append(name)
+            self.characters[name] = Counter(name)
+            key = normalize(name)
+            if key not in self.normalized:
+                self.normalized[key] = []
+                self.sizes[key] = len(trigrams(key))
+                for trigram in trigrams(key):
+                    self.postings.setdefault(trigram, set()).add(key)
+            self.normalized[key].append(name)
+        if card['id'] not in self.names[name]:
+            self.names[name].append(card['id'])
+
+    def _scores(self, name):
+        """ {normalized name: similarity} for names sharing a trigram """
+        query = trigrams(normalize(name))
+        shared = {}
+        for trigram in query:
+            for key in self.postings.get(trigram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        return {key: 2 * count / (len(query) + self.sizes[key])
+                for key, count in shared.items()}
+
+    def lookup(self, name, limit=10):
+        """ Return up to limit [(card name, similarity, [card ids])], most
+        similar first
+        """
+        ranked = sorted(self._scores(name).items(),
+                        key=lambda score: (-score[1], score[0]))
+        results = []
+        for key, score in ranked:
+            for cardname in sorted(self.normalized[key]):
+                results.append((cardname, score, self.names[cardname]))
+        return results[:limit] if limit else results
+
+    def candidates(self, name, ratio=CANDIDATE_RATIO):
+        """ Return the set of ids of cards whose names could score ratio or
+        more with fuzz.ratio, for narrowing down name based comparisons
+
+        fuzz.ratio is 2 * matching characters / total length rounded to a
+        percentage and two names can't match more characters than they have
+        in common, which bounds it without comparing the names.  Trigram
+        similarity doesn't, fuzz.ratio counts the symbols normalize drops,
+        e.g. 'M Garchomp δ' and 'Machop δ' score 80 with trigrams 0.22
+        alike.
+        """
+        characters = Counter(name)
+        cardids = set()
+        for length, cardnames in self.lengths.items():
+            total = length + len(name)
+            # 100 * 2 * common / total rounds to ratio or more
+            if 400 * min(length, len(name)) < (2 * ratio - 1) * total:
+                continue
+            for cardname in cardnames:
+                common = sum((characters &
+                              self.characters[cardname]).values())
+                if 400 * common >= (2 * ratio - 1) * total:
+                    cardids.update(self.names[cardname])
+        return cardids
+
+    def summary(self):
+        return '{} names'.format(len(self.names))
+
+    def to_json(self):
+        return {'names': self.names}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['names'])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,38 @@
-import boto3
+import hashlib
 import json
+import os
+import sys
 import decimal
 import argparse
 import logging
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key, Attr
 from fuzzywuzzy import fuzz
+import tcgdata.attackindex as attackindex
+import tcgdata.cardserver as cardserver
+import tcgdata.dbtools as dbtools
+import tcgdata.storage as storage
+import tcgdata.textindex as textindex
+import tcgdata.nameindex as nameindex
+from tcgdata.legality import LegalityIndex
+
+logger = logging.getLogger(__name__)
+
+# Where query results are cached between runs
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'tcgdata')
 
 
 def main():
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('--id', '-i', nargs=1, type=str,
-                        required=False, help='pull specific card by id')
-    # parser.add_argument('--set', '-s', nargs=1, type=str,
-    #                     required=False, help='pull all cards in a set')
+    parser.add_argument('--id', '-i', nargs='+', type=str,
+                        required=False, help='pull specific card(s) by id')
+    parser.add_argument('--idfile', type=argparse.FileType('r'),
+                        required=False,
+                        help='pull the cards listed in a file, one id per '
+                        'line')
+    parser.add_argument('--set', '-s', nargs=1, type=str,
+                        required=False, help='pull all cards in a set')
     parser.add_argument(
         '--standard', required=False, action="store_true",
         help='limit to only standard legal cards'
@@ -23,16 +41,123 @@ def main():
         '--expanded', required=False, action="store_true",
         help='limit to only expanded legal cards'
     )
+    parser.add_argument(
+        '--name', '-n', type=str, required=False,
+        help='pull cards with this exact name'
+    )
+    parser.add_argument(
+        '--supertype', type=str, required=False,
+        choices=dbtools.SUPERTYPES,
+        help='limit to Pokémon, Trainer or Energy cards'
+    )
+    parser.add_argument(
+        '--season', type=str, default='2018', required=False,
+        help='season used by --standard and --expanded (default 2018)'
+    )
     parser.add_argument(
         '--ability', nargs='?', type=str, required=False,
         const=True, default=False,
         help='limit to Pokémon with abilities, next arg can be text to match',
     )
+    parser.add_argument(
+        '--search', nargs='+', type=str, required=False,
+        help='ranked search of ability, attack and Trainer/Energy text, '
+        'cards must contain all of the words'
+    )
+    parser.add_argument(
+        '--fuzzyname', type=str, required=False, metavar='NAME',
+        help='cards with the names most like NAME, best match first, '
+        'e.g. misspelt names'
+    )
+    parser.add_argument(
+        '--damage', type=attackindex.parse_range, required=False,
+        metavar='RANGE',
+        help='cards with an attack doing MIN:MAX base damage, either end '
+        'may be left out, e.g. 130: (with --cost, the same attack)'
+    )
+    parser.add_argument(
+        '--cost', type=attackindex.parse_range, required=False,
+        metavar='RANGE',
+        help='cards with an attack costing MIN:MAX energy, e.g. :2'
+    )
+    parser.add_argument(
+        '--hp', type=attackindex.parse_range, required=False,
+        metavar='RANGE',
+        help='cards with MIN:MAX HP, e.g. 100:150'
+    )
+    parser.add_argument(
+        '--limit', type=int, required=False,
+        help='return at most this many cards of --search or '
+        '--damage/--cost/--hp, or --fuzzyname names (default 5 names)'
+    )
+    parser.add_argument(
+        '--textindex', type=str, default=textindex.TEXT_INDEX_FILE,
+        required=False,
+        help='index used by --search, built by loadcards --textindex or '
+        'buildtextindex (default {})'.format(textindex.TEXT_INDEX_FILE)
+    )
+    parser.add_argument(
+        '--nameindex', type=str, default=nameindex.NAME_INDEX_FILE,
+        required=False,
+        help='index used by --fuzzyname, built by loadcards --nameindex or '
+        'buildnameindex (default {})'.format(nameindex.NAME_INDEX_FILE)
+    )
+    parser.add_argument(
+        '--attackindex', type=str, default=attackindex.ATTACK_INDEX_FILE,
+        required=False,
+        help='index used by --damage, --cost and --hp, built by loadcards '
+        '--attackindex or buildattackindex (default {})'.format(
+            attackindex.ATTACK_INDEX_FILE)
+    )
+    parser.add_argument(
+        '--fields', '-f', nargs='+', type=str, required=False,
+        help='only read these attributes, e.g. --fields id name '
+        'attacks.name'
+    )
+    parser.add_argument(
+        '--ndjson', action='store_true', required=False,
+        help='stream one card per line as each page of results arrives'
+    )
+    parser.add_argument(
+        '--capacity', type=float, default=0.9, required=False,
+        help="fraction of the table's provisioned read capacity to use, 0 "
+        "for no limit (not limited with --localdb)"
+    )
+    parser.add_argument(
+        '--checklegal', nargs='+', type=str, required=False,
+        help='print the legality of card ids from FORMATS without querying '
+        'the database'
+    )
+    parser.add_argument(
+        '--formats', type=str, default='formats.json', required=False,
+        help='formats file used by --checklegal (default formats.json)'
+    )
+    parser.add_argument(
+        '--nocache', action='store_true', required=False,
+        help="don't read or write the local query result cache"
+    )
+    parser.add_argument(
+        '--cachedir', type=str, default=CACHE_DIR, required=False,
+        help='directory for cached query results (default {})'.format(
+            CACHE_DIR)
+    )
     parser.add_argument(
         '-l', '--localdb',
         action='store_true', help='use local database',
         required=False
     )
+    parser.add_argument(
+        '--sqlite', required=False, metavar='PATH',
+        help='use an SQLite database file instead of dynamodb')
+    parser.add_argument(
+        '--server', nargs='?', const=cardserver.SERVER_URL, required=False,
+        metavar='URL',
+        help='ask a running cardserver (default {}), falling back to the '
+        'database if there is none'.format(cardserver.SERVER_URL))
+    parser.add_argument(
+        '--segments', type=int, default=1, required=False,
+        help='number of parallel scan segments'
+    )
     parser.add_argument(
         '-d', '--debug',
         help="Print lots of debugging statements", action="store_const",
@@ -45,86 +170,445 @@ def main():
 
     args = parser.parse_args()
 
+    # Offline legality check, no database needed
+    if args.checklegal:
+        print(json.dumps(check_legality(LegalityIndex.from_file(args.formats),
+                                        args.checklegal)))
+        return
+
+    # Criteria which may be served by an index, the rest become filters
+    criteria = {}
+    if args.name:
+        criteria['name'] = args.name
+    if args.supertype:
+        criteria['supertype'] = args.supertype
+    legalformats = []
+    if args.standard:
+        legalformats.append('standard')
+    if args.expanded:
+        legalformats.append('expanded')
+
+    # Use the table key where we can rather than scanning the whole table
+    cardids = []
+    if args.id:
+        cardids.extend(args.id)
+    if args.idfile:
+        cardids.extend(line.strip() for line in args.idfile if line.strip())
+
+    # A running cardserver answers from memory
+    if args.server:
+        try:
+            cards = cardserver.query_server(args.server, {
+                'ids': cardids,
+                'set': args.set[0] if args.set else None,
+                'name': args.name,
+                'supertype': args.supertype,
+                'season': args.season,
+                'formats': legalformats,
+                'ability': args.ability,
+                'search': ' '.join(args.search) if args.search else None,
+                'fuzzyname': args.fuzzyname,
+                'damage': args.damage,
+                'cost': args.cost,
+                'hp': args.hp,
+                'limit': args.limit,
+                'fields': args.fields})
+        except ValueError as e:
+            parser.error('cardserver: {}'.format(e))
+        if cards is not None:
+            if args.ndjson:
+                write_ndjson([cards])
+            else:
+                print(json.dumps(cards))
+            return
+        logger.info('Falling back to the database')
+
     # Get the service resource.
-    if args.localdb:
-        dynamodb = boto3.resource(
-            'dynamodb', endpoint_url='http://localhost:8000')
-    else:
-        dynamodb = boto3.resource('dynamodb')
+    dynamodb = storage.connect(args.localdb, args.sqlite)
 
     cardbase_name = 'tcg_cards'
+    setbase_name = 'tcg_sets'
     cardtable = dynamodb.Table(cardbase_name)
 
     # print('Connected to table {} created at {}\n'.format(
     #     cardbase_name, cardtable.creation_date_time))
 
     # initialize filters
-    filter = ''
-    if args.standard:
-        filter = filter & Attr('2018_standard').eq(True)
-    if args.expanded:
-        filter = filter & Attr('2018_expanded').eq(True)
-    if args.ability:
-        # filter = filter & Attr('ability').contains(args.ability[0])
-        # filter = Attr('ability').contains(args.ability[0])
-        #print('searching for {}'.format(args.ability))
-        # print(args.ability)
-        filter = (Attr('ability.name').contains(args.ability) |
-                  Attr('ability.text').contains(args.ability))
+    filter = None
+    if args.ability is True:
+        filter = _and(filter, Attr('ability').exists())
+    elif args.ability:
+        filter = _and(filter, Attr('ability.name').contains(args.ability) |
+                      Attr('ability.text').contains(args.ability))
 
-    if args.id:
-        filter = Attr('id').eq(args.id[0])
-    # elif args.set:
-    #     filter = Key('set_code').eq(args.set[0])
-    # else:
-        # filter = None
-        # filter = Attr('name').contains('Mew-EX') & Attr('2017_standard').eq(True)
-        # filter = filter & Attr('ability').exists()
-        # filter = Attr('name').contains('Switch')
-        # filter = Attr('id').eq('g1-rc15')
-        # filter = Attr('abbr').contains('sum') & Attr('name').contains('Tauros-GX')
-        # filter = (Attr('name').contains(
-        #     '-GX') | Attr('name').contains('-EX')) & Attr('ability').exists() & Attr('2017_standard').eq(True)
-        # filter = Attr('2017_expanded').eq(True) &
-        # filter = Attr('subtype').contains('Basic') & Attr('evolvesFrom').not_exists() & Attr('supertype').contains('Pokémon') & Attr('retreat_cost').not_exists() & Attr('2017_expanded').eq(True)
-
-    cards = replace_decimals(query_cards(cardtable, filter))
-    print(json.dumps(cards))
-    # print(json.dumps(cards))
-    # print(json.dumps(cards, default=decimal_default))
-    # print(len(cards))
-
-
-def query_cards(cardtable, filter):
-    """ Query the cardtable with the filter and return a list pokemon """
-    RETRY_EXCEPTIONS = ('ProvisionedThroughputExceededException',
-                        'ThrottlingException')
-
-    # We cannot begin with ExclusiveStartKey=None, so we use kwargs sans that
-    # the first time, then update to include it subsequently.
-    scan_kw = {}
-    if filter:
-        scan_kw.update({'FilterExpression': filter})
-    retries = 0
-    pokemon = []
-    while True:
+    # --id/--idfile, --search, --fuzzyname and the ranges each give card
+    # ids, the cards have to be given by all of them
+    idsources = [cardids] if cardids else []
+    # --limit cuts the cards of --search and the ranges once they are
+    # combined and filtered, it's the number of names for --fuzzyname
+    cardlimit = None
+    if args.search or args.damage or args.cost or args.hp:
+        cardlimit = args.limit
+
+    # Text search gives the ids of the matching cards, best match first
+    if args.search:
+        cardindex = textindex.TextIndex.load(args.textindex)
+        if cardindex is None:
+            sys.exit(1)
+        results = cardindex.search(' '.join(args.search))
+        for cardid, score in results:
+            logger.info('{} {:.3f}'.format(cardid, score))
+        if not results:
+            if not args.ndjson:
+                print(json.dumps([]))
+            return
+        idsources.append([cardid for cardid, score in results])
+    # Fuzzy name lookup gives the ids of the cards with the closest names
+    if args.fuzzyname:
+        cardnames = nameindex.NameIndex.load(args.nameindex)
+        if cardnames is None:
+            sys.exit(1)
+        results = cardnames.lookup(args.fuzzyname, args.limit or 5)
+        for name, score, ids in results:
+            logger.info('{} {:.3f}'.format(name, score))
+        if not results:
+            if not args.ndjson:
+                print(json.dumps([]))
+            return
+        idsources.append([cardid for name, score, ids in results
+                          for cardid in ids])
+    # Damage, cost and HP ranges are binary searched in the attack index
+    if args.damage or args.cost or args.hp:
+        cardattacks = attackindex.AttackIndex.load(args.attackindex)
+        if cardattacks is None:
+            sys.exit(1)
+        results = cardattacks.search(args.damage, args.cost, args.hp)
+        if not results:
+            if not args.ndjson:
+                print(json.dumps([]))
+            return
+        idsources.append(results)
+    if idsources:
+        cardids = dbtools.intersect_ids(idsources)
+        if not cardids:
+            if not args.ndjson:
+                print(json.dumps([]))
+            return
+
+    # Only read the requested attributes
+    read_kw = {}
+    if args.fields:
+        read_kw = dbtools.projection(args.fields)
+
+    # Results are cached until loadcards changes the tables, which it
+    # records by bumping the generation in the set table
+    cachefile = generation = None
+    if not args.nocache:
+        generation = dbtools.table_generation(dynamodb.Table(setbase_name))
+    if generation:
+        cachefile = cache_path(args.cachedir, cardbase_name, {
+            'ids': cardids,
+            'limit': cardlimit,
+            'set': args.set[0] if args.set else None,
+            'criteria': criteria,
+            'legalformats': legalformats,
+            'season': args.season if legalformats else None,
+            'ability': args.ability,
+            'fields': args.fields,
+            'segments': args.segments,
+            'ndjson': args.ndjson})
+        cards = read_cache(cachefile, generation)
+        if cards is not None:
+            logger.info('Using cached results {}'.format(cachefile))
+            if args.ndjson:
+                write_ndjson([cards])
+            else:
+                print(json.dumps(cards))
+            return
+
+    if not args.localdb:
+        dbtools.throttle(cardtable, args.capacity)
+
+    if cardids:
+        # The other criteria narrow down the cards asked for by id
+        if args.set:
+            filter = _and(filter, Attr('set_code').eq(args.set[0]))
+        filter = _and(filter, _criteria_filter(criteria, args.season,
+                                               legalformats))
+        if cardlimit and filter is None:
+            cardids = cardids[:cardlimit]
+        cards = get_cards(cardtable, cardids, args.fields, filter)
+        pages = [cards[:cardlimit] if cardlimit else cards]
+    elif args.set:
+        filter = _and(filter, _criteria_filter(criteria, args.season,
+                                               legalformats))
+        pages = query_set_pages(cardtable, args.set[0], filter, **read_kw)
+    else:
+        pages = query_index_pages(cardtable, criteria, args.season,
+                                  legalformats, filter, args.segments,
+                                  ordered=not args.ndjson, **read_kw)
+
+    cards = []
+    if args.ndjson:
+        write_ndjson(_collect(pages, cards))
+    else:
+        for page in pages:
+            cards.extend(page)
+        print(json.dumps(cards))
+    if cachefile:
+        write_cache(cachefile, generation, cards)
+
+
+def _collect(pages, cards):
+    """ pass pages through, extending cards with each one """
+    for page in pages:
+        cards.extend(page)
+        yield page
+
+
+def check_legality(legality, cardids):
+    """ Return {cardid: {'<season>_<format>': bool}} for card ids
+
+    Legality comes from the compiled season rules alone, so reprints made
+    legal by the loadcards postprocess aren't included.
+    """
+    results = {}
+    for cardid in cardids:
+        key = dbtools.card_key(cardid)
         try:
-            response = cardtable.scan(**scan_kw)
-            pokemon.extend(response['Items'])
-            last_key = response.get('LastEvaluatedKey')
-            # print('len={} response[Count]={} last_key={}'.format(
-            #     len(pokemon), response['Count'], last_key))
-            if not last_key:
-                break
-            retries = 0          # if successful, reset count
-            scan_kw.update({'ExclusiveStartKey': last_key})
-        except ClientError as err:
-            if err.response['Error']['Code'] not in RETRY_EXCEPTIONS:
-                raise
-            print('WHOA, too fast, slow it down retries={}'.format(retries))
-            sleep(2 ** retries)
-            retries += 1     # TODO max limit
-    return pokemon
+            results[cardid] = legality.legality(key['set_code'],
+                                                key['number'], cardid)
+        except ValueError:
+            logger.warning('Card {} has an unexpected number'.format(cardid))
+    return results
+
+
+def _and(filter, condition):
+    """ AND condition onto filter, either may be None """
+    if filter is None:
+        return condition
+    if condition is None:
+        return filter
+    return filter & condition
+
+
+def get_cards(cardtable, cardids, fields=None, filter=None):
+    """ Return the cards with the given ids using GetItem or BatchGetItem
+
+    Cards are returned in the order of cardids, ids which aren't found are
+    logged and skipped.
+
+    fields -- only read these attributes (see dbtools.projection)
+    filter -- only return the cards meeting this condition, as the
+              FilterExpression of a query would
+    """
+    get_kw = {}
+    if fields and filter is None:
+        # id is needed to put the cards in order
+        get_kw = dbtools.projection(list(fields) + ['id'])
+    if len(cardids) == 1:
+        item = dbtools.get_item(cardtable, dbtools.card_key(cardids[0]),
+                                **get_kw)
+        items = [item] if item else []
+    else:
+        items = dbtools.batch_get_items(
+            cardtable, [dbtools.card_key(cardid) for cardid in cardids],
+            **get_kw)
+    found = {item['id']: item for item in items}
+    cards = []
+    for cardid in cardids:
+        if cardid in found:
+            cards.append(found[cardid])
+        else:
+            logger.warning('Card {} not found'.format(cardid))
+    cards = replace_decimals(cards)
+    if filter is not None:
+        # the whole cards were read so the filter can be evaluated
+        cards = [card for card in cards if storage.evaluate(filter, card)]
+        if fields:
+            cards = [storage.project(card, fields) for card in cards]
+    elif fields and 'id' not in fields:
+        for card in cards:
+            del card['id']
+    return cards
+
+
+def query_set(cardtable, setcode, filter=None, **query_kw):
+    """ Return the cards in a set with a Query on the set_code partition """
+    cards = []
+    for page in query_set_pages(cardtable, setcode, filter, **query_kw):
+        cards.extend(page)
+    return cards
+
+
+def query_set_pages(cardtable, setcode, filter=None, **query_kw):
+    """ Query the set_code partition, yielding each page of cards
+
+    Numbers are returned as int/float (see dbtools.plain_client).
+
+    query_kw -- added to the query (e.g. ProjectionExpression)
+    """
+    query_kw['KeyConditionExpression'] = Key('set_code').eq(setcode)
+    if filter:
+        query_kw['FilterExpression'] = filter
+    return dbtools.query_pages(cardtable, plain=True, **query_kw)
+
+
+def _criteria_filter(criteria, season, legalformats):
+    """ return a filter for criteria and legal formats, or None """
+    filter = None
+    for attribute, value in sorted(criteria.items()):
+        filter = _and(filter, Attr(attribute).eq(value))
+    for legalformat in legalformats:
+        filter = _and(filter, Attr('{}_{}'.format(season, legalformat)).eq(
+            True))
+    return filter
+
+
+def choose_index(cardtable, criteria, season, legalformats):
+    """ Pick a secondary index to serve the criteria
+
+    Indexes are preferred in order of selectivity: name-index, then the
+    sparse legality index for the season, then supertype-index.  Only indexes
+    which exist on the table and are active (not still being built) are
+    considered, legality indexes only exist for the most recent seasons (see
+    dbtools.card_indexes).
+
+    Returns (index name, list of KeyConditionExpressions, remaining criteria,
+    remaining legal formats), or None if no index applies.  The legality
+    index is partitioned by supertype so it takes one query per supertype
+    unless one was asked for.
+    """
+    indexes = [index['IndexName']
+               for index in cardtable.global_secondary_indexes or []
+               if index.get('IndexStatus', 'ACTIVE') == 'ACTIVE']
+    criteria = dict(criteria)
+    legalformats = list(legalformats)
+
+    if 'name' in criteria and 'name-index' in indexes:
+        keycondition = Key('name').eq(criteria.pop('name'))
+        return 'name-index', [keycondition], criteria, legalformats
+
+    for legalformat in legalformats:
+        indexname = dbtools.legality_index_name(season, legalformat)
+        if indexname not in indexes:
+            continue
+        legalformats.remove(legalformat)
+        attribute = dbtools.legality_index_attribute(season, legalformat)
+        if 'supertype' in criteria:
+            supertypes = [criteria.pop('supertype')]
+        else:
+            supertypes = dbtools.SUPERTYPES
+        return (indexname,
+                [Key(attribute).eq(supertype) for supertype in supertypes],
+                criteria, legalformats)
+
+    if 'supertype' in criteria and 'supertype-index' in indexes:
+        keycondition = Key('supertype').eq(criteria.pop('supertype'))
+        return 'supertype-index', [keycondition], criteria, legalformats
+
+    return None
+
+
+def query_index(cardtable, criteria, season, legalformats, filter=None,
+                segments=1, **read_kw):
+    """ Return the cards matching criteria, legal formats and filter
+
+    Uses a secondary index where one applies (see choose_index), otherwise
+    falls back to scanning the table.
+    """
+    cards = []
+    for page in query_index_pages(cardtable, criteria, season, legalformats,
+                                  filter, segments, **read_kw):
+        cards.extend(page)
+    return cards
+
+
+def query_index_pages(cardtable, criteria, season, legalformats,
+                      filter=None, segments=1, ordered=True, **read_kw):
+    """ Generator of pages of cards for query_index
+
+    ordered -- when falling back to a parallel scan, return the pages in
+               segment order (in a single page) rather than as they arrive
+    read_kw -- added to each query or scan (e.g. ProjectionExpression)
+    """
+    choice = choose_index(cardtable, criteria, season, legalformats)
+    if choice is None:
+        filter = _and(filter, _criteria_filter(criteria, season,
+                                               legalformats))
+        if ordered:
+            yield query_cards(cardtable, filter, segments, **read_kw)
+            return
+        if filter:
+            read_kw['FilterExpression'] = filter
+        yield from dbtools.scan_pages(cardtable, segments, plain=True,
+                                      **read_kw)
+        return
+
+    indexname, keyconditions, criteria, legalformats = choice
+    logger.info('Querying index {}'.format(indexname))
+    filter = _and(filter, _criteria_filter(criteria, season, legalformats))
+    for keycondition in keyconditions:
+        query_kw = dict(read_kw, IndexName=indexname,
+                        KeyConditionExpression=keycondition)
+        if filter:
+            query_kw['FilterExpression'] = filter
+        yield from dbtools.query_pages(cardtable, plain=True, **query_kw)
+
+
+def query_cards(cardtable, filter, segments=1, **scan_kw):
+    """ Query the cardtable with the filter and return a list pokemon
+
+    Numbers are returned as int/float (see dbtools.plain_client).
+
+    segments -- number of parallel scan segments, see dbtools.scan_pages
+    scan_kw -- added to the scan (e.g. ProjectionExpression)
+    """
+    return dbtools.scan_items(cardtable, filter, segments=segments,
+                              plain=True, **scan_kw)
+
+
+def write_ndjson(pages, out=None):
+    """ Write each card as a line of JSON, flushing after every page """
+    out = out or sys.stdout
+    for page in pages:
+        for card in page:
+            out.write(json.dumps(card) + '\n')
+        out.flush()
+
+
+def cache_path(cachedir, table_name, query):
+    """ Return the cache file for a query on a table
+
+    query -- dict of the normalized query arguments
+    """
+    digest = hashlib.sha1(json.dumps(
+        query, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(cachedir, '{}-{}.json'.format(table_name, digest))
+
+
+def read_cache(cachefile, generation):
+    """ Return the cached cards, None if they aren't cached or are from a
+    different generation of the tables
+    """
+    try:
+        with open(cachefile) as json_file:
+            cached = json.load(json_file)
+    except (OSError, ValueError):
+        return None
+    if cached.get('generation') != generation:
+        return None
+    return cached['cards']
+
+
+def write_cache(cachefile, generation, cards):
+    """ Cache the cards for the generation of the tables """
+    os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+    # Write to a temporary file and rename so readers never see part of it
+    tmpfile = '{}.{}.tmp'.format(cachefile, os.getpid())
+    with open(tmpfile, 'w') as json_file:
+        json.dump({'generation': generation, 'cards': cards}, json_file)
+    os.replace(tmpfile, cachefile)
 
 
 def replace_decimals(obj):
@@ -0,0 +1,685 @@
+''' Storage backends for the card and set tables
+
+The tools work with a DynamoDB service resource (boto3.resource), either
+against AWS or DynamoDB Local.  SQLiteDatabase is an embedded alternative
+implementing the subset of the resource, Table and client operations the
+tools use (create/delete tables, put, batch write, get, batch get, query and
+scan, with boto3 Key/Attr conditions), so local runs don't need a service.
+Use connect() to get either.
+'''
+import datetime
+import decimal
+import json
+import re
+import sqlite3
+import threading
+import boto3
+from boto3.dynamodb.conditions import AttributeBase, ConditionBase
+from botocore.exceptions import ClientError
+
+# Most items returned in one page of a query or scan
+PAGE_SIZE = 1000
+
+# Table holding the create_table arguments of each table in the database
+SPEC_TABLE = '__tables__'
+
+# Column holding the json of each item
+ITEM_COLUMN = '__item__'
+
+# Stands in for attributes an item doesn't have
+MISSING = object()
+
+
+def connect(localdb=False, sqlite=None):
+    """ Return the database for the tools' tables
+
+    sqlite -- path of an SQLite database file, used instead of DynamoDB
+    localdb -- use DynamoDB Local at localhost:8000
+    """
+    if sqlite:
+        return SQLiteDatabase(sqlite)
+    if localdb:
+        return boto3.resource('dynamodb',
+                              endpoint_url='http://localhost:8000')
+    return boto3.resource('dynamodb')
+
+
+def _error(code, message, operation):
+    """ a ClientError like the ones boto3 raises """
+    return ClientError({'Error': {'Code': code, 'Message': message}},
+                       operation)
+
+
+def _quote(name):
+    """ quote an identifier for SQL """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _json_default(value):
+    """ encode the values json can't: Decimals (from the resource layer)
+    become int/float and sets become lists
+    """
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(
+            value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def _column_value(value):
+    """ value for an indexed column, only scalars can be key attributes """
+    if isinstance(value, bool) or not isinstance(
+            value, (str, int, float, decimal.Decimal)):
+        return None
+    if isinstance(value, decimal.Decimal):
+        return _json_default(value)
+    return value
+
+
+class SQLiteDatabase(object):
+    """ Stands in for a boto3 DynamoDB service resource, backed by SQLite
+
+    Each table is an SQLite table with a column for each attribute in its
+    AttributeDefinitions (the table and index keys, e.g. set_code, number,
+    id, name and the legality index attributes) and the whole item as json.
+    Each global secondary index is an SQLite index on its key columns.
+
+    Items are returned with numbers as int/float, the same as
+    dbtools.plain_client.  Tables are always on-demand.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # One connection is shared by the threads dbtools uses, requests
+        # are serialized by the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} (name TEXT PRIMARY KEY, '
+                'spec TEXT NOT NULL, created TEXT NOT NULL)'.format(
+                    _quote(SPEC_TABLE)))
+        self.meta = _Meta(SQLiteClient(self))
+        self.tables = _Tables(self)
+
+    def Table(self, name):
+        """ the table called name, which may not exist (yet) """
+        return SQLiteTable(self, name)
+
+    def create_table(self, **spec):
+        """ create a table from create_table arguments """
+        name = spec['TableName']
+        with self.lock, self.connection:
+            if self.spec(name):
+                raise _error('ResourceInUseException',
+                             'Table already exists: {}'.format(name),
+                             'CreateTable')
+            attributes = [attribute['AttributeName']
+                          for attribute in spec['AttributeDefinitions']]
+            keys = [key['AttributeName'] for key in spec['KeySchema']]
+            self.connection.execute(
+                'CREATE TABLE {} ({}, {} TEXT NOT NULL, '
+                'PRIMARY KEY ({}))'.format(
+                    _quote(name),
+                    ', '.join(_quote(attribute) for attribute in attributes),
+                    _quote(ITEM_COLUMN),
+                    ', '.join(_quote(key) for key in keys)))
+            for index in spec.get('GlobalSecondaryIndexes', []):
+                self._create_index(name, index)
+            self.connection.execute(
+                'INSERT INTO {} (name, spec, created) VALUES (?, ?, ?)'.format(
+                    _quote(SPEC_TABLE)),
+                (name, json.dumps(spec),
+                 datetime.datetime.now(datetime.timezone.utc).isoformat()))
+        return self.Table(name)
+
+    def _create_index(self, table_name, index):
+        self.connection.execute('CREATE INDEX {} ON {} ({})'.format(
+            _quote('{}.{}'.format(table_name, index['IndexName'])),
+            _quote(table_name),
+            ', '.join(_quote(key['AttributeName'])
+                      for key in index['KeySchema'])))
+
+    def spec(self, name):
+        """ the create_table arguments of a table, None if it doesn't
+        exist
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT spec FROM {} WHERE name = ?'.format(
+                    _quote(SPEC_TABLE)), (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _table_spec(self, name, operation):
+        """ spec of a table, raising ResourceNotFoundException if it doesn't
+        exist
+        """
+        spec = self.spec(name)
+        if spec is None:
+            raise _error('ResourceNotFoundException',
+                         'Requested resource not found: Table: {} not '
+                         'found'.format(name), operation)
+        return spec
+
+    def table_names(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                'SELECT name FROM {} ORDER BY name'.format(
+                    _quote(SPEC_TABLE)))]
+
+
+class _Meta(object):
+    def __init__(self, client):
+        self.client = client
+
+
+class _Tables(object):
+    """ database.tables, only all() is supported """
+
+    def __init__(self, database):
+        self.database = database
+
+    def all(self):
+        return [self.database.Table(name)
+                for name in self.database.table_names()]
+
+
+class SQLiteTable(object):
+    """ Stands in for a boto3 DynamoDB Table resource """
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = self.table_name = name
+        self.meta = database.meta
+
+    def __repr__(self):
+        return 'sqlite.Table(name={!r})'.format(self.name)
+
+    def _spec(self):
+        return self.database._table_spec(self.name, 'DescribeTable')
+
+    @property
+    def key_schema(self):
+        return self._spec()['KeySchema']
+
+    @property
+    def attribute_definitions(self):
+        return self._spec()['AttributeDefinitions']
+
+    @property
+    def global_secondary_indexes(self):
+        return self.meta.client.describe_table(TableName=self.name)[
+            'Table']['GlobalSecondaryIndexes'] or None
+
+    @property
+    def table_status(self):
+        self._spec()
+        return 'ACTIVE'
+
+    @property
+    def billing_mode_summary(self):
+        return {'BillingMode': 'PAY_PER_REQUEST'}
+
+    @property
+    def provisioned_throughput(self):
+        return {'ReadCapacityUnits': 0, 'WriteCapacityUnits': 0}
+
+    @property
+    def creation_date_time(self):
+        with self.database.lock:
+            row = self.database.connection.execute(
+                'SELECT created FROM {} WHERE name = ?'.format(
+                    _quote(SPEC_TABLE)), (self.name,)).fetchone()
+        if not row:
+            self._spec()
+        return datetime.datetime.fromisoformat(row[0])
+
+    def reload(self):
+        """ nothing is cached, so there is nothing to reload """
+
+    def delete(self):
+        database = self.database
+        with database.lock, database.connection:
+            database._table_spec(self.name, 'DeleteTable')
+            database.connection.execute('DROP TABLE {}'.format(
+                _quote(self.name)))
+            database.connection.execute(
+                'DELETE FROM {} WHERE name = ?'.format(_quote(SPEC_TABLE)),
+                (self.name,))
+
+    def update(self, AttributeDefinitions=(), GlobalSecondaryIndexUpdates=(),
+               **kwargs):
+        """ Create or delete global secondary indexes, throughput and
+        billing changes are ignored
+        """
+        database = self.database
+        with database.lock, database.connection:
+            spec = database._table_spec(self.name, 'UpdateTable')
+            columns = [attribute['AttributeName']
+                       for attribute in spec['AttributeDefinitions']]
+            added = [attribute for attribute in AttributeDefinitions
+                     if attribute['AttributeName'] not in columns]
+            for attribute in added:
+                database.connection.execute(
+                    'ALTER TABLE {} ADD COLUMN {}'.format(
+                        _quote(self.name),
+                        _quote(attribute['AttributeName'])))
+            spec['AttributeDefinitions'].extend(added)
+            if added:
+                # Fill in the new columns from the existing items
+                names = [attribute['AttributeName'] for attribute in added]
+                rows = database.connection.execute(
+                    'SELECT rowid, {} FROM {}'.format(
+                        _quote(ITEM_COLUMN), _quote(self.name))).fetchall()
+                database.connection.executemany(
+                    'UPDATE {} SET {} WHERE rowid = ?'.format(
+                        _quote(self.name),
+                        ', '.join('{} = ?'.format(_quote(name))
+                                  for name in names)),
+                    [[_column_value(json.loads(item).get(name))
+                      for name in names] + [rowid] for rowid, item in rows])
+            indexes = spec.setdefault('GlobalSecondaryIndexes', [])
+            for update in GlobalSecondaryIndexUpdates:
+                if 'Create' in update:
+                    database._create_index(self.name, update['Create'])
+                    indexes.append(update['Create'])
+                elif 'Delete' in update:
+                    indexname = update['Delete']['IndexName']
+                    database.connection.execute('DROP INDEX {}'.format(
+                        _quote('{}.{}'.format(self.name, indexname))))
+                    indexes[:] = [index for index in indexes
+                                  if index['IndexName'] != indexname]
+            database.connection.execute(
+                'UPDATE {} SET spec = ? WHERE name = ?'.format(
+                    _quote(SPEC_TABLE)), (json.dumps(spec), self.name))
+
+    def put_item(self, Item, **kwargs):
+        return self.meta.client.batch_write_item(
+            RequestItems={self.name: [{'PutRequest': {'Item': Item}}]})
+
+    def delete_item(self, Key, **kwargs):
+        return self.meta.client.batch_write_item(
+            RequestItems={self.name: [{'DeleteRequest': {'Key': Key}}]})
+
+    def get_item(self, Key, **kwargs):
+        return self.meta.client.get_item(TableName=self.name, Key=Key,
+                                         **kwargs)
+
+    def query(self, **kwargs):
+        return self.meta.client.query(TableName=self.name, **kwargs)
+
+    def scan(self, **kwargs):
+        return self.meta.client.scan(TableName=self.name, **kwargs)
+
+
+class _Waiter(object):
+    """ SQLite tables are created and deleted immediately """
+
+    def wait(self, **kwargs):
+        pass
+
+
+class SQLiteClient(object):
+    """ Stands in for the low level client of an SQLiteDatabase
+
+    Conditions are boto3 Key/Attr objects rather than expression strings,
+    and items are plain python values rather than typed attribute values.
+    """
+
+    # Items are returned with numbers as int/float, see dbtools._plain
+    plain = True
+
+    def __init__(self, database):
+        self.database = database
+
+    def get_waiter(self, name):
+        return _Waiter()
+
+    def describe_table(self, TableName):
+        spec = self.database._table_spec(TableName, 'DescribeTable')
+        description = dict(spec, TableStatus='ACTIVE', BillingModeSummary={
+            'BillingMode': 'PAY_PER_REQUEST'})
+        description['GlobalSecondaryIndexes'] = [
+            dict(index, IndexStatus='ACTIVE')
+            for index in spec.get('GlobalSecondaryIndexes', [])]
+        return {'Table': description}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        database = self.database
+        with database.lock, database.connection:
+            for table_name, requests in RequestItems.items():
+                spec = database._table_spec(table_name, 'BatchWriteItem')
+                columns = [attribute['AttributeName']
+                           for attribute in spec['AttributeDefinitions']]
+                keys = [key['AttributeName'] for key in spec['KeySchema']]
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        if any(_column_value(item.get(key)) is None
+                               for key in keys):
+                            raise _error(
+                                'ValidationException',
+                                'One of the required keys was not given a '
+                                'value', 'BatchWriteItem')
+                        database.connection.execute(
+                            'INSERT OR REPLACE INTO {} ({}, {}) VALUES '
+                            '({})'.format(
+                                _quote(table_name),
+                                ', '.join(_quote(column)
+                                          for column in columns),
+                                _quote(ITEM_COLUMN),
+                                ', '.join('?' * (len(columns) + 1))),
+                            [_column_value(item.get(column))
+                             for column in columns] +
+                            [json.dumps(item, default=_json_default)])
+                    else:
+                        key = request['DeleteRequest']['Key']
+                        database.connection.execute(
+                            'DELETE FROM {} WHERE {}'.format(
+                                _quote(table_name),
+                                ' AND '.join('{} = ?'.format(_quote(name))
+                                             for name in keys)),
+                            [_column_value(key[name]) for name in keys])
+        return {'UnprocessedItems': {}}
+
+    def _get(self, table_name, key, operation):
+        database = self.database
+        spec = database._table_spec(table_name, operation)
+        keys = [keyattribute['AttributeName']
+                for keyattribute in spec['KeySchema']]
+        with database.lock:
+            row = database.connection.execute(
+                'SELECT {} FROM {} WHERE {}'.format(
+                    _quote(ITEM_COLUMN), _quote(table_name),
+                    ' AND '.join('{} = ?'.format(_quote(name))
+                                 for name in keys)),
+                [_column_value(key[name]) for name in keys]).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_item(self, TableName, Key, ProjectionExpression=None,
+                 ExpressionAttributeNames=None, **kwargs):
+        item = self._get(TableName, Key, 'GetItem')
+        if item is None:
+            return {}
+        return {'Item': _project(item, ProjectionExpression,
+                                 ExpressionAttributeNames)}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for table_name, request in RequestItems.items():
+            items = (self._get(table_name, key, 'BatchGetItem')
+                     for key in request['Keys'])
+            responses[table_name] = [
+                _project(item, request.get('ProjectionExpression'),
+                         request.get('ExpressionAttributeNames'))
+                for item in items if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def query(self, TableName, KeyConditionExpression, IndexName=None,
+              **kwargs):
+        clauses, parameters = _key_condition(KeyConditionExpression)
+        return self._read(TableName, IndexName, clauses, parameters,
+                          'Query', **kwargs)
+
+    def scan(self, TableName, IndexName=None, Segment=None,
+             TotalSegments=None, **kwargs):
+        clauses, parameters = [], []
+        if TotalSegments:
+            clauses.append('rowid % ? = ?')
+            parameters.extend([TotalSegments, Segment])
+        return self._read(TableName, IndexName, clauses, parameters, 'Scan',
+                          **kwargs)
+
+    def _read(self, table_name, index_name, clauses, parameters, operation,
+              FilterExpression=None, ProjectionExpression=None,
+              ExpressionAttributeNames=None, ExclusiveStartKey=None,
+              ScanIndexForward=True, Limit=None, **kwargs):
+        """ a page of a query or scan, in the order of the index (or table)
+        keys, then the table keys
+        """
+        database = self.database
+        spec = database._table_spec(table_name, operation)
+        order = [key['AttributeName'] for key in spec['KeySchema']]
+        if index_name:
+            indexes = {index['IndexName']: index
+                       for index in spec.get('GlobalSecondaryIndexes', [])}
+            if index_name not in indexes:
+                raise _error('ValidationException',
+                             'The table does not have the specified index: '
+                             '{}'.format(index_name), operation)
+            indexkeys = [key['AttributeName']
+                         for key in indexes[index_name]['KeySchema']]
+            # Indexes are sparse, items without the index keys aren't in them
+            clauses = clauses + ['{} IS NOT NULL'.format(_quote(key))
+                                 for key in indexkeys]
+            order = indexkeys + [key for key in order
+                                 if key not in indexkeys]
+        clauses = list(clauses)
+        parameters = list(parameters)
+        if ExclusiveStartKey:
+            clauses.append('({}) {} ({})'.format(
+                ', '.join(_quote(key) for key in order),
+                '>' if ScanIndexForward else '<',
+                ', '.join('?' * len(order))))
+            parameters.extend(_column_value(ExclusiveStartKey[key])
+                              for key in order)
+        limit = min(Limit or PAGE_SIZE, PAGE_SIZE)
+        with database.lock:
+            rows = database.connection.execute(
+                'SELECT {}, {} FROM {} {} ORDER BY {} LIMIT ?'.format(
+                    ', '.join(_quote(key) for key in order),
+                    _quote(ITEM_COLUMN), _quote(table_name),
+                    'WHERE ' + ' AND '.join(clauses) if clauses else '',
+                    ', '.join('{} {}'.format(
+                        _quote(key), 'ASC' if ScanIndexForward else 'DESC')
+                        for key in order)),
+                parameters + [limit]).fetchall()
+        items = []
+        for row in rows:
+            item = json.loads(row[-1])
+            if FilterExpression is None or evaluate(FilterExpression, item):
+                items.append(_project(item, ProjectionExpression,
+                                      ExpressionAttributeNames))
+        response = {'Items': items, 'Count': len(items),
+                    'ScannedCount': len(rows)}
+        if len(rows) == limit:
+            response['LastEvaluatedKey'] = dict(zip(order, rows[-1][:-1]))
+        return response
+
+
+def _key_condition(condition):
+    """ SQL clauses and parameters for a KeyConditionExpression """
+    expression = condition.get_expression()
+    operator = expression['operator']
+    values = expression['values']
+    if operator == 'AND':
+        clauses, parameters = _key_condition(values[0])
+        more_clauses, more_parameters = _key_condition(values[1])
+        return clauses + more_clauses, parameters + more_parameters
+    column = _quote(values[0].name)
+    if operator == 'BETWEEN':
+        return (['{} BETWEEN ? AND ?'.format(column)],
+                [_column_value(values[1]), _column_value(values[2])])
+    if operator == 'begins_with':
+        # substr rather than LIKE, which ignores case
+        return (['substr({}, 1, length(?)) = ?'.format(column)],
+                [values[1], values[1]])
+    if operator in ('=', '<', '<=', '>', '>='):
+        return (['{} {} ?'.format(column, operator)],
+                [_column_value(values[1])])
+    raise _error('ValidationException',
+                 'Unsupported key condition {}'.format(operator), 'Query')
+
+
+def _path(path):
+    """ 'attacks[0].name' -> ['attacks', 0, 'name'] """
+    elements = []
+    for name, index in re.findall(r'([^.\[\]]+)|\[(\d+)\]', path):
+        elements.append(int(index) if index else name)
+    return elements
+
+
+def _path_value(item, path):
+    """ the value at a document path in item, MISSING if there isn't one """
+    value = item
+    for element in _path(path):
+        if isinstance(element, int):
+            if not isinstance(value, list) or element >= len(value):
+                return MISSING
+        elif not isinstance(value, dict) or element not in value:
+            return MISSING
+        value = value[element]
+    return value
+
+
+def project(item, fields):
+    """ the attributes of item named by fields, as reading the item with
+    dbtools.projection(fields) returns them
+    """
+    return _project(item, ', '.join(fields))
+
+
+def _project(item, projection_expression, names=None):
+    """ the attributes of item named by a ProjectionExpression """
+    if not projection_expression:
+        return item
+    names = names or {}
+    projected = {}
+    for path in projection_expression.split(','):
+        path = re.sub(r'#\w+', lambda match: names[match.group(0)],
+                      path.strip())
+        elements = _path(path)
+        if _path_value(item, path) is MISSING:
+            continue
+        source = item
+        target = projected
+        for position, element in enumerate(elements):
+            source = source[element]
+            if position == len(elements) - 1:
+                target[element] = source
+            else:
+                # list positions are collected in a dict, see _lists
+                target = target.setdefault(element, {})
+    return _lists(projected, item)
+
+
+def _lists(projected, item):
+    """ turn the dicts _project collected list positions in back into lists,
+    keeping the positions in order as DynamoDB does
+    """
+    for name, value in projected.items():
+        if isinstance(item[name], list) and isinstance(value, dict):
+            projected[name] = [
+                _lists(value[index], item[name][index])
+                if isinstance(value[index], dict) and
+                isinstance(item[name][index], dict) else value[index]
+                for index in sorted(value)]
+        elif isinstance(item[name], dict) and isinstance(value, dict):
+            projected[name] = _lists(value, item[name])
+    return projected
+
+
+def _number(value):
+    return (isinstance(value, (int, float, decimal.Decimal)) and
+            not isinstance(value, bool))
+
+
+def _comparable(left, right):
+    """ DynamoDB only compares values of the same type """
+    if _number(left) and _number(right):
+        return True
+    return type(left) is type(right) and isinstance(left, (str, bytes))
+
+
+def _equal(left, right):
+    """ equal values of the same type (True isn't 1 to DynamoDB) """
+    return left == right and (type(left) is type(right) or
+                              _number(left) and _number(right))
+
+
+def _attribute_type(value):
+    if isinstance(value, bool):
+        return 'BOOL'
+    if _number(value):
+        return 'N'
+    if isinstance(value, str):
+        return 'S'
+    if value is None:
+        return 'NULL'
+    if isinstance(value, list):
+        return 'L'
+    if isinstance(value, dict):
+        return 'M'
+    return 'B'
+
+
+def _operand(value, item):
+    """ the value of one side of a condition for item """
+    if isinstance(value, AttributeBase):
+        return _path_value(item, value.name)
+    if isinstance(value, ConditionBase):
+        # size()
+        attribute = _operand(value.get_expression()['values'][0], item)
+        if attribute is MISSING:
+            return MISSING
+        return len(attribute)
+    return value
+
+
+def evaluate(condition, item):
+    """ True if item satisfies a boto3 condition (e.g. a FilterExpression
+    built from Attr), following DynamoDB's comparison rules
+    """
+    expression = condition.get_expression()
+    operator = expression['operator']
+    values = expression['values']
+    if operator == 'AND':
+        return evaluate(values[0], item) and evaluate(values[1], item)
+    if operator == 'OR':
+        return evaluate(values[0], item) or evaluate(values[1], item)
+    if operator == 'NOT':
+        return not evaluate(values[0], item)
+
+    operands = [_operand(value, item) for value in values]
+    if operator == 'attribute_exists':
+        return operands[0] is not MISSING
+    if operator == 'attribute_not_exists':
+        return operands[0] is MISSING
+    left = operands[0]
+    if left is MISSING:
+        return operator == '<>'
+    if operator == 'attribute_type':
+        return _attribute_type(left) == operands[1]
+    if operator == '=':
+        return _equal(left, operands[1])
+    if operator == '<>':
+        return not _equal(left, operands[1])
+    if operator == 'IN':
+        return any(_equal(left, value) for value in operands[1])
+    if operator == 'begins_with':
+        return _comparable(left, operands[1]) and isinstance(
+            left, str) and left.startswith(operands[1])
+    if operator == 'contains':
+        if isinstance(left, str):
+            return isinstance(operands[1], str) and operands[1] in left
+        if isinstance(left, (list, set, frozenset)):
+            return operands[1] in left
+        return False
+    if operator == 'BETWEEN':
+        return (_comparable(left, operands[1]) and
+                _comparable(left, operands[2]) and
+                operands[1] <= left <= operands[2])
+    if not _comparable(left, operands[1]):
+        return False
+    if operator == '<':
+        return left < operands[1]
+    if operator == '<=':
+        return left <= operands[1]
+    if operator == '>':
+        return left > operands[1]
+    if operator == '>=':
+        return left >= operands[1]
+    raise _error('ValidationException',
+                 'Unsupported condition {}'.format(operator), 'Scan')
@@ -0,0 +1,127 @@
+''' Inverted index of the text on cards (abilities, attacks, Trainer and
+Energy text) for ranked full text search
+'''
+import math
+import tcgdata.indexfile as indexfile
+
+# Bump when the file format or tokenizing changes
+INDEX_VERSION = 1
+
+# Default index file, written by loadcards --textindex and buildtextindex
+TEXT_INDEX_FILE = 'textindex.json'
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Names (of abilities, attacks...) count this many times their text
+NAME_WEIGHT = 2
+
+
+def main():
+    indexfile.build_main(TextIndex, 'Build the text search index from the '
+                         'card files', TEXT_INDEX_FILE)
+
+
+def tokenize(text):
+    """ lower case words of text without accents or apostrophes, e.g.
+    "Opponent's Pokémon" -> ['opponents', 'pokemon']
+    """
+    return indexfile.words(text)
+
+
+def card_text(card):
+    """ Generator of (text, weight) for the searchable text on a card
+
+    Works on card file (camelCase) and card table (snake_case) records.
+    """
+    for name in ('ability', 'ancientTrait', 'ancient_trait'):
+        if isinstance(card.get(name), dict):
+            yield card[name].get('name', ''), NAME_WEIGHT
+            yield card[name].get('text', ''), 1
+    for attack in card.get('attacks') or []:
+        yield attack.get('name', ''), NAME_WEIGHT
+        yield attack.get('text', ''), 1
+    # Trainer and Energy text
+    text = card.get('text') or []
+    for line in [text] if isinstance(text, str) else text:
+        yield line, 1
+
+
+class TextIndex(indexfile.IndexFile):
+    """ Token -> posting list index of card text, ranked with BM25
+
+    ids -- card id of each document number
+    lengths -- weighted number of tokens in each document
+    postings -- {token: [[document number, weighted term frequency], ...]}
+                in document number order
+    """
+
+    kind = 'text index'
+    version = INDEX_VERSION
+
+    def __init__(self, ids=None, lengths=None, postings=None):
+        self.ids = ids or []
+        self.lengths = lengths or []
+        self.postings = postings or {}
+
+    def add(self, card):
+        """ index the text of a card, cards without text are skipped """
+        counts = {}
+        for text, weight in card_text(card):
+            for token in tokenize(text or ''):
+                counts[token] = counts.get(token, 0) + weight
+        if not counts:
+            return
+        document = len(self.ids)
+        self.ids.append(card['id'])
+        self.lengths.append(sum(counts.values()))
+        for token, count in counts.items():
+            self.postings.setdefault(token, []).append([document, count])
+
+    def search(self, query, limit=None):
+        """ Return [(card id, score)] of the cards containing every word of
+        query, best match first
+        """
+        tokens = sorted(set(tokenize(query)))
+        if not tokens or not self.ids:
+            return []
+        postings = [self.postings.get(token, []) for token in tokens]
+        if not all(postings):
+            return []
+        # Intersect starting from the rarest token
+        postings.sort(key=len)
+        scores = {}
+        average = sum(self.lengths) / len(self.lengths)
+        for position, posting in enumerate(postings):
+            idf = math.log(1 + (len(self.ids) - len(posting) + 0.5) /
+                           (len(posting) + 0.5))
+            matched = {}
+            for document, count in posting:
+                if position and document not in scores:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B *
+                                  self.lengths[document] / average)
+                matched[document] = (scores.get(document, 0) + idf * count *
+                                     (BM25_K1 + 1) / (count + norm))
+            scores = matched
+        ranked = sorted(scores.items(),
+                        key=lambda score: (-score[1], self.ids[score[0]]))
+        if limit:
+            ranked = ranked[:limit]
+        return [(self.ids[document], score) for document, score in ranked]
+
+    def summary(self):
+        return '{} cards, {} terms'.format(len(self.ids), len(self.postings))
+
+    def to_json(self):
+        return {'ids': self.ids, 'lengths': self.lengths,
+                'postings': self.postings}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['ids'], data['lengths'], data['postings'])
+
+
+if __name__ == "__main__":
+    main()
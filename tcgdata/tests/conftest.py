@@ -0,0 +1,158 @@
+''' Fixtures shared by the tests '''
+import json
+import os
+from copy import deepcopy
+from functools import partial
+
+import boto3
+import pytest
+from moto import mock_aws
+import tcgdata.cardfilters as cardfilters
+import tcgdata.loadcards as loadcards
+from tcgdata.legality import LegalityIndex
+
+CARD_KEY_SCHEMA = [{'AttributeName': 'set_code', 'KeyType': 'HASH'},
+                   {'AttributeName': 'number', 'KeyType': 'RANGE'}]
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    """ DynamoDB resource backed by moto """
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        yield boto3.resource('dynamodb', region_name='us-east-1')
+
+
+@pytest.fixture
+def cardtable(dynamodb):
+    """ an empty on-demand table with the card table's key """
+    return dynamodb.create_table(
+        TableName='tcg_cards', KeySchema=CARD_KEY_SCHEMA,
+        AttributeDefinitions=[
+            {'AttributeName': 'set_code', 'AttributeType': 'S'},
+            {'AttributeName': 'number', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST')
+
+
+def make_cards(count, sets=3):
+    """ count minimal card items spread over sets sets """
+    return [{'set_code': 'xy{}'.format(i % sets), 'number': str(i),
+             'id': 'xy{}-{}'.format(i % sets, i), 'name': 'Card {}'.format(i),
+             'hp': str(10 * (i % 20))}
+            for i in range(count)]
+
+
+# Cards with the text, cost and legality cases the load filters handle
+SAMPLE_CARDS = [
+    {'id': 'xy7-1', 'set_code': 'xy7', 'number': '1', 'name': 'Pikachu',
+     'supertype': 'Pokémon', 'subtype': 'Basic', 'hp': '60',
+     'standard_legal': True, 'expanded_legal': None,
+     'ability': {'name': 'Static', 'text': 'It’s your opponent’s turn, '
+                 'don’t flip x2 coins.', 'type': 'Ability'},
+     'attacks': [
+         {'name': 'Thunder Shock', 'cost': ['Colorless', 'Lightning'],
+          'convertedEnergyCost': 2, 'damage': '20x',
+          'text': '(20x) Flip a coin. This attack does 20x damage '
+                  'for each heads.'},
+         {'name': 'Quick Attack', 'cost': [], 'damage': '10+',
+          'text': '(10+) Flip a coin. If heads, this attack does 10 more '
+                  'damage.'}],
+     'weaknesses': [{'type': 'Fighting', 'value': 'x2'}],
+     'resistances': [{'type': 'Metal', 'value': '-20'}],
+     'retreat_cost': ['Colorless'], 'artist': '', 'evolvesFrom': None},
+    {'id': 'xy7-2', 'set_code': 'xy7', 'number': '2', 'name': 'Switch',
+     'supertype': 'Trainer', 'subtype': 'Item',
+     'text': ["Switch your Active Pokémon with 1 of your Benched Pokémon.",
+              '', "You can't play more than 1 Item card that's x3.",
+              'None'],
+     'artist': 'None'},
+    {'id': 'xyp-XY40', 'set_code': 'xyp', 'number': 'XY40',
+     'name': 'Team Flare Grunt', 'supertype': 'Trainer',
+     'subtype': 'Supporter',
+     'text': ["Discard an Energy from your opponent’s Active Pokémon."]},
+    {'id': 'xyp-XY70', 'set_code': 'xyp', 'number': 'XY70',
+     'name': 'Garchomp', 'supertype': 'Pokémon', 'subtype': 'Stage 2',
+     'hp': '150', 'evolvesFrom': 'Gabite',
+     'attacks': [
+         {'name': 'Dragonblade', 'cost': ['Colorless', 'Fighting', 'Water'],
+          'damage': '130×', 'text': '(130×) Discard the top 2 cards of your '
+          'deck.'},
+         {'name': 'Royal Blades', 'cost': ['Free'], 'damage': '',
+          'text': ''}]},
+    {'id': 'sm1-60', 'set_code': 'sm1', 'number': '60', 'name': 'Snorlax',
+     'supertype': 'Pokémon', 'subtype': 'Basic', 'hp': '150',
+     'attacks': [
+         {'name': 'Body Slam', 'cost': ['Colorless', 'Colorless',
+                                        'Colorless', 'Colorless'],
+          'damage': '100', 'text': "Flip a coin. If heads, your opponent's "
+          'Active Pokémon is now Paralyzed.'}],
+     'rules': ['You can’t have more than 1 card with 1x in its name.']},
+    {'id': 'bw4-72', 'set_code': 'bw4', 'number': '72',
+     'name': 'Charizard', 'supertype': 'Pokémon', 'subtype': 'Stage 2',
+     'hp': '120', 'standard_legal': False,
+     'attacks': [
+         {'name': 'Fire Spin', 'cost': ['Fire', 'Fire', 'Fire', 'Fire'],
+          'damage': '100', 'convertedEnergyCost': '4',
+          'text': 'Discard 2 Energy cards attached to Charizard in order '
+                  'to use this attack.'}]},
+]
+
+# Set data for update_set_data, as loaded from allsets.json
+SAMPLE_SETS = {
+    'xy7': {'total_cards': 100, 'release_date': '08/12/2015'},
+    'xyp': {'total_cards': 211, 'release_date': '10/09/2013'},
+    'sm1': {'total_cards': 163, 'release_date': '02/03/2017'},
+    'bw4': {'total_cards': 99, 'release_date': '02/08/2012'},
+}
+
+FORMATS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                            'formats.json')
+
+
+@pytest.fixture
+def sample_cards():
+    """ a fresh copy of SAMPLE_CARDS """
+    return deepcopy(SAMPLE_CARDS)
+
+
+@pytest.fixture
+def formats():
+    """ the repository's formats.json """
+    with open(FORMATS_FILE) as json_file:
+        return json.load(json_file)
+
+
+@pytest.fixture
+def tcgdata(formats):
+    """ the tcgdata structure loadcards passes to its filters """
+    return {'seasons': formats['seasons'],
+            'abbreviations': formats['abbreviations'],
+            'sets': deepcopy(SAMPLE_SETS),
+            'legality': LegalityIndex(formats['seasons']),
+            'reprints': [], 'reprintgroups': {}, 'reprintcards': set()}
+
+
+def card_filters(formats):
+    """ loadcards' card filters, without the indexes """
+    return [loadcards.delete_nulls,
+            loadcards.remove_oldtags,
+            loadcards.sort_energy,
+            loadcards.update_attack_damage,
+            partial(cardfilters.normalize_text,
+                    normalizer=cardfilters.TextNormalizer.from_formats(
+                        formats, loadcards.LOAD_TEXT_RULES)),
+            loadcards.update_card_legality,
+            loadcards.update_reprints,
+            loadcards.update_set_data]
+
+
+@pytest.fixture
+def loaded_cards(sample_cards, formats, tcgdata):
+    """ SAMPLE_CARDS as loadcards writes them to the card table """
+    filters = card_filters(formats)
+    for card in sample_cards:
+        for filter in filters:
+            filter(item=card, tcgdata=tcgdata)
+    return sample_cards
@@ -0,0 +1,120 @@
+''' AttackIndex range search and its index file '''
+import argparse
+import json
+import random
+
+import pytest
+from tcgdata.attackindex import (AttackIndex, attack_cost, card_hp,
+                                 parse_damage, parse_range)
+
+RANGES = [None, [None, None], [30, None], [None, 40], [20, 60], [50, 50],
+          [200, None]]
+COSTS = [None, [None, 1], [2, 3], [4, None], [2, 2]]
+
+
+def _cards(count, seed=1):
+    """ count cards with random attacks and HP """
+    rng = random.Random(seed)
+    cards = []
+    for number in range(count):
+        card = {'id': 'xy1-{}'.format(number), 'attacks': []}
+        for attack in range(rng.randint(0, 3)):
+            card['attacks'].append({
+                'damage': rng.choice(['', '10', '20+', '30×', '40x', '50-',
+                                      '60', '90', '120', '200']),
+                'cost': ['Colorless'] * rng.randint(0, 4)})
+        if rng.random() < 0.8:
+            card['hp'] = str(10 * rng.randint(3, 25))
+        cards.append(card)
+    return cards
+
+
+def _search(cards, damage=None, cost=None, hp=None):
+    """ AttackIndex.search, card by card """
+    matches = []
+    for card in cards if damage or cost else []:
+        for attack in card['attacks']:
+            value = parse_damage(attack['damage'])[0]
+            if damage and (value is None or not _in(value, damage)):
+                continue
+            if cost and not _in(attack_cost(attack), cost):
+                continue
+            order = ((value, attack_cost(attack)) if damage else
+                     (attack_cost(attack), value or 0))
+            matches.append((order, card['id']))
+    if hp:
+        withhp = sorted((card_hp(card), card['id']) for card in cards
+                        if card_hp(card) is not None and
+                        _in(card_hp(card), hp))
+        if not (damage or cost):
+            return [cardid for value, cardid in withhp]
+        withhp = set(cardid for value, cardid in withhp)
+        matches = [match for match in matches if match[1] in withhp]
+    cardids = []
+    for order, cardid in sorted(matches):
+        if cardid not in cardids:
+            cardids.append(cardid)
+    return cardids
+
+
+def _in(value, valuerange):
+    low, high = valuerange
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+@pytest.fixture(scope='module')
+def cards():
+    return _cards(300)
+
+
+@pytest.fixture(scope='module')
+def index(cards):
+    index = AttackIndex()
+    for card in cards:
+        index.add(card)
+    return index
+
+
+def test_parse():
+    assert parse_damage('30×') == (30, '×')
+    assert parse_damage(' 40x') == (40, '×')
+    assert parse_damage('120') == (120, None)
+    assert parse_damage('') == (None, None)
+    assert parse_range('130:') == [130, None]
+    assert parse_range(':2') == [None, 2]
+    assert parse_range('60') == [60, 60]
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_range('a:b')
+
+
+@pytest.mark.parametrize('damage', RANGES)
+@pytest.mark.parametrize('cost', COSTS)
+def test_search(index, cards, damage, cost):
+    assert index.search(damage, cost) == _search(cards, damage, cost)
+    assert index.search(damage, cost, [80, 150]) == _search(
+        cards, damage, cost, [80, 150])
+
+
+def test_search_hp(index, cards):
+    for hp in RANGES[1:]:
+        assert index.search(hp=hp) == _search(cards, hp=hp)
+
+
+def test_save_load(index, tmp_path, monkeypatch):
+    path = str(tmp_path / 'attackindex.json')
+    index.save(path)
+    # the sorted orders are read back rather than sorted again
+    monkeypatch.setattr(AttackIndex, '_sort', lambda self: None)
+    loaded = AttackIndex.load(path)
+    assert (loaded.bydamage, loaded.bycost, loaded.hp) == (
+        index.bydamage, index.bycost, index.hp)
+    for damage in RANGES:
+        for cost in COSTS:
+            assert loaded.search(damage, cost) == index.search(damage, cost)
+
+
+def test_load_unusable(tmp_path):
+    path = tmp_path / 'attackindex.json'
+    path.write_text(json.dumps({'version': 1, 'damage': [], 'cost': [],
+                                'ids': [], 'hp': [], 'hpids': []}))
+    assert AttackIndex.load(str(path)) is None
@@ -0,0 +1,137 @@
+''' TextNormalizer gives the same cards as the sequential filters it
+replaced
+'''
+import re
+from copy import deepcopy
+
+import pytest
+import tcgdata.cardfilters as cardfilters
+
+
+def _old_filter(patterns):
+    """ the filters as they were before TextNormalizer: every pattern is
+    applied in turn to every string of the item
+    """
+    def _filter(**kwargs):
+        d = kwargs['item']
+        if isinstance(d, dict):
+            for k, v in list(d.items()):
+                if isinstance(v, list) or isinstance(v, dict):
+                    _filter(item=v)
+                if isinstance(v, str):
+                    for pattern, replacement in patterns:
+                        v = d[k] = re.sub(pattern, replacement, v)
+        elif isinstance(d, list):
+            for i, v in enumerate(d):
+                if isinstance(v, str):
+                    for pattern, replacement in patterns:
+                        v = d[i] = re.sub(pattern, replacement, v)
+                if isinstance(v, dict):
+                    _filter(item=v)
+    return _filter
+
+
+old_apostrophe_to_quotes = _old_filter([(r'’s\b', r"'s"),
+                                        (r'’t\b', r"'t")])
+old_quote_to_apostrophe = _old_filter([(r'\'s\b', r'’s'),
+                                       (r'\'t\b', r'’t')])
+old_x_to_times = _old_filter([(r'\b(\d+)x\b', r'\1×'),
+                              (r'\bx(\d+)\b', r'×\1')])
+
+
+def old_clean_attack_text(**kwargs):
+    for attack in kwargs['item'].get('attacks') or []:
+        if attack.get('text'):
+            for pattern in [r'^\(\d+×\)\s*', r'^\(\d+\+\)\s*']:
+                attack['text'] = re.sub(pattern, '', attack['text'])
+
+
+# loadcards applied these one after the other
+OLD_LOAD_CHAIN = [old_x_to_times, old_quote_to_apostrophe,
+                  old_clean_attack_text]
+
+
+def _apply(filters, cards):
+    for card in cards:
+        for filter in filters:
+            filter(item=card)
+    return cards
+
+
+def test_load_rules_match_old_chain(sample_cards):
+    expected = _apply(OLD_LOAD_CHAIN, deepcopy(sample_cards))
+    normalizer = cardfilters.TextNormalizer(
+        ['x_to_times', 'quote_to_apostrophe', 'clean_attack_text'])
+    counts = {}
+    for card in sample_cards:
+        cardfilters.normalize_text(item=card, normalizer=normalizer,
+                                   counts=counts)
+    assert sample_cards == expected
+    assert counts == {'x_to_times': 6, 'quote_to_apostrophe': 3,
+                      'clean_attack_text': 3}
+
+
+@pytest.mark.parametrize('old, new', [
+    (old_apostrophe_to_quotes, cardfilters.apostrophe_to_quotes),
+    (old_quote_to_apostrophe, cardfilters.quote_to_apostrophe),
+    (old_x_to_times, cardfilters.x_to_times),
+])
+def test_single_rule_filters_match_old(sample_cards, old, new):
+    expected = _apply([old], deepcopy(sample_cards))
+    assert _apply([new], sample_cards) == expected
+
+
+def test_clean_attack_text(sample_cards):
+    # The rule also takes damage still written with an x, the old filter
+    # relied on x_to_times running first
+    expected = _apply([old_x_to_times, old_clean_attack_text],
+                      deepcopy(sample_cards))
+    _apply([cardfilters.x_to_times, cardfilters.clean_attack_text],
+           sample_cards)
+    assert sample_cards == expected
+    card = {'attacks': [{'text': '(20x) Flip a coin.'}],
+            'text': ['(20+) not an attack']}
+    cardfilters.clean_attack_text(item=card)
+    assert card == {'attacks': [{'text': 'Flip a coin.'}],
+                    'text': ['(20+) not an attack']}
+
+
+def test_from_formats_rules(formats, sample_cards):
+    # formats.json carries the default rules, quote_to_apostrophe disabled
+    assert list(formats['rules']) == list(cardfilters.TEXT_RULES)
+    normalizer = cardfilters.TextNormalizer.from_formats(formats)
+    assert normalizer.rules == ['apostrophe_to_quotes', 'x_to_times',
+                                'clean_attack_text']
+    expected = _apply([old_apostrophe_to_quotes, old_x_to_times,
+                       old_clean_attack_text], deepcopy(sample_cards))
+    for card in sample_cards:
+        normalizer.normalize(card)
+    assert sample_cards == expected
+
+
+def test_prefilter_skips_regex():
+    ruleset = {'never': {'prefilter': ['#'], 'patterns': [[r'a', 'b']]}}
+    normalizer = cardfilters.TextNormalizer(['never'], ruleset=ruleset)
+    counts = {}
+    assert normalizer.sub('banana', counts) == 'banana'
+    assert normalizer.sub('#banana', counts) == '#bbnbnb'
+    assert counts == {'never': 3}
+
+
+def test_fields_and_exclude_sets():
+    ruleset = {
+        'upper': {'fields': ['.attacks.name'], 'patterns': [[r'^a', 'A']]},
+        'swap': {'exclude_sets': 'dont_swap',
+                 'patterns': [[r'(\d)x', r'x\1']]}
+    }
+    normalizer = cardfilters.TextNormalizer(
+        ['upper', 'swap'], ruleset=ruleset, formats={'dont_swap': ['bw1']})
+    card = {'set_code': 'xy1', 'name': 'abc 2x',
+            'attacks': [{'name': 'abc 2x', 'text': 'abc'}]}
+    counts = normalizer.normalize(card)
+    assert card == {'set_code': 'xy1', 'name': 'abc x2',
+                    'attacks': [{'name': 'Abc x2', 'text': 'abc'}]}
+    assert counts == {'upper': 1, 'swap': 2}
+    card = {'set_code': 'bw1', 'attacks': [{'name': 'abc 2x'}]}
+    normalizer.normalize(card)
+    assert card == {'set_code': 'bw1', 'attacks': [{'name': 'Abc 2x'}]}
@@ -0,0 +1,97 @@
+''' CardCorpus answers queries as querycards does, CardServer rejects
+queries it can't answer
+'''
+import threading
+
+import pytest
+from tcgdata.cardserver import CardCorpus, CardServer, query_server
+
+IDS = ['sm1-60', 'xy7-2', 'nosuch-1', 'xyp-XY70', 'xy7-1', 'bw4-72']
+
+
+@pytest.fixture
+def corpus(loaded_cards):
+    return CardCorpus(loaded_cards)
+
+
+def _ids(cards):
+    return [card['id'] for card in cards]
+
+
+def test_query_ids_with_criteria(corpus):
+    assert _ids(corpus.query(ids=IDS)) == [
+        'sm1-60', 'xy7-2', 'xyp-XY70', 'xy7-1', 'bw4-72']
+    assert _ids(corpus.query(ids=IDS, formats=['standard'],
+                             supertype='Pokémon')) == ['sm1-60', 'xyp-XY70']
+    assert _ids(corpus.query(ids=IDS, set='xy7', ability=True)) == ['xy7-1']
+    assert corpus.query(ids=IDS, name='Switch', fields=['name']) == [
+        {'name': 'Switch'}]
+    assert _ids(corpus.query(ids=IDS, season='2017',
+                             formats=['expanded', 'standard'])) == [
+        'sm1-60', 'xy7-2', 'xyp-XY70', 'xy7-1']
+
+
+def test_query_criteria(corpus):
+    assert _ids(corpus.query(formats=['standard'])) == [
+        'sm1-60', 'xyp-XY70']
+    assert _ids(corpus.query(set='xyp')) == ['xyp-XY40', 'xyp-XY70']
+    assert _ids(corpus.query(ability='Static')) == ['xy7-1']
+
+
+@pytest.mark.parametrize('query, expected', [
+    ({'search': 'flip', 'hp': [100, None]}, ['sm1-60']),
+    ({'search': 'damage', 'hp': [100, None]}, []),
+    ({'ids': ['bw4-72', 'sm1-60', 'xy7-1', 'xy7-1'], 'damage': [10, None]},
+     ['bw4-72', 'sm1-60', 'xy7-1']),
+    ({'fuzzyname': 'Garchomp', 'limit': 2, 'cost': [None, 3]},
+     ['xyp-XY70']),
+    ({'search': 'coin', 'damage': [10, None], 'supertype': 'Pokémon'},
+     ['sm1-60', 'xy7-1']),
+    ({'damage': [10, None], 'limit': 1}, ['xy7-1']),
+    ({'damage': [10, None], 'formats': ['standard'], 'limit': 1},
+     ['sm1-60']),
+])
+def test_query_combined(corpus, query, expected):
+    # the same answers as querycard's test_main_combined
+    assert _ids(corpus.query(**query)) == expected
+
+
+class _Source(object):
+    """ card source of a CardServer, see cardserver.TableSource """
+
+    def __init__(self, cards):
+        self.cards = cards
+
+    def version(self):
+        return 1
+
+    def load(self):
+        return self.cards
+
+
+@pytest.fixture
+def server(loaded_cards):
+    server = CardServer(('127.0.0.1', 0), _Source(loaded_cards))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_server_query(server):
+    assert _ids(query_server(server, {'set': 'xyp'})) == [
+        'xyp-XY40', 'xyp-XY70']
+
+
+@pytest.mark.parametrize('query', [
+    {'damage': [10, 20, 30]}, {'hp': '60:'}, {'search': 'flip', 'limit': 'a'}])
+def test_server_bad_query(server, query):
+    with pytest.raises(ValueError, match='Bad query'):
+        query_server(server, query)
+
+
+@pytest.mark.parametrize('query', [[1], None, 3, 'xy7-1'])
+def test_server_query_not_object(server, query):
+    with pytest.raises(ValueError, match='must be a JSON object'):
+        query_server(server, query)
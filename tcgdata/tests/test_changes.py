@@ -0,0 +1,54 @@
+''' The change journal reports the same edits as DeepDiff '''
+from copy import deepcopy
+
+from deepdiff import DeepDiff
+import tcgdata.changes as changes
+import tcgdata.loadcards as loadcards
+from tests.conftest import card_filters
+
+
+def test_journal_matches_deepdiff(sample_cards, formats, tcgdata):
+    filters = card_filters(formats)
+    tcgdata['reprintgroups'] = loadcards.reprint_groups(
+        [{'Garchomp': ['xyp-XY70', 'sm1-99']}], tcgdata['legality'])
+    for item in sample_cards:
+        orig = deepcopy(item)
+        journal = changes.ChangeJournal()
+        for filter in filters:
+            filter(item=item, tcgdata=tcgdata, journal=journal)
+        assert journal.diff() == DeepDiff(
+            orig, item, verbose_level=2).to_dict()
+
+
+def test_journal_matches_deepdiff_on_lists():
+    cases = [
+        (['a', '', 'b', ''], ['a', 'b']),
+        (['', 'a'], ['a']),
+        (['Water', 'Fire', 'Colorless'], ['Water', 'Fire', 'Colorless']),
+        (['Colorless', 'Fire', 'Water'], ['Water', 'Fire', 'Colorless']),
+        (['Colorless', 'Colorless', 'Fire'], ['Fire', 'Colorless',
+                                              'Colorless']),
+        ([], ['Free']),
+    ]
+    for old, new in cases:
+        journal = changes.ChangeJournal()
+        journal.record_list("['cost']", old, new)
+        assert journal.diff() == DeepDiff({'cost': old}, {'cost': new},
+                                          verbose_level=2).to_dict()
+
+
+def test_repeated_edits_keep_net_change():
+    journal = changes.ChangeJournal()
+    journal.record("['hp']", '60', '70')
+    journal.record("['hp']", '70', '60')
+    journal.record("['abbr']", changes.MISSING, 'aor')
+    journal.record("['abbr']", 'aor', changes.MISSING)
+    journal.record("['set']", 'Ancient Origins', 'XY - Ancient Origins')
+    journal.record("['number']", '1', 1)
+    assert journal.diff('xy7-1') == {
+        'values_changed': {"xy7-1['set']": {
+            'old_value': 'Ancient Origins',
+            'new_value': 'XY - Ancient Origins'}},
+        'type_changes': {"xy7-1['number']": {
+            'old_type': str, 'new_type': int, 'old_value': '1',
+            'new_value': 1}}}
@@ -0,0 +1,172 @@
+''' dbtools batch reads and writes and parallel scans against moto '''
+import pytest
+import tcgdata.dbtools as dbtools
+from tests.conftest import CARD_KEY_SCHEMA, make_cards
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """ record the backoffs rather than sleeping """
+    calls = []
+    monkeypatch.setattr(dbtools, 'backoff', calls.append)
+    return calls
+
+
+def _ids(items):
+    return sorted(item['id'] for item in items)
+
+
+def test_batch_write_items_batches_of_25(cardtable, monkeypatch):
+    client = cardtable.meta.client
+    real = client.batch_write_item
+    sizes = []
+
+    def batch_write_item(**kwargs):
+        sizes.append(len(kwargs['RequestItems'][cardtable.name]))
+        return real(**kwargs)
+    monkeypatch.setattr(client, 'batch_write_item', batch_write_item)
+
+    cards = make_cards(60)
+    assert dbtools.batch_write_items(cardtable, iter(cards),
+                                     CARD_KEY_SCHEMA, workers=2) == 60
+    assert sorted(sizes) == [10, 25, 25]
+    assert _ids(dbtools.scan_items(cardtable)) == _ids(cards)
+
+
+def test_batch_write_items_splits_duplicate_keys(cardtable, monkeypatch):
+    client = cardtable.meta.client
+    real = client.batch_write_item
+    sizes = []
+
+    def batch_write_item(**kwargs):
+        sizes.append(len(kwargs['RequestItems'][cardtable.name]))
+        return real(**kwargs)
+    monkeypatch.setattr(client, 'batch_write_item', batch_write_item)
+
+    cards = make_cards(3)
+    updated = dict(cards[1], name='Updated')
+    # One worker, so the batches are written in order
+    dbtools.batch_write_items(cardtable, cards + [updated], CARD_KEY_SCHEMA,
+                              workers=1)
+    assert sizes == [3, 1]
+    assert dbtools.get_item(cardtable, dbtools.card_key(updated['id']))[
+        'name'] == 'Updated'
+
+
+def test_batch_write_items_retries_unprocessed(cardtable, monkeypatch,
+                                               backoffs):
+    client = cardtable.meta.client
+    real = client.batch_write_item
+    calls = []
+
+    def batch_write_item(**kwargs):
+        # Only write the first 10 items of the first request
+        calls.append(kwargs)
+        requests = kwargs['RequestItems'][cardtable.name]
+        if len(calls) > 1:
+            return real(**kwargs)
+        real(RequestItems={cardtable.name: requests[:10]})
+        return {'UnprocessedItems': {cardtable.name: requests[10:]}}
+    monkeypatch.setattr(client, 'batch_write_item', batch_write_item)
+
+    cards = make_cards(25)
+    dbtools.batch_write_items(cardtable, cards, CARD_KEY_SCHEMA, workers=1)
+    assert len(calls) == 2
+    assert len(calls[1]['RequestItems'][cardtable.name]) == 15
+    assert backoffs == [0]
+    assert _ids(dbtools.scan_items(cardtable)) == _ids(cards)
+
+
+def test_batch_write_items_gives_up(cardtable, monkeypatch, backoffs):
+    client = cardtable.meta.client
+
+    def batch_write_item(**kwargs):
+        return {'UnprocessedItems': kwargs['RequestItems']}
+    monkeypatch.setattr(client, 'batch_write_item', batch_write_item)
+
+    with pytest.raises(Exception, match='Gave up writing batch'):
+        dbtools.batch_write_items(cardtable, make_cards(5), CARD_KEY_SCHEMA,
+                                  max_retries=3)
+    assert backoffs == [0, 1, 2]
+
+
+def test_batch_write_items_delete(cardtable):
+    cards = make_cards(30)
+    dbtools.batch_write_items(cardtable, cards, CARD_KEY_SCHEMA)
+    keys = [dbtools.card_key(card['id']) for card in cards[:27]]
+    assert dbtools.batch_write_items(cardtable, keys, CARD_KEY_SCHEMA,
+                                     delete=True) == 27
+    assert _ids(dbtools.scan_items(cardtable)) == _ids(cards[27:])
+
+
+def test_batch_get_items_batches_of_100(cardtable, monkeypatch):
+    cards = make_cards(250)
+    dbtools.batch_write_items(cardtable, cards, CARD_KEY_SCHEMA)
+    client = cardtable.meta.client
+    real = client.batch_get_item
+    sizes = []
+
+    def batch_get_item(**kwargs):
+        sizes.append(len(kwargs['RequestItems'][cardtable.name]['Keys']))
+        return real(**kwargs)
+    monkeypatch.setattr(client, 'batch_get_item', batch_get_item)
+
+    keys = [dbtools.card_key(card['id']) for card in cards]
+    # Duplicate and missing keys
+    keys = keys + keys[:5] + [{'set_code': 'xy0', 'number': '9999'}]
+    items = dbtools.batch_get_items(cardtable, keys)
+    assert sizes == [100, 100, 51]
+    assert _ids(items) == _ids(cards)
+
+
+def test_batch_get_items_retries_unprocessed_keys(cardtable, monkeypatch,
+                                                  backoffs):
+    cards = make_cards(40)
+    dbtools.batch_write_items(cardtable, cards, CARD_KEY_SCHEMA)
+    client = cardtable.meta.client
+    real = client.batch_get_item
+    calls = []
+
+    def batch_get_item(**kwargs):
+        # Leave the last 15 keys of the first request unprocessed
+        calls.append(kwargs)
+        request = kwargs['RequestItems'][cardtable.name]
+        if len(calls) > 1:
+            return real(**kwargs)
+        response = real(RequestItems={cardtable.name: dict(
+            request, Keys=request['Keys'][:-15])})
+        response['UnprocessedKeys'] = {cardtable.name: dict(
+            request, Keys=request['Keys'][-15:])}
+        return response
+    monkeypatch.setattr(client, 'batch_get_item', batch_get_item)
+
+    items = dbtools.batch_get_items(
+        cardtable, [dbtools.card_key(card['id']) for card in cards],
+        **dbtools.projection(['id', 'name']))
+    assert len(calls) == 2
+    assert len(calls[1]['RequestItems'][cardtable.name]['Keys']) == 15
+    assert backoffs == [0]
+    assert _ids(items) == _ids(cards)
+    assert all(set(item) == {'id', 'name'} for item in items)
+
+
+@pytest.mark.parametrize('segments', [1, 4])
+def test_scan_items_segments(cardtable, segments):
+    cards = make_cards(300)
+    dbtools.batch_write_items(cardtable, cards, CARD_KEY_SCHEMA)
+    items = dbtools.scan_items(cardtable, segments=segments, plain=True)
+    assert _ids(items) == _ids(cards)
+    # Merged in segment order, so the order is repeatable
+    assert items == dbtools.scan_items(cardtable, segments=segments,
+                                       plain=True)
+
+
+def test_scan_pages_segments_with_filter(cardtable):
+    from boto3.dynamodb.conditions import Attr
+    cards = make_cards(120)
+    dbtools.batch_write_items(cardtable, cards, CARD_KEY_SCHEMA)
+    items = []
+    for page in dbtools.scan_pages(cardtable, segments=3, plain=True,
+                                   FilterExpression=Attr('hp').eq('0')):
+        items.extend(page)
+    assert _ids(items) == _ids(card for card in cards if card['hp'] == '0')
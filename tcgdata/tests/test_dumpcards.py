@@ -0,0 +1,30 @@
+''' dumpcards writes table items back in the card file format '''
+import logging
+
+import tcgdata.dumpcards as dumpcards
+
+
+def test_filecard_drops_unknown_nested_keys(formats, caplog):
+    item = {'id': 'xy7-1', 'name': 'Pikachu', 'set_code': 'xy7',
+            'national_pokedex_number': 25, '2018_standard': False,
+            'reprints': ['xy7-1'],
+            'ability': {'type': 'Ability', 'name': 'Static', 'text': 'a',
+                        'errata': 'b'},
+            'attacks': [{'text': 'c', 'name': 'Shock', 'damage': '20+',
+                         'damageBase': 20, 'damageModifier': '+'},
+                        {'name': 'Tackle', 'cost': ['Free'],
+                         'effect': 'd'}]}
+    with caplog.at_level(logging.WARNING, logger='tcgdata.dumpcards'):
+        card = dumpcards.filecard(item, formats['keyorder'])
+    assert card == {
+        'id': 'xy7-1', 'name': 'Pikachu',
+        'ability': {'name': 'Static', 'text': 'a', 'type': 'Ability'},
+        'setCode': 'xy7',
+        'attacks': [{'name': 'Shock', 'damage': '20+', 'text': 'c'},
+                    {'name': 'Tackle', 'cost': ['Free']}],
+        'nationalPokedexNumber': 25}
+    assert list(card) == ['id', 'name', 'ability', 'setCode', 'attacks',
+                          'nationalPokedexNumber']
+    assert [record.getMessage() for record in caplog.records] == [
+        'Dropping errata from .ability of xy7-1, not in keyorder',
+        'Dropping effect from .attacks of xy7-1, not in keyorder']
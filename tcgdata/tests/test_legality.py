@@ -0,0 +1,94 @@
+''' LegalityIndex gives the same flags as the per season loop it replaced '''
+import pytest
+from tcgdata.legality import LegalityIndex
+
+
+def old_card_legality(item, tcg_seasons):
+    """ update_card_legality as it was before LegalityIndex """
+    for season in tcg_seasons:
+        item[season + '_standard'] = False
+        item[season + '_expanded'] = False
+        standard_banned = expanded_banned = False
+        if item['id'] in tcg_seasons[season]['banned_standard_cards']:
+            standard_banned = True
+        if item['id'] in tcg_seasons[season]['banned_expanded_cards']:
+            expanded_banned = True
+        if (item['set_code'] in tcg_seasons[season]['standard_legal_sets'] and
+                not standard_banned):
+            item[season + '_standard'] = True
+        if (item['set_code'] in tcg_seasons[season]['expanded_legal_sets'] and
+                not expanded_banned):
+            item[season + '_expanded'] = True
+        for split_set in tcg_seasons[season]['standard_legal_split_sets']:
+            if item['set_code'] == split_set['set'] and not standard_banned:
+                if 'number_prefix' in split_set:
+                    if item['number'].startswith(split_set['number_prefix']):
+                        cardnum = int(item['number'].strip(
+                            split_set['number_prefix']))
+                        if cardnum >= split_set['min']:
+                            item[season + '_standard'] = True
+                    else:
+                        raise ValueError
+                else:
+                    if int(item['number']) >= split_set['min']:
+                        item[season + '_standard'] = True
+    return item
+
+
+def _cards(seasons):
+    """ a card from every set, and the edges of the split sets, named in
+    seasons
+    """
+    setcodes = set(['base1', 'nosuchset'])
+    splitsets = set()
+    cardids = set()
+    for season in seasons.values():
+        setcodes.update(season['standard_legal_sets'])
+        setcodes.update(season['expanded_legal_sets'])
+        cardids.update(season['banned_standard_cards'])
+        cardids.update(season['banned_expanded_cards'])
+        for split_set in season['standard_legal_split_sets']:
+            splitsets.add(split_set['set'])
+            prefix = split_set.get('number_prefix', '')
+            for number in (1, split_set['min'] - 1, split_set['min'], 200):
+                cardids.add('{}-{}{}'.format(split_set['set'], prefix,
+                                             number))
+    # split set numbers without the prefix are an error, tested below
+    cardids.update('{}-1'.format(setcode) for setcode in setcodes
+                   if setcode not in splitsets)
+    return [{'id': cardid, 'set_code': cardid.rsplit('-', 1)[0],
+             'number': cardid.rsplit('-', 1)[1]} for cardid in cardids]
+
+
+def test_formats_legality_matches_old_loop(formats):
+    seasons = formats['seasons']
+    index = LegalityIndex(seasons)
+    cards = _cards(seasons)
+    assert len(cards) > 50
+    for card in cards:
+        expected = old_card_legality(dict(card), seasons)
+        assert dict(card, **index.card_legality(card)) == expected
+
+
+def test_banned_and_split_sets():
+    seasons = {
+        '2019': {'standard_legal_sets': ['sm1', 'sm2'],
+                 'expanded_legal_sets': ['bw1', 'sm1', 'sm2', 'smp'],
+                 'standard_legal_split_sets': [
+                     {'set': 'smp', 'number_prefix': 'SM', 'min': 94},
+                     {'set': 'bw1', 'min': 50}],
+                 'banned_standard_cards': ['sm2-10', 'smp-SM100'],
+                 'banned_expanded_cards': ['sm1-5', 'bw1-60']}}
+    index = LegalityIndex(seasons)
+    for cardid in ['sm1-5', 'sm2-10', 'sm2-11', 'smp-SM93', 'smp-SM94',
+                   'smp-SM100', 'bw1-49', 'bw1-50', 'bw1-60', 'xy1-1']:
+        card = {'id': cardid, 'set_code': cardid.split('-')[0],
+                'number': cardid.split('-')[1]}
+        expected = old_card_legality(dict(card), seasons)
+        assert dict(card, **index.card_legality(card)) == expected
+    assert index.is_legal('smp', 'SM94', 'smp-SM94', '2019', 'standard')
+    assert not index.is_legal('sm2', '10', 'sm2-10', '2019', 'standard')
+    assert index.is_legal('sm2', '10', 'sm2-10', '2019', 'expanded')
+    with pytest.raises(ValueError):
+        index.card_legality({'id': 'smp-1', 'set_code': 'smp',
+                             'number': '1'})
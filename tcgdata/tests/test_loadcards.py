@@ -0,0 +1,183 @@
+''' loadcards file reading and table maintenance, with moto's DynamoDB '''
+import json
+from copy import deepcopy
+
+import pytest
+from boto3.dynamodb.conditions import Key
+import tcgdata.dbtools as dbtools
+import tcgdata.loadcards as loadcards
+from tests.conftest import CARD_KEY_SCHEMA, card_filters
+
+SEASONS = {'2017': {}, '2018': {}}
+
+
+def _legal_cards(count):
+    """ cards legal in 2018 standard if their number is even, loaded before
+    there were legality index attributes
+    """
+    return [{'set_code': 'sm1', 'number': str(i), 'id': 'sm1-{}'.format(i),
+             'name': 'Card {}'.format(i),
+             'supertype': ['Pokémon', 'Trainer', 'Energy'][i % 3],
+             '2017_standard': True, '2017_expanded': True,
+             '2018_standard': i % 2 == 0, '2018_expanded': True}
+            for i in range(count)]
+
+
+def test_ensure_indexes_backfills(dynamodb, capsys):
+    oldindexes, attributes = dbtools.card_indexes(['2016', '2017'])
+    table = dynamodb.create_table(
+        TableName='tcg_cards', KeySchema=CARD_KEY_SCHEMA,
+        AttributeDefinitions=[
+            {'AttributeName': 'set_code', 'AttributeType': 'S'},
+            {'AttributeName': 'number', 'AttributeType': 'S'}] + attributes,
+        GlobalSecondaryIndexes=oldindexes, BillingMode='PAY_PER_REQUEST')
+    cards = _legal_cards(60)
+    # a card already right, and one with an index attribute of a season
+    # which is no longer indexed
+    dbtools.update_legality_index(cards[0], SEASONS)
+    cards[1]['2017_standard_idx'] = 'Trainer'
+    dbtools.batch_write_items(table, cards, CARD_KEY_SCHEMA)
+
+    indexes, attributes = dbtools.card_indexes(SEASONS)
+    loadcards.ensure_indexes(table, indexes, attributes, SEASONS,
+                             CARD_KEY_SCHEMA, workers=1)
+    assert 'legality index attributes of 59 cards' in capsys.readouterr().out
+
+    table.reload()
+    assert sorted(index['IndexName']
+                  for index in table.global_secondary_indexes) == [
+        '2018_expanded-index', '2018_standard-index', 'name-index',
+        'supertype-index']
+    legal = []
+    for supertype in dbtools.SUPERTYPES:
+        legal.extend(table.query(
+            IndexName='2018_standard-index',
+            KeyConditionExpression=Key('2018_standard_idx').eq(
+                supertype))['Items'])
+    assert sorted(item['id'] for item in legal) == sorted(
+        card['id'] for card in cards if card['2018_standard'])
+    items = dbtools.scan_items(table)
+    assert not [item for item in items if '2017_standard_idx' in item]
+    assert len(items) == 60
+
+
+ARRAY = [
+    {'id': 'xy7-1', 'name': 'Pokémon Catcher ×2', 'hp': 120,
+     'text': ['a ] and a , in a string', ''], 'nested': [[1, 2], [], [3]]},
+    12345678901234567890, 1.5, -7, 'é' * 50, None, True, [], {},
+]
+
+
+@pytest.mark.parametrize('chunksize', [1, 3, 7, 65536])
+def test_iter_json_array(tmp_path, chunksize):
+    path = tmp_path / 'cards.json'
+    for text in [json.dumps(ARRAY, ensure_ascii=False),
+                 json.dumps(ARRAY, indent=4), '\n [ ] \n', '[1]']:
+        path.write_text(text, encoding='utf-8')
+        with open(path, 'rb') as json_file:
+            assert list(loadcards.iter_json_array(
+                json_file, chunksize=chunksize)) == json.loads(text)
+
+
+@pytest.mark.parametrize('text', [
+    '{"id": "xy7-1"}', '', '   ', '"cards"', '[{"id": "xy7-1"}, {"id": ',
+    '[{"id": "xy7-1"}, 12', '[{"id": "xy7-1"}'])
+def test_iter_json_array_errors(tmp_path, text):
+    path = tmp_path / 'cards.json'
+    path.write_text(text)
+    with open(path, 'rb') as json_file:
+        with pytest.raises(ValueError, match='cards.json'):
+            list(loadcards.iter_json_array(json_file, chunksize=4))
+
+
+def _reprint_cards(sample_cards):
+    """ the sample cards and a reprint of Switch, legal in 2018 standard
+    while the original isn't
+    """
+    switch = deepcopy(sample_cards[1])
+    switch.update({'id': 'sm1-132', 'set_code': 'sm1', 'number': '132'})
+    return sample_cards + [switch]
+
+
+def _load(table, path, cards, formats, tcgdata, reprints, sync):
+    """ write cards to path and load them into table, return what was
+    printed
+    """
+    with open(path, 'w') as json_file:
+        json.dump(cards, json_file)
+    tcgdata['reprintgroups'] = loadcards.reprint_groups(
+        reprints, tcgdata['legality'])
+    tcgdata['reprintcards'] = set()
+    loadcards.populate_table(table, str(path), CARD_KEY_SCHEMA,
+                             filters=card_filters(formats),
+                             tcgdata=tcgdata, workers=2, sync=sync)
+
+
+def _table_cards(table):
+    return {item['id']: item for item in dbtools.scan_items(table)}
+
+
+def test_sync_converges(cardtable, dynamodb, tmp_path, sample_cards,
+                        formats, tcgdata, capsys):
+    cards = _reprint_cards(sample_cards)
+    reprints = [{'Switch': ['xy7-2', 'sm1-132']}]
+    path = tmp_path / 'cards.json'
+    _load(cardtable, path, cards, formats, tcgdata, reprints, False)
+    assert 'Loaded 7 items' in capsys.readouterr().out
+    switch = _table_cards(cardtable)['xy7-2']
+    assert switch['reprints'] == ['xy7-2', 'sm1-132']
+    assert switch['2018_standard'] is True
+    assert switch['2018_standard_idx'] == 'Trainer'
+
+    _load(cardtable, path, cards, formats, tcgdata, reprints, True)
+    assert '0 written, 0 deleted, 7 unchanged' in capsys.readouterr().out
+
+    # The reprint group is gone and a card is no longer in the file
+    _load(cardtable, path, cards[1:], formats, tcgdata, [], True)
+    assert '2 written, 1 deleted, 4 unchanged' in capsys.readouterr().out
+    synced = _table_cards(cardtable)
+    switch = synced['xy7-2']
+    assert 'reprints' not in switch
+    assert switch['2018_standard'] is False
+    assert '2018_standard_idx' not in switch
+    assert 'xy7-1' not in synced
+
+    # the same as loading from scratch
+    reloaded = dynamodb.create_table(
+        TableName='reloaded', KeySchema=CARD_KEY_SCHEMA,
+        AttributeDefinitions=[
+            {'AttributeName': 'set_code', 'AttributeType': 'S'},
+            {'AttributeName': 'number', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST')
+    _load(reloaded, path, cards[1:], formats, tcgdata, [], False)
+    assert _table_cards(reloaded) == synced
+
+
+def test_postprocess_resets_reprints(cardtable, tmp_path, sample_cards,
+                                     formats, tcgdata, capsys):
+    cards = _reprint_cards(sample_cards)
+    path = tmp_path / 'cards.json'
+    _load(cardtable, path, cards, formats, tcgdata,
+          [{'Switch': ['xy7-2', 'sm1-132']}], False)
+    loaded = _table_cards(cardtable)
+
+    tcgdata['reprintgroups'] = loadcards.reprint_groups(
+        [{'Switch': ['sm1-132', 'xy7-2', 'xy7-99']}], tcgdata['legality'])
+    loadcards.update_reprints_and_legality(cardtable, tcgdata,
+                                           CARD_KEY_SCHEMA)
+    assert 'Error finding card xy7-99 (Switch)' in capsys.readouterr().out
+    updated = _table_cards(cardtable)
+    assert updated['xy7-2']['reprints'] == ['sm1-132', 'xy7-2', 'xy7-99']
+
+    tcgdata['reprintgroups'] = {}
+    loadcards.update_reprints_and_legality(cardtable, tcgdata,
+                                           CARD_KEY_SCHEMA)
+    updated = _table_cards(cardtable)
+    assert 'reprints' not in updated['xy7-2']
+    assert updated['xy7-2']['2018_standard'] is False
+    del loaded['xy7-2']['reprints'], loaded['sm1-132']['reprints']
+    loaded['xy7-2'].update(tcgdata['legality'].card_legality(loaded['xy7-2']))
+    dbtools.update_legality_index(loaded['xy7-2'], tcgdata['seasons'])
+    for item in loaded.values():
+        item[dbtools.CONTENT_HASH] = dbtools.content_hash(item)
+    assert updated == loaded
@@ -0,0 +1,113 @@
+''' NameIndex lookup, reprint candidates and its index file '''
+import json
+import random
+
+import pytest
+from fuzzywuzzy import fuzz
+import tcgdata.indexfile as indexfile
+from tcgdata.nameindex import CANDIDATE_RATIO, NameIndex, normalize
+
+BASES = ['Pikachu', 'Raichu', 'Charizard', 'Garchomp', 'Machop', 'Machamp',
+         'Mew', 'Mewtwo', 'Eevee', 'Flabébé', 'Farfetch’d', 'Nidoran ♀',
+         'Mr. Mime', 'Porygon-Z', 'Ho-Oh', 'Gardevoir', 'Gallade', 'Snorlax',
+         'Professor Sycamore', 'Energy Switch', 'Switch', 'Ultra Ball']
+PREFIXES = ['', 'Dark ', 'M ', "Team Rocket's "]
+SUFFIXES = ['', '-EX', ' GX', ' BREAK', ' δ', ' LV.X', ' ◇']
+
+
+def _names(count, seed=1):
+    """ count card names like the real ones, some with a misprint """
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        name = list(rng.choice(PREFIXES) + rng.choice(BASES) +
+                    rng.choice(SUFFIXES))
+        if rng.random() < 0.3:
+            position = rng.randrange(len(name))
+            edit = rng.choice(['replace', 'delete', 'insert'])
+            character = rng.choice('abcdehmnoprt -')
+            if edit == 'replace':
+                name[position] = character
+            elif edit == 'delete':
+                del name[position]
+            else:
+                name.insert(position, character)
+        names.add(''.join(name))
+    return sorted(names)
+
+
+@pytest.fixture
+def index(sample_cards):
+    index = NameIndex()
+    for card in sample_cards:
+        index.add(card)
+    index.add({'id': 'xy1-1', 'name': 'Garchomp-EX'})
+    index.add({'id': 'xy1-2', 'name': 'Garchomp-EX'})
+    return index
+
+
+def test_normalize():
+    assert normalize('Sceptile-EX') == 'sceptile ex'
+    assert normalize('Farfetch’d') == 'farfetchd'
+    assert normalize('  Flabébé  δ') == 'flabebe'
+
+
+def test_lookup(index):
+    results = index.lookup('garchomp')
+    assert [name for name, score, cardids in results] == [
+        'Garchomp', 'Garchomp-EX']
+    assert results[0][1] == 1
+    assert results[1][2] == ['xy1-1', 'xy1-2']
+    assert index.lookup('Garchmp', 1)[0][0] == 'Garchomp'
+    assert index.lookup('xyz') == []
+
+
+def test_candidates_keep_fuzz_ratio_matches():
+    # Every name find_reprints_local would accept, including names trigrams
+    # rate far apart
+    names = _names(150) + ['M Garchomp δ', 'Machop δ', 'Alolanm Machop-EX',
+                           'Aol-an Garchomp-EX']
+    index = NameIndex({name: [str(number)]
+                       for number, name in enumerate(names)})
+    compared = 0
+    for number, name in enumerate(names):
+        candidates = index.candidates(name)
+        expected = set(str(other) for other, othername in enumerate(names)
+                       if fuzz.ratio(name, othername) >= CANDIDATE_RATIO)
+        assert expected <= candidates, name
+        compared += len(candidates)
+    # and still leaves most pairs out
+    assert compared < len(names) ** 2 / 10
+
+
+def test_candidates_rounding():
+    index = NameIndex({'abcdefghij': ['1']})
+    # 2 * 8 / 20 is a ratio of 80, 2 * 7 / 19 is 74
+    assert fuzz.ratio('abcdefghXY', 'abcdefghij') == 80
+    assert index.candidates('abcdefghXY') == {'1'}
+    assert index.candidates('abcdefgXY') == set()
+
+
+def test_save_load(index, tmp_path):
+    path = str(tmp_path / 'nameindex.json')
+    index.save(path)
+    loaded = NameIndex.load(path)
+    assert loaded.names == index.names
+    assert loaded.lookup('Flare Grunt') == index.lookup('Flare Grunt')
+    assert loaded.candidates('Pikachu') == index.candidates('Pikachu')
+
+
+def test_load_unusable(tmp_path):
+    assert NameIndex.load(str(tmp_path / 'missing.json')) is None
+    path = tmp_path / 'nameindex.json'
+    path.write_text(json.dumps({'version': 0, 'names': {}}))
+    assert NameIndex.load(str(path)) is None
+
+
+def test_index_file_abstract():
+    class Incomplete(indexfile.IndexFile):
+        def add(self, card):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,79 @@
+''' querycard reads from moto's DynamoDB '''
+import json
+import sys
+
+import pytest
+from boto3.dynamodb.conditions import Attr
+import tcgdata.dbtools as dbtools
+import tcgdata.querycard as querycard
+from tcgdata.attackindex import AttackIndex
+from tcgdata.nameindex import NameIndex
+from tcgdata.textindex import TextIndex
+from tests.conftest import CARD_KEY_SCHEMA
+
+IDS = ['sm1-60', 'xy7-2', 'nosuch-1', 'xyp-XY70', 'xy7-1', 'bw4-72']
+
+
+def test_get_cards_filtered(cardtable, loaded_cards):
+    dbtools.batch_write_items(cardtable, loaded_cards, CARD_KEY_SCHEMA)
+    cards = querycard.get_cards(cardtable, IDS)
+    assert [card['id'] for card in cards] == [
+        'sm1-60', 'xy7-2', 'xyp-XY70', 'xy7-1', 'bw4-72']
+    assert querycard.get_cards(cardtable, IDS, ['name', 'hp']) == [
+        {'name': 'Snorlax', 'hp': '150'}, {'name': 'Switch'},
+        {'name': 'Garchomp', 'hp': '150'}, {'name': 'Pikachu', 'hp': '60'},
+        {'name': 'Charizard', 'hp': '120'}]
+
+    # --standard --season 2018 --supertype Pokémon
+    filter = querycard._criteria_filter({'supertype': 'Pokémon'}, '2018',
+                                        ['standard'])
+    assert querycard.get_cards(cardtable, IDS, ['name'], filter) == [
+        {'name': 'Snorlax'}, {'name': 'Garchomp'}]
+    # --set xy7 --ability
+    filter = Attr('ability').exists() & Attr('set_code').eq('xy7')
+    assert [card['id'] for card in querycard.get_cards(
+        cardtable, IDS, ['id', 'ability.name'], filter)] == ['xy7-1']
+
+
+@pytest.fixture
+def indexes(loaded_cards, tmp_path):
+    """ querycard arguments for text, name and attack indexes of the
+    cards
+    """
+    args = []
+    for option, index in [('--textindex', TextIndex()),
+                          ('--nameindex', NameIndex()),
+                          ('--attackindex', AttackIndex())]:
+        for card in loaded_cards:
+            index.add(card)
+        path = str(tmp_path / '{}.json'.format(option[2:]))
+        index.save(path)
+        args.extend([option, path])
+    return args
+
+
+def _main(monkeypatch, capsys, *args):
+    """ ids of the cards querycard prints """
+    monkeypatch.setattr(sys, 'argv', ['querycards', '--nocache'] + list(args))
+    querycard.main()
+    return [card['id'] for card in json.loads(capsys.readouterr().out)]
+
+
+@pytest.mark.parametrize('args, expected', [
+    # in the order of the search, only the cards with the HP
+    (['--search', 'flip', '--hp', '100:'], ['sm1-60']),
+    (['--search', 'damage', '--hp', '100:'], []),
+    (['--id', 'bw4-72', 'sm1-60', 'xy7-1', 'xy7-1', '--damage', '10:'],
+     ['bw4-72', 'sm1-60', 'xy7-1']),
+    (['--fuzzyname', 'Garchomp', '--limit', '2', '--cost', ':3'],
+     ['xyp-XY70']),
+    (['--search', 'coin', '--damage', '10:', '--supertype', 'Pokémon'],
+     ['sm1-60', 'xy7-1']),
+    # the limit is taken after the criteria
+    (['--damage', '10:', '--limit', '1'], ['xy7-1']),
+    (['--damage', '10:', '--standard', '--limit', '1'], ['sm1-60']),
+])
+def test_main_combined(cardtable, loaded_cards, indexes, monkeypatch, capsys,
+                       args, expected):
+    dbtools.batch_write_items(cardtable, loaded_cards, CARD_KEY_SCHEMA)
+    assert _main(monkeypatch, capsys, *(args + indexes)) == expected
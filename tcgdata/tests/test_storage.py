@@ -0,0 +1,136 @@
+''' The SQLite backend pages and projects as DynamoDB (moto) does '''
+import json
+
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+import tcgdata.dbtools as dbtools
+import tcgdata.storage as storage
+from tests.conftest import CARD_KEY_SCHEMA, make_cards
+
+SEASONS = {'2018': {}}
+
+
+def _create(database):
+    indexes, attributes = dbtools.card_indexes(SEASONS)
+    return database.create_table(
+        TableName='tcg_cards', KeySchema=CARD_KEY_SCHEMA,
+        AttributeDefinitions=[
+            {'AttributeName': 'set_code', 'AttributeType': 'S'},
+            {'AttributeName': 'number', 'AttributeType': 'S'}] + attributes,
+        GlobalSecondaryIndexes=indexes, BillingMode='PAY_PER_REQUEST')
+
+
+def _cards(count):
+    cards = make_cards(count)
+    for i, card in enumerate(cards):
+        card['supertype'] = dbtools.SUPERTYPES[i % 3]
+        card['2018_standard'] = i % 2 == 0
+        card['attacks'] = [{'name': 'Attack {}'.format(i), 'damage': '10',
+                            'cost': ['Fire'] * (i % 4)},
+                           {'name': 'Second', 'convertedEnergyCost': i}]
+        dbtools.update_legality_index(card, SEASONS)
+    return cards
+
+
+def _plain(items):
+    """ items with Decimals as int/float, as the SQLite backend returns """
+    return json.loads(json.dumps(items, default=storage._json_default))
+
+
+@pytest.fixture
+def tables(dynamodb, tmp_path):
+    """ (moto table, SQLite table) holding the same cards """
+    cards = _cards(50)
+    tables = (_create(dynamodb),
+              _create(storage.SQLiteDatabase(str(tmp_path / 'cards.db'))))
+    for table in tables:
+        dbtools.batch_write_items(table, cards, CARD_KEY_SCHEMA, workers=1)
+    return tables
+
+
+@pytest.mark.parametrize('segments', [1, 3])
+def test_scan_pages(tables, monkeypatch, segments):
+    monkeypatch.setattr(storage, 'PAGE_SIZE', 7)
+    dynamotable, sqlitetable = tables
+    pages = list(dbtools.scan_pages(sqlitetable, segments=segments))
+    assert max(len(page) for page in pages) == 7
+    assert len(pages) >= 50 // 7
+    items = [item for page in pages for item in page]
+    assert len(items) == 50
+    assert sorted(items, key=lambda item: item['id']) == sorted(
+        _plain(dbtools.scan_items(dynamotable)),
+        key=lambda item: item['id'])
+
+
+def test_filtered_query_pages(tables, monkeypatch):
+    monkeypatch.setattr(storage, 'PAGE_SIZE', 4)
+    query = {'IndexName': '2018_standard-index',
+             'KeyConditionExpression': Key('2018_standard_idx').eq(
+                 'Trainer') & Key('name').begins_with('Card 1'),
+             'FilterExpression': Attr('hp').ne('100')}
+    results = [_plain(dbtools.query_items(table, **query))
+               for table in tables]
+    assert results[0] == results[1]
+    assert [item['name'] for item in results[1]] == ['Card 16']
+    # Limit is the number of items read, before the filter
+    for table in tables:
+        response = table.query(Limit=1, **query)
+        assert (response['Count'], response['ScannedCount']) == (0, 1)
+        assert response['LastEvaluatedKey'] == {
+            'set_code': 'xy1', 'number': '10', '2018_standard_idx': 'Trainer',
+            'name': 'Card 10'}
+
+
+def test_query_descending(tables, monkeypatch):
+    monkeypatch.setattr(storage, 'PAGE_SIZE', 2)
+    query = {'IndexName': 'supertype-index', 'ScanIndexForward': False,
+             'KeyConditionExpression': Key('supertype').eq('Energy')}
+    results = [_plain(dbtools.query_items(table, **query))
+               for table in tables]
+    assert [item['name'] for item in results[1]] == sorted(
+        (card['name'] for card in _cards(50)
+         if card['supertype'] == 'Energy'), reverse=True)
+    assert [item['id'] for item in results[0]] == [
+        item['id'] for item in results[1]]
+
+
+@pytest.mark.parametrize('fields', [
+    ['id', 'name'],
+    ['number', 'nosuchfield', 'attacks'],
+])
+def test_projection(tables, fields):
+    key = {'set_code': 'xy1', 'number': '7'}
+    results = [_plain(table.get_item(Key=key, **dbtools.projection(fields))[
+        'Item']) for table in tables]
+    assert results[0] == results[1]
+    item = tables[1].get_item(Key=key)['Item']
+    assert storage.project(item, fields) == results[1]
+    results = [sorted(_plain(dbtools.batch_get_items(
+        table, [key, {'set_code': 'xy2', 'number': '8'}],
+        **dbtools.projection(fields))), key=json.dumps) for table in tables]
+    assert results[0] == results[1]
+    results = [sorted(_plain(dbtools.scan_items(
+        table, **dbtools.projection(fields))), key=json.dumps)
+        for table in tables]
+    assert results[0] == results[1]
+
+
+# moto doesn't accept placeholders followed by a list index
+@pytest.mark.parametrize('fields, projected', [
+    (['id', 'attacks[0].name', 'attacks[1].convertedEnergyCost'],
+     {'id': 'xy1-7', 'attacks': [{'name': 'Attack 7'},
+                                 {'convertedEnergyCost': 7}]}),
+    (['attacks[1]', 'number'],
+     {'number': '7', 'attacks': [{'name': 'Second',
+                                  'convertedEnergyCost': 7}]}),
+    (['attacks[0].cost[2]', 'attacks[5].name'],
+     {'attacks': [{'cost': ['Fire']}]}),
+    (['attacks[0].cost[3]', 'nosuchfield'], {}),
+])
+def test_list_projection(tables, fields, projected):
+    key = {'set_code': 'xy1', 'number': '7'}
+    sqlitetable = tables[1]
+    assert sqlitetable.get_item(Key=key, **dbtools.projection(fields))[
+        'Item'] == projected
+    assert storage.project(sqlitetable.get_item(Key=key)['Item'],
+                           fields) == projected
@@ -0,0 +1,85 @@
+''' TextIndex search and its index file '''
+import json
+import math
+
+import pytest
+from tcgdata.textindex import (BM25_B, BM25_K1, TextIndex, card_text,
+                               tokenize)
+
+
+def _bm25(cards, query):
+    """ BM25 scores of the cards containing every word of query, worked out
+    card by card
+    """
+    documents = {}
+    for card in cards:
+        counts = {}
+        for text, weight in card_text(card):
+            for token in tokenize(text or ''):
+                counts[token] = counts.get(token, 0) + weight
+        if counts:
+            documents[card['id']] = counts
+    average = sum(sum(counts.values()) for counts in documents.values()) / \
+        len(documents)
+    tokens = set(tokenize(query))
+    scores = {}
+    for cardid, counts in documents.items():
+        if not tokens or not tokens <= set(counts):
+            continue
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * sum(counts.values()) /
+                          average)
+        score = 0
+        for token in tokens:
+            matching = len([1 for other in documents.values()
+                            if token in other])
+            idf = math.log(1 + (len(documents) - matching + 0.5) /
+                           (matching + 0.5))
+            score = score + (idf * counts[token] * (BM25_K1 + 1) /
+                             (counts[token] + norm))
+        scores[cardid] = score
+    return sorted(scores.items(), key=lambda score: (-score[1], score[0]))
+
+
+@pytest.fixture
+def index(sample_cards):
+    index = TextIndex()
+    for card in sample_cards:
+        index.add(card)
+    return index
+
+
+def test_tokenize():
+    assert tokenize("Opponent's Pokémon can’t, 20× damage") == [
+        'opponents', 'pokemon', 'cant', '20', 'damage']
+
+
+@pytest.mark.parametrize('query', [
+    'flip a coin', 'pokemon', "opponent's active", 'damage', 'heads',
+    'Discard', 'no such words', '', 'card'])
+def test_search_matches_bm25(index, sample_cards, query):
+    results = index.search(query)
+    expected = _bm25(sample_cards, query)
+    assert [cardid for cardid, score in results] == [
+        cardid for cardid, score in expected]
+    assert [score for cardid, score in results] == pytest.approx(
+        [score for cardid, score in expected])
+    assert index.search(query, 2) == results[:2]
+
+
+def test_save_load(index, tmp_path):
+    path = str(tmp_path / 'textindex.json')
+    index.save(path)
+    loaded = TextIndex.load(path)
+    assert (loaded.ids, loaded.lengths, loaded.postings) == (
+        index.ids, index.lengths, index.postings)
+    assert loaded.search('flip a coin') == index.search('flip a coin')
+
+
+def test_load_unusable(tmp_path):
+    assert TextIndex.load(str(tmp_path / 'missing.json')) is None
+    path = tmp_path / 'textindex.json'
+    path.write_text('{"ids": ')
+    assert TextIndex.load(str(path)) is None
+    path.write_text(json.dumps({'version': 0, 'ids': [], 'lengths': [],
+                                'postings': {}}))
+    assert TextIndex.load(str(path)) is None